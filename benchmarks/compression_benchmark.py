@@ -0,0 +1,104 @@
+"""
+Compression benchmark: CPU cost against bandwidth and memory saved.
+
+Builds a synthetic script whose highlights point into this repository's own
+source files, then for every available codec reports compression and
+decompression time, throughput and size saved for the JSON response body,
+the Markdown export and the source blobs. Finally it stores the scripts in a
+ScriptStore and reports the at-rest memory with the configured codec.
+
+Usage:
+    python benchmarks/compression_benchmark.py [--scenes 2000] [--repeat 5]
+"""
+from pathlib import Path
+import argparse
+import asyncio
+import sys
+import time
+import tracemalloc
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from src.models.script import CodeHighlight, Scene, Script  # noqa: E402
+from src.services.compression import AT_REST_CODEC, CODECS  # noqa: E402
+from src.services.script_store import ScriptStore  # noqa: E402
+
+
+def build_script(scenes: int) -> Script:
+    files = [
+        {"path": str(p.relative_to(ROOT)), "content": p.read_text(encoding="utf-8")}
+        for p in sorted((ROOT / "src").rglob("*.py"))
+    ]
+    out = []
+    for i in range(scenes):
+        f = files[i % len(files)]
+        lines = f["content"].splitlines()
+        start = (i * 7) % max(1, len(lines) - 12) + 1
+        end = min(len(lines), start + 11)
+        explanation = f"Scene {i} walks through {f['path']} lines {start}-{end} and explains how they fit together. " * 3
+        out.append(Scene(
+            title=f"Scene {i}: {f['path']}",
+            duration=20,
+            content=explanation,
+            code_highlights=[CodeHighlight(
+                file_path=f["path"], start_line=start, end_line=end,
+                description=explanation, code="\n".join(lines[start - 1:end])
+            )]
+        ))
+    return Script(scenes=out).attach_sources(files)
+
+
+def measure(func, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def report(label: str, data: bytes, repeat: int) -> None:
+    print(f"\n{label}: {len(data) / 1024:.0f} KiB uncompressed")
+    print(f"  {'codec':<6} {'ratio':>7} {'saved KiB':>10} {'comp ms':>9} {'MB/s':>7} {'decomp ms':>10}")
+    for name, codec in CODECS.items():
+        packed = codec.compress(data)
+        comp = measure(lambda: codec.compress(data), repeat)
+        decomp = measure(lambda: codec.decompress(packed), repeat)
+        print(
+            f"  {name:<6} {len(data) / len(packed):>7.2f} {(len(data) - len(packed)) / 1024:>10.0f} "
+            f"{comp * 1000:>9.1f} {len(data) / comp / 1e6:>7.0f} {decomp * 1000:>10.1f}"
+        )
+
+
+async def store_memory(script: Script, copies: int) -> None:
+    store = ScriptStore()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for i in range(copies):
+        await store.put(str(i), script)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    grown = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    cached = sum(len(b) for b in store._bodies.values())
+    codec = AT_REST_CODEC.name if AT_REST_CODEC else "none"
+    print(f"\nScriptStore with {copies} copies (at-rest codec: {codec})")
+    print(f"  traced memory growth: {grown / 1024:.0f} KiB, cached bodies: {cached / 1024:.0f} KiB")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenes", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--copies", type=int, default=20)
+    args = parser.parse_args()
+
+    script = build_script(args.scenes)
+    report("JSON body (GET /api/scripts/{id})", script.model_dump_json().encode("utf-8"), args.repeat)
+    report("Markdown export", script.to_markdown().encode("utf-8"), args.repeat)
+    report("Source blobs", "".join(script.sources.values()).encode("utf-8"), args.repeat)
+    asyncio.run(store_memory(script, args.copies))
+
+
+if __name__ == "__main__":
+    main()
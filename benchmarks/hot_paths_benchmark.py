@@ -0,0 +1,253 @@
+"""
+Micro-benchmarks for the parsing, batching and rendering hot paths.
+
+Synthetic inputs stand in for large LLM responses, big repositories and
+huge scripts. Each case reports the median and best wall time over
+--repeat runs and the peak traced memory of one extra run. Results can be
+saved as a baseline; a later run compared against it exits non-zero when a
+case got slower or used more memory than the allowed threshold.
+
+Baselines are machine specific, so save and compare them on the same host.
+
+Usage:
+    python benchmarks/hot_paths_benchmark.py [--scale 1.0] [--repeat 5] [--only parse]
+    python benchmarks/hot_paths_benchmark.py --save-baseline
+    python benchmarks/hot_paths_benchmark.py --compare [--time-threshold 0.25] [--memory-threshold 0.25]
+"""
+from pathlib import Path
+from typing import Callable, Dict, List
+import argparse
+import json
+import logging
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from src.api.routes.script import parse_sample_script_md  # noqa: E402
+from src.models.script import CodeHighlight, Scene, Script  # noqa: E402
+from src.services.llm_service import LLMService  # noqa: E402
+from src.services.script_generator import count_tokens, plan_batches  # noqa: E402
+from src.services.tree_summary import summarize_tree  # noqa: E402
+
+DEFAULT_BASELINE = Path(__file__).resolve().parent / "baselines" / "hot_paths.json"
+WORDS = "the function reads each value and returns a new list so callers never see partial state".split()
+
+
+# Synthetic data ---------------------------------------------------------------
+
+def synthetic_repo(files: int, lines: int, seed: int = 1) -> List[Dict[str, str]]:
+    """Python-looking files with unique, realistic lines."""
+    rng = random.Random(seed)
+    repo = []
+    for i in range(files):
+        body = []
+        for j in range(lines):
+            if j % 12 == 0:
+                body.append(f"def handler_{i}_{j}(request, limit={rng.randint(1, 99)}):")
+            else:
+                body.append(f"    value_{j} = compute_{rng.randint(0, 999)}(request.items[{j % 7}], limit) + {rng.randint(0, 9999)}")
+        repo.append({"path": f"pkg/mod_{i // 20}/file_{i}.py", "content": "\n".join(body), "type": "file"})
+    return repo
+
+
+def sentence(rng: random.Random, words: int = 24) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def markdown_response(repo: List[Dict[str, str]], scenes: int, seed: int = 2) -> str:
+    """An LLM response in the Markdown scene format, with highlights quoting the repo."""
+    rng = random.Random(seed)
+    parts = []
+    for i in range(scenes):
+        f = repo[i % len(repo)]
+        lines = f["content"].splitlines()
+        start = rng.randint(1, max(1, len(lines) - 10))
+        end = start + 9
+        code = "\n".join(lines[start - 1:end])
+        parts.append(
+            f"## Scene {i + 1}: Understanding part {i} ({rng.randint(10, 40)}s)\n"
+            f"{sentence(rng)} {sentence(rng)}\n\n"
+            f"### Code Highlights\n**{f['path']}** (lines {start}-{end}):\n```python\n{code}\n```\n"
+            f"{sentence(rng)}\n\n---\n"
+        )
+    return "\n".join(parts)
+
+
+def json_response(repo: List[Dict[str, str]], chapters: int, scenes_per_chapter: int, seed: int = 3) -> Dict:
+    """A JSON-mode response whose scenes carry code but no line ranges, so lines must be located."""
+    rng = random.Random(seed)
+    out = []
+    for c in range(chapters):
+        chapter_files = [repo[(c * 3 + k) % len(repo)] for k in range(3)]
+        scenes = []
+        for s in range(scenes_per_chapter):
+            f = chapter_files[s % len(chapter_files)]
+            lines = f["content"].splitlines()
+            start = rng.randint(1, max(1, len(lines) - 8))
+            scenes.append({
+                "title": f"Scene {s + 1}",
+                "duration": 20,
+                "file_path": f["path"],
+                "code": "\n".join(lines[start - 1:start + 7]),
+                "explanation": sentence(rng, 40),
+            })
+        out.append({"title": f"Chapter {c + 1}", "files": [f["path"] for f in chapter_files], "scenes": scenes})
+    return {"chapters": out}
+
+
+def huge_script(repo: List[Dict[str, str]], scenes: int, seed: int = 4) -> Script:
+    rng = random.Random(seed)
+    out = []
+    for i in range(scenes):
+        f = repo[i % len(repo)]
+        lines = f["content"].splitlines()
+        start = rng.randint(1, max(1, len(lines) - 10))
+        out.append(Scene(
+            title=f"Scene {i + 1}: Part {i}",
+            duration=20,
+            content=f"{sentence(rng)} {sentence(rng)}",
+            code_highlights=[CodeHighlight(
+                file_path=f["path"], start_line=start, end_line=start + 9,
+                description=sentence(rng), code="\n".join(lines[start - 1:start + 9])
+            )]
+        ))
+    return Script(scenes=out)
+
+
+def repo_paths(count: int, seed: int = 5) -> List[str]:
+    """Monorepo-shaped paths: a few deep trees, many packages, mixed extensions."""
+    rng = random.Random(seed)
+    exts = [".py", ".py", ".ts", ".tsx", ".md", ".json", ".go"]
+    return [
+        "/".join(f"dir{rng.randint(0, 3 + depth * 4)}" for depth in range(rng.randint(1, 6)))
+        + f"/file_{i}{rng.choice(exts)}"
+        for i in range(count)
+    ] + ["README.md", "pyproject.toml", "src/main.py"]
+
+
+# Cases ------------------------------------------------------------------------
+
+def tokenizer_available() -> bool:
+    try:
+        count_tokens(["probe"])
+        return True
+    except Exception:
+        return False
+
+
+def build_cases(scale: float) -> Dict[str, Callable[[], object]]:
+    n = lambda base: max(1, int(base * scale))  # noqa: E731
+    repo = synthetic_repo(n(120), 300)
+    files = repo[:n(40)]
+    markdown = markdown_response(files, n(400))
+    json_data = json_response(files, n(20), 15)
+    script = huge_script(repo, n(5000))
+    paths = repo_paths(n(50000))
+    rng = random.Random(6)
+    token_counts = [rng.randint(50, 4000) for _ in range(n(20000))]
+    batch_files = [{"path": f"f{i}.py", "content": ""} for i in range(len(token_counts))]
+
+    saved = Path(tempfile.mkdtemp()) / "script.md"
+    saved.write_text(script.to_markdown(), encoding="utf-8")
+    llm_service = LLMService.__new__(LLMService)  # parsing needs no client
+
+    cases = {
+        "parse_response_markdown": lambda: llm_service._parse_response(markdown, files),
+        "parse_sample_script_md": lambda: parse_sample_script_md(str(saved)),
+        "from_json_response": lambda: Script.from_json_response(json_data, files),
+        "to_markdown": lambda: script.to_markdown(),
+        "plan_batches": lambda: plan_batches(batch_files, token_counts),
+        "summarize_tree": lambda: summarize_tree(paths, keep=paths[:50]),
+    }
+    if tokenizer_available():
+        contents = [f["content"] for f in repo]
+        cases["count_tokens"] = lambda: count_tokens(contents)
+    else:
+        print("count_tokens: skipped (tiktoken encoding could not be loaded)")
+    return cases
+
+
+def measure(func: Callable[[], object], repeat: int) -> Dict[str, float]:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"median_s": statistics.median(times), "best_s": min(times), "peak_mb": peak / 1e6}
+
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]],
+            time_threshold: float, memory_threshold: float) -> List[str]:
+    failures = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        slower = result["median_s"] / base["median_s"] - 1 if base["median_s"] else 0.0
+        bigger = result["peak_mb"] / base["peak_mb"] - 1 if base["peak_mb"] else 0.0
+        if slower > time_threshold:
+            failures.append(f"{name}: median {result['median_s'] * 1000:.1f} ms is {slower:.0%} slower than baseline")
+        if bigger > memory_threshold:
+            failures.append(f"{name}: peak {result['peak_mb']:.1f} MB is {bigger:.0%} above baseline")
+    return failures
+
+
+def main() -> int:
+    # Per-batch and skipped-file log lines would dominate the output
+    logging.getLogger("src").setLevel(logging.ERROR)
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiplier for every synthetic input size")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--only", help="Run only cases whose name contains this text")
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--compare", action="store_true", help="Fail if a case regressed against the baseline")
+    parser.add_argument("--time-threshold", type=float, default=0.25, help="Allowed slowdown, as a fraction")
+    parser.add_argument("--memory-threshold", type=float, default=0.25, help="Allowed peak memory growth, as a fraction")
+    args = parser.parse_args()
+
+    cases = build_cases(args.scale)
+    results: Dict[str, Dict[str, float]] = {}
+    print(f"{'case':<26} {'median ms':>10} {'best ms':>9} {'peak MB':>8}")
+    for name, func in cases.items():
+        if args.only and args.only not in name:
+            continue
+        results[name] = measure(func, args.repeat)
+        r = results[name]
+        print(f"{name:<26} {r['median_s'] * 1000:>10.1f} {r['best_s'] * 1000:>9.1f} {r['peak_mb']:>8.1f}")
+
+    if args.save_baseline:
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        stored = json.loads(args.baseline.read_text()) if args.baseline.exists() else {}
+        stored.update({"scale": args.scale, "results": {**stored.get("results", {}), **results}})
+        args.baseline.write_text(json.dumps(stored, indent=2))
+        print(f"\nSaved baseline to {args.baseline}")
+    if args.compare:
+        if not args.baseline.exists():
+            print(f"\nNo baseline at {args.baseline}; run with --save-baseline first")
+            return 1
+        stored = json.loads(args.baseline.read_text())
+        if stored.get("scale") != args.scale:
+            print(f"\nBaseline was recorded at scale {stored.get('scale')}; rerun with the same --scale")
+            return 1
+        failures = compare(results, stored["results"], args.time_threshold, args.memory_threshold)
+        for failure in failures:
+            print(f"REGRESSION {failure}")
+        if failures:
+            return 1
+        print("\nNo regressions against the baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
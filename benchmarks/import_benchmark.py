@@ -0,0 +1,91 @@
+"""
+Import-time benchmark for the API app.
+
+Imports `src.api.app` in fresh interpreters (as a worker does at start-up)
+with OPENAI_API_KEY unset, and reports the median wall time together with
+the slowest modules from `python -X importtime`. Importing must not build
+services or load the OpenAI SDK, PyGithub or httpx; the benchmark fails
+if it does, or if the median exceeds --max-seconds.
+
+Usage:
+    python benchmarks/import_benchmark.py [--runs 5] [--max-seconds 2.0]
+"""
+from pathlib import Path
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = Path(__file__).resolve().parent.parent
+# Must stay lazy: loaded only when a service is first built
+LAZY_MODULES = ("openai", "github", "httpx", "tiktoken")
+PROBE = (
+    "import sys, time\n"
+    "start = time.perf_counter()\n"
+    "import src.api.app\n"
+    "print(time.perf_counter() - start)\n"
+    f"print(','.join(m for m in {LAZY_MODULES!r} if m in sys.modules))\n"
+)
+
+
+def _env() -> dict:
+    env = dict(os.environ)
+    env.pop("OPENAI_API_KEY", None)
+    env["PYTHONDONTWRITEBYTECODE"] = "1"
+    return env
+
+
+def run_once() -> tuple:
+    out = subprocess.run(
+        [sys.executable, "-c", PROBE], cwd=ROOT, env=_env(), capture_output=True, text=True, check=True
+    ).stdout.splitlines()
+    return float(out[-2]), [m for m in out[-1].split(",") if m]
+
+
+def slowest_modules(top: int) -> list:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import src.api.app"],
+        cwd=ROOT, env=_env(), capture_output=True, text=True, check=True
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        if "." not in name or name.startswith("src."):
+            rows.append((int(cumulative), name))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-seconds", type=float, default=2.0)
+    parser.add_argument("--top", type=int, default=12)
+    args = parser.parse_args()
+
+    times, loaded = [], set()
+    for _ in range(args.runs):
+        seconds, eager = run_once()
+        times.append(seconds)
+        loaded.update(eager)
+    median = statistics.median(times)
+    print(f"import src.api.app: median {median * 1000:.0f} ms over {args.runs} runs "
+          f"(min {min(times) * 1000:.0f}, max {max(times) * 1000:.0f})")
+    print("\nSlowest top-level and src modules (cumulative):")
+    for cumulative, name in slowest_modules(args.top):
+        print(f"  {cumulative / 1000:8.1f} ms  {name}")
+
+    failed = False
+    if loaded:
+        print(f"\nFAIL: imported eagerly: {', '.join(sorted(loaded))}")
+        failed = True
+    if median > args.max_seconds:
+        print(f"\nFAIL: median import time {median:.2f}s exceeds {args.max_seconds:.2f}s")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
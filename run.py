@@ -1,21 +1,20 @@
-import uvicorn
 import logging
+from dotenv import load_dotenv
+
+# Server settings (ENVIRONMENT, WEB_CONCURRENCY, shutdown timeouts) are read on import
+load_dotenv()
+
+from src.api.serving import main  # noqa: E402
+from src.services.logging_setup import configure_logging  # noqa: E402
 
 # Configure logging
-logging.basicConfig(level=logging.INFO)
+configure_logging()
 logger = logging.getLogger(__name__)
 
 if __name__ == "__main__":
     logger.info("Starting server...")
     try:
-        uvicorn.run(
-            "src.api.app:app",
-            host="0.0.0.0",
-            port=8080,
-            reload=True,
-            reload_dirs=["src"],  # Watch the entire src directory
-            log_level="info"
-        )
+        main()
     except Exception as e:
         logger.error(f"Failed to start server: {e}")
-        raise 
\ No newline at end of file
+        raise
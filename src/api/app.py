@@ -1,12 +1,59 @@
-from fastapi import FastAPI
-from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import RedirectResponse
-from .routes import code, script, test
+from contextlib import asynccontextmanager
+import asyncio
+import os
+from dotenv import load_dotenv
+
+# Load .env and configure logging once, before any module reads its settings
+load_dotenv()
+from ..services.logging_setup import configure_logging  # noqa: E402
+configure_logging()
+
+from fastapi import FastAPI  # noqa: E402
+from fastapi.middleware.cors import CORSMiddleware  # noqa: E402
+from fastapi.responses import JSONResponse, RedirectResponse, Response  # noqa: E402
+from .routes import admin, code, script, test  # noqa: E402
+from .middleware import CompressionMiddleware, RequestIdMiddleware  # noqa: E402
+from ..services.offload import shutdown_pools  # noqa: E402
+from ..services.script_cache import parsed_script_cache  # noqa: E402
+from ..services.artifact_sink import artifact_sink  # noqa: E402
+from ..services.job_tracker import job_tracker  # noqa: E402
+from ..services.admission import generation_admission  # noqa: E402
+from ..services.llm_scheduler import llm_limiter  # noqa: E402
+from ..services.token_cache import token_count_cache  # noqa: E402
+from ..services.metrics import register_gauge, registry  # noqa: E402
+from ..services.registry import close_services, get_github_service, get_script_generator  # noqa: E402
+from ..services.script_generator import MOCK_SCRIPT_PATHS, DEFAULT_MOCK_SCRIPT_PATH, parse_mock_script_file  # noqa: E402
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    watcher = None
+    if os.environ.get("PRELOAD_SERVICES", "false").lower() == "true":
+        # Build the shared services now instead of on the first request
+        get_github_service()
+        get_script_generator()
+    if os.environ.get("MOCK_LLM_MODE", "false").lower() == "true":
+        # Parse the mock scripts up front so mock responses never touch the disk
+        await parsed_script_cache.preload([DEFAULT_MOCK_SCRIPT_PATH, *MOCK_SCRIPT_PATHS.values()], parse_mock_script_file)
+        await parsed_script_cache.preload([script.SAMPLE_SCRIPT_PATH], script.parse_sample_script_md)
+        if os.environ.get("MOCK_SCRIPT_WATCH", "false").lower() == "true":
+            interval = float(os.environ.get("MOCK_SCRIPT_WATCH_INTERVAL", "2"))
+            watcher = asyncio.create_task(parsed_script_cache.watch(interval))
+    job_tracker.mark_ready()
+    yield
+    # Uvicorn has already waited for open requests; this covers other servers
+    await job_tracker.drain()
+    if watcher is not None:
+        watcher.cancel()
+    # Finish queued artifact writes before the I/O pool goes away
+    await artifact_sink.close()
+    await close_services()
+    shutdown_pools()
 
 app = FastAPI(
     title="VibeParse",
     description="AI-powered code explanation generator",
-    version="0.1.0"
+    version="0.1.0",
+    lifespan=lifespan
 )
 
 # Configure CORS
@@ -18,10 +65,18 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress large text responses for clients that accept it
+if os.environ.get("RESPONSE_COMPRESSION", "true").lower() == "true":
+    app.add_middleware(CompressionMiddleware)
+
+# Outermost, so every log line of a request carries its ID
+app.add_middleware(RequestIdMiddleware)
+
 # Include routers
 app.include_router(code.router, prefix="/api", tags=["code"])
 app.include_router(script.router, prefix="/api", tags=["script"])
 app.include_router(test.router, prefix="/api", tags=["test"])
+app.include_router(admin.router, prefix="/api", tags=["admin"])
 
 @app.get("/")
 async def root():
@@ -30,4 +85,25 @@ async def root():
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
-    return {"status": "healthy"} 
\ No newline at end of file
+    return {"status": "healthy"}
+
+@app.get("/ready")
+async def readiness_check():
+    """Readiness probe: 503 until startup finishes and once the worker starts draining for shutdown"""
+    status = job_tracker.status()
+    if not job_tracker.accepting:
+        return JSONResponse(status_code=503, content={"status": "draining" if job_tracker.draining else "starting", **status})
+    return {"status": "ready", **status}
+
+# Queue depths and cache sizes are read when /metrics is scraped
+register_gauge("generations_running", "Script generations holding an admission slot", lambda: generation_admission.running)
+register_gauge("generations_queued", "Script generations waiting for an admission slot", lambda: generation_admission.queued)
+register_gauge("llm_calls_in_flight", "LLM calls holding a scheduler slot", lambda: llm_limiter.status()["in_flight"])
+register_gauge("llm_calls_waiting", "LLM calls waiting for a scheduler slot", lambda: llm_limiter.status()["waiting"])
+register_gauge("jobs_active", "Tracked jobs in flight on this worker", lambda: job_tracker.active)
+register_gauge("token_cache_entries", "Token counts held in the blob SHA cache", lambda: len(token_count_cache))
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics for this worker: stage latencies, token usage, retries, caches and queues"""
+    return Response(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,157 @@
+from typing import List, Optional
+import re
+import uuid
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from ..services.compression import CODECS, MIN_SIZE, PREFERRED_ENCODINGS, compress, encoded_etag, negotiate
+from ..services.offload import run_in_pool
+from ..services.logging_setup import request_id
+
+# Larger bodies are compressed in the offload pool instead of on the event loop
+OFFLOAD_MIN_SIZE = 256 * 1024
+# Client-supplied request IDs are echoed back only if they look like IDs
+REQUEST_ID_PATTERN = re.compile(r"[A-Za-z0-9._-]{1,64}")
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/javascript", "application/xml", "+json", "+xml")
+
+
+def _add_vary(headers: MutableHeaders) -> None:
+    if "accept-encoding" not in headers.get("vary", "").lower():
+        headers.add_vary_header("Accept-Encoding")
+
+
+def _compressible(content_type: Optional[str]) -> bool:
+    if not content_type:
+        return False
+    content_type = content_type.split(";")[0].strip().lower()
+    return any(content_type.startswith(t) or content_type.endswith(t) for t in COMPRESSIBLE_TYPES)
+
+
+class RequestIdMiddleware:
+    """
+    Give each HTTP request an ID for its log records and echo it as `X-Request-ID`.
+
+    A well-formed incoming `X-Request-ID` (e.g. from a proxy) is kept;
+    otherwise a new one is generated. Tasks started while handling the
+    request inherit the ID.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        incoming = Headers(scope=scope).get("x-request-id", "")
+        rid = incoming if REQUEST_ID_PATTERN.fullmatch(incoming) else uuid.uuid4().hex[:16]
+        token = request_id.set(rid)
+
+        async def send_with_id(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message)["X-Request-ID"] = rid
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            request_id.reset(token)
+
+
+class CompressionMiddleware:
+    """
+    Negotiated response compression (zstd, br or gzip, per Accept-Encoding).
+
+    Bodies smaller than `minimum_size` and non-text types are sent as is;
+    streamed bodies are compressed chunk by chunk. Compressed responses get
+    `Vary: Accept-Encoding` and an encoding-specific ETag, and responses the
+    app already encoded are passed through untouched.
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int = MIN_SIZE, encodings: Optional[List[str]] = None):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.encodings = encodings if encodings is not None else PREFERRED_ENCODINGS
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding"), self.encodings)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        await _CompressingResponder(self.app, encoding, self.minimum_size)(scope, receive, send)
+
+
+class _CompressingResponder:
+    def __init__(self, app: ASGIApp, encoding: str, minimum_size: int):
+        self.app = app
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.send: Send = None
+        self.start: Optional[Message] = None
+        self.compressor = None
+        self.passthrough = False
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        self.send = send
+        await self.app(scope, receive, self.send_wrapper)
+
+    async def send_wrapper(self, message: Message) -> None:
+        if message["type"] == "http.response.start":
+            # Hold the headers until the first body chunk shows whether compression pays off
+            self.start = message
+            return
+        if message["type"] != "http.response.body":
+            await self.send(message)
+            return
+        if self.start is not None:
+            start, self.start = self.start, None
+            await self._begin(start, message)
+            return
+        if self.passthrough:
+            await self.send(message)
+            return
+        body = self.compressor.chunk(message.get("body", b""))
+        if not message.get("more_body", False):
+            body += self.compressor.finish()
+        await self.send({"type": "http.response.body", "body": body, "more_body": message.get("more_body", False)})
+
+    async def _begin(self, start: Message, message: Message) -> None:
+        headers = MutableHeaders(raw=start["headers"])
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if "content-encoding" in headers:
+            # Already encoded by the app (e.g. a stored compressed body)
+            _add_vary(headers)
+            self.passthrough = True
+        elif start["status"] == 304:
+            _add_vary(headers)
+            if "etag" in headers:
+                headers["ETag"] = encoded_etag(headers["etag"], self.encoding)
+            self.passthrough = True
+        elif not _compressible(headers.get("content-type")) or (not more_body and len(body) < self.minimum_size):
+            self.passthrough = True
+        if self.passthrough:
+            await self.send(start)
+            await self.send(message)
+            return
+
+        codec = CODECS[self.encoding]
+        headers["Content-Encoding"] = self.encoding
+        _add_vary(headers)
+        if "etag" in headers:
+            headers["ETag"] = encoded_etag(headers["etag"], self.encoding)
+        if more_body:
+            self.compressor = codec.stream()
+            del headers["Content-Length"]
+            await self.send(start)
+            await self.send({"type": "http.response.body", "body": self.compressor.chunk(body), "more_body": True})
+            return
+        if len(body) >= OFFLOAD_MIN_SIZE:
+            compressed = await run_in_pool("compress_response", compress, body, self.encoding)
+        else:
+            compressed = codec.compress(body)
+        headers["Content-Length"] = str(len(compressed))
+        await self.send(start)
+        await self.send({"type": "http.response.body", "body": compressed})
@@ -0,0 +1,81 @@
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel
+from typing import Any, Dict, Optional
+import logging
+import os
+import secrets
+from ...services.profiler import job_profiler
+
+logger = logging.getLogger(__name__)
+
+
+def require_admin(
+    authorization: Optional[str] = Header(None),
+    x_admin_token: Optional[str] = Header(None)
+) -> None:
+    """Allow the request only with the ADMIN_TOKEN; the admin API is hidden (404) when no token is set."""
+    expected = os.environ.get("ADMIN_TOKEN", "")
+    if not expected:
+        raise HTTPException(status_code=404, detail="Not Found")
+    supplied = x_admin_token or ""
+    if authorization and authorization.lower().startswith("bearer "):
+        supplied = authorization[7:]
+    if not secrets.compare_digest(supplied.encode(), expected.encode()):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+
+router = APIRouter(dependencies=[Depends(require_admin)])
+
+
+class ProfileNextRequest(BaseModel):
+    count: int = 1
+
+
+@router.get("/admin/profiles")
+async def profiler_status():
+    """Armed job IDs, jobs being profiled and finished profiles, newest first"""
+    return job_profiler.status()
+
+
+@router.post("/admin/profiles/jobs/{job_id}")
+async def profile_job(job_id: str):
+    """Profile the job started by the request with this X-Request-ID"""
+    job_profiler.arm_job(job_id)
+    logger.info(f"[Admin] Armed profiling for job {job_id}")
+    return job_profiler.status()
+
+
+@router.post("/admin/profiles/next")
+async def profile_next_jobs(request: ProfileNextRequest):
+    """Profile the next `count` jobs on this worker"""
+    if not 1 <= request.count <= 100:
+        raise HTTPException(status_code=422, detail="count must be between 1 and 100")
+    job_profiler.arm_next(request.count)
+    logger.info(f"[Admin] Armed profiling for the next {request.count} job(s)")
+    return job_profiler.status()
+
+
+@router.delete("/admin/profiles/armed")
+async def disarm_profiling():
+    """Cancel pending profiling requests; jobs already being profiled finish normally"""
+    job_profiler.disarm()
+    return job_profiler.status()
+
+
+@router.get("/admin/profiles/{job_id}")
+async def get_profile(job_id: str, top: int = Query(20, ge=1, le=200)) -> Dict[str, Any]:
+    """Hottest functions and top allocation sites of a finished profile"""
+    profile = job_profiler.get(job_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail=f"No finished profile for job {job_id}")
+    return profile.summary(top)
+
+
+@router.get("/admin/profiles/{job_id}/collapsed", response_class=PlainTextResponse)
+async def get_collapsed_stacks(job_id: str):
+    """Sampled stacks in folded format, for flamegraph.pl or speedscope"""
+    profile = job_profiler.get(job_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail=f"No finished profile for job {job_id}")
+    return PlainTextResponse(profile.collapsed())
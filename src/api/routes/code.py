@@ -1,11 +1,12 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel, HttpUrl
 from typing import List, Optional
 from src.services.github_service import GitHubService
+from src.services.offload import run_in_pool
+from src.services.registry import get_github_service
 import os
 
 router = APIRouter()
-github_service = GitHubService()
 
 class CodeRequest(BaseModel):
     github_url: HttpUrl
@@ -23,7 +24,7 @@ def save_files_to_disk(files: List[dict], base_dir: str = "test_output") -> List
     return saved_paths
 
 @router.post("/fetch-code")
-async def fetch_code(request: CodeRequest):
+async def fetch_code(request: CodeRequest, github_service: GitHubService = Depends(get_github_service)):
     """
     Fetch code from a GitHub URL. The URL can point to either a file or a directory.
     If it's a directory, you can optionally specify file types to include.
@@ -45,7 +46,7 @@ async def fetch_code(request: CodeRequest):
             )
         
         if request.save_to_disk:
-            saved_paths = save_files_to_disk(files)
+            saved_paths = await run_in_pool("save_files", save_files_to_disk, files, io=True)
             return {"saved_files": saved_paths}
         else:
             return {"files": files}
@@ -1,18 +1,55 @@
-from fastapi import APIRouter, HTTPException
-from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from typing import Any, Dict, List, Optional
 from pydantic import BaseModel
 from ...services.script_generator import ScriptGenerator
-from ...models.script import Script, Scene, CodeHighlight
+from ...services.registry import get_script_generator
+from ...models.script import Script, Scene, ChapterOutline
+from ...services.lazy_chapters import LazyScript, LazyScriptStore
+from ...services.scene_parser import parse_scenes
+from ...services.script_cache import parsed_script_cache
+from ...services.job_tracker import job_tracker
+from ...services.admission import AdmissionRejected, generation_admission
+from ...services.compression import encoded_etag
+from ...services.script_store import ScriptStore, IMMUTABLE_CACHE_CONTROL, SCENE_FIELDS, etag_matches
+import hashlib
+import logging
 import os
+import sys
 import uuid
-import re
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 
 router = APIRouter()
-script_generator = ScriptGenerator()
+logger = logging.getLogger(__name__)
 
-# In-memory storage for scripts by ID
-script_store = {}
+# In-memory storage for scripts by ID, with their serialized responses
+script_store = ScriptStore()
+# Generation state for scripts created in lazy mode, by script ID
+lazy_store = LazyScriptStore()
+
+async def _store_lazy_script(script_id: str, lazy_script: LazyScript) -> None:
+    """Write a lazy script's chapters so far to the script store; its sources are dropped once it is complete."""
+    async with lazy_script.store_lock:
+        await script_store.put(script_id, lazy_script.script())
+        lazy_script.release_sources()
+
+async def _generate_chapter(
+    script_generator: ScriptGenerator, script_id: str, lazy_script: LazyScript, number: int
+) -> List[Scene]:
+    """Generate (or return) chapter `number` and update the stored script when it is new."""
+    is_new = number not in lazy_script.chapters
+    scenes = await script_generator.generate_lazy_chapter(lazy_script, number)
+    if is_new:
+        await _store_lazy_script(script_id, lazy_script)
+    return scenes
+
+def _client_key(http_request: Request) -> str:
+    """Admission key of a request: its client address, which (unlike the e-mail in the body) the caller cannot vary freely."""
+    return http_request.client.host if http_request.client else "unknown"
+
+def _cache_control(script_id: str) -> str:
+    """Stored scripts never change, except lazy ones that are still gaining chapters."""
+    lazy_script = lazy_store.get(script_id)
+    return "no-cache" if lazy_script is not None and not lazy_script.complete else IMMUTABLE_CACHE_CONTROL
 
 def get_project_paths():
     current_file = os.path.abspath(__file__)
@@ -28,130 +65,10 @@ def get_project_paths():
 PATHS = get_project_paths()
 SAMPLE_SCRIPT_PATH = PATHS['sample_script_path']
 
-def extract_code_blocks_from_content(content: str) -> list:
-    code_block_pattern = re.compile(r'```([a-zA-Z0-9]*)[ \t]*\r?\n([\s\S]*?)```', re.MULTILINE)
-    highlights = []
-    
-    # Try to extract file path from content (look for patterns like "The `src/App.css` file")
-    file_path = "scene-content"  # default
-    file_path_match = re.search(r'The `([^`]+)` file', content)
-    if file_path_match:
-        file_path = file_path_match.group(1)
-    
-    for match in code_block_pattern.finditer(content):
-        lang = match.group(1) or ""
-        code = match.group(2).strip()
-        highlights.append(CodeHighlight(
-            file_path=file_path,
-            start_line=0,
-            end_line=0,
-            description="Inline code block from scene content",
-            code=code
-        ))
-    return highlights
-
 def parse_sample_script_md(md_path: str) -> Script:
-    scenes = []
-    with open(md_path, "r") as f:
-        lines = f.readlines()
-
-    current_scene = None
-    current_highlights = []
-    in_highlights = False
-    highlight_file = None
-    highlight_start = None
-    highlight_end = None
-    highlight_desc = ""
-    highlight_code = ""
-    code_block = False
-    content_lines = []
-    scene_title = ""
-    scene_duration = 0
-    scene_content = ""
-
-    for line in lines:
-        if line.startswith("## ") and ("Scene" in line or "Chapter" in line):
-            if current_scene:
-                current_scene["content"] = "".join(content_lines).strip()
-                content_highlights = extract_code_blocks_from_content(current_scene["content"])
-                all_highlights = current_highlights + content_highlights
-                scenes.append(Scene(
-                    title=current_scene["title"],
-                    duration=current_scene["duration"],
-                    content=current_scene["content"],
-                    code_highlights=all_highlights
-                ))
-                current_highlights = []
-                content_lines = []
-            # Match both Scene and Chapter patterns
-            m = re.match(r"## (Scene|Chapter) [0-9]+: (.*) \((\d+)s\)", line)
-            if m:
-                scene_title = m.group(2).strip()
-                scene_title = re.sub(r'^(Scene \d+: |Chapter \d+: )+', '', scene_title)
-                scene_duration = int(m.group(3))
-                current_scene = {"title": scene_title, "duration": scene_duration}
-        elif line.strip() == "### Code Highlights":
-            in_highlights = True
-        elif in_highlights and line.startswith("**"):
-            if highlight_file:
-                current_highlights.append(CodeHighlight(
-                    file_path=highlight_file,
-                    start_line=highlight_start,
-                    end_line=highlight_end,
-                    description=highlight_desc.strip(),
-                    code=highlight_code.strip()
-                ))
-                highlight_desc = ""
-                highlight_code = ""
-            # Parse the line number format: **filename** (lines start-end):
-            m = re.match(r"\*\*(.+?)\*\* \(lines (\d+)-(\d+)\):", line)
-            if m:
-                highlight_file = m.group(1).strip()
-                highlight_start = int(m.group(2))
-                highlight_end = int(m.group(3))
-            else:
-                # Try alternative pattern without colon
-                m2 = re.match(r"\*\*(.+?)\*\* \(lines (\d+)-(\d+)\)", line)
-                if m2:
-                    highlight_file = m2.group(1).strip()
-                    highlight_start = int(m2.group(2))
-                    highlight_end = int(m2.group(3))
-                else:
-                    highlight_file = None
-                    highlight_start = None
-                    highlight_end = None
-        elif in_highlights and line.strip() == "```":
-            code_block = not code_block
-        elif in_highlights and code_block:
-            highlight_code += line
-        elif in_highlights and line.strip() == "":
-            pass
-        elif in_highlights and not code_block:
-            highlight_desc += line
-        elif line.strip() == "---":
-            in_highlights = False
-        elif current_scene and not in_highlights:
-            content_lines.append(line)
-
-    if highlight_file:
-        current_highlights.append(CodeHighlight(
-            file_path=highlight_file,
-            start_line=highlight_start,
-            end_line=highlight_end,
-            description=highlight_desc.strip(),
-            code=highlight_code.strip()
-        ))
-    if current_scene:
-        current_scene["content"] = "".join(content_lines).strip()
-        content_highlights = extract_code_blocks_from_content(current_scene["content"])
-        all_highlights = current_highlights + content_highlights
-        scenes.append(Scene(
-            title=current_scene["title"],
-            duration=current_scene["duration"],
-            content=current_scene["content"],
-            code_highlights=all_highlights
-        ))
-    return Script(scenes=scenes)
+    """Parse a saved Markdown script file into a Script, streaming it line by line."""
+    with open(md_path, "r", encoding="utf-8") as f:
+        return parse_scenes(f, inline_code_highlights=True, strip_numbering=True)
 
 class ScriptRequest(BaseModel):
     github_url: str
@@ -160,62 +77,251 @@ class ScriptRequest(BaseModel):
     file_types: Optional[List[str]] = None
     save_to_disk: bool = True
     email: Optional[str] = None
+    # Generate chapters on first access; defaults to the LAZY_CHAPTER_MODE environment variable
+    lazy: Optional[bool] = None
 
 class ScriptWithID(BaseModel):
     script_id: str
     script: Script
+    outline: Optional[List[ChapterOutline]] = None
+
+class ChapterResponse(BaseModel):
+    script_id: str
+    chapter: ChapterOutline
+    scenes: List[Scene]
+
+class ChapterSummary(BaseModel):
+    number: int  # 0 is the introduction before the first chapter header
+    title: str
+    start: int
+    count: int
+    duration: int
+
+class SceneSummary(BaseModel):
+    index: int
+    title: str
+    duration: int
+    chapter: int
+
+class ScriptOutline(BaseModel):
+    script_id: str
+    scene_count: int
+    total_duration: int
+    chapters: List[ChapterSummary]
+    scenes: List[SceneSummary]
+
+class SceneWindow(BaseModel):
+    script_id: str
+    offset: int
+    limit: int
+    total: int
+    # Scene objects limited to the selected fields
+    scenes: List[Dict[str, Any]]
+
+class EstimateRequest(BaseModel):
+    github_url: str
+    file_types: Optional[List[str]] = None
+    lazy: Optional[bool] = None
+
+class BatchEstimate(BaseModel):
+    files: List[str]
+    tokens: int
+
+class GenerationEstimate(BaseModel):
+    file_count: int
+    skipped_files: List[str]
+    batches: List[BatchEstimate]
+    total_input_tokens: int
+    # Files whose token count is exact (tokenized before); the rest are estimated from their size
+    exact_token_counts: int
+    predicted_llm_calls: int
+    avg_llm_call_seconds: float
+    llm_available: bool
+    expected_seconds: float
+    expected_seconds_breakdown: Dict[str, float]
 
 @router.post("/generate-script", response_model=ScriptWithID)
-async def generate_script(request: ScriptRequest):
-    print(f"[API] /generate-script endpoint called")
-    print(f"[API] Request: URL={request.github_url}, Proficiency={request.proficiency}, Depth={request.depth}")
-    print(f"[API] File types: {request.file_types}, Save to disk: {request.save_to_disk}")
-    print(f"[USER] New user started generation for {request.github_url} and has e-mail {request.email}")
-    
+async def generate_script(
+    request: ScriptRequest,
+    http_request: Request,
+    script_generator: ScriptGenerator = Depends(get_script_generator)
+):
     # Check environment variables
     USE_JSON_SCRIPT_PROMPT = os.environ.get("USE_JSON_SCRIPT_PROMPT", "false").lower() == "true"
     MOCK_LLM_MODE = os.environ.get("MOCK_LLM_MODE", "false").lower() == "true"
-    print(f"[API] Environment: USE_JSON_SCRIPT_PROMPT={USE_JSON_SCRIPT_PROMPT}, MOCK_LLM_MODE={MOCK_LLM_MODE}")
+    logger.info(
+        "[API] /generate-script: url=%s proficiency=%s depth=%s file_types=%s save_to_disk=%s json=%s mock=%s",
+        request.github_url, request.proficiency, request.depth, request.file_types,
+        request.save_to_disk, USE_JSON_SCRIPT_PROMPT, MOCK_LLM_MODE
+    )
+    logger.info("[USER] New user started generation for %s and has e-mail %s", request.github_url, request.email)
+    lazy = request.lazy if request.lazy is not None else os.environ.get("LAZY_CHAPTER_MODE", "false").lower() == "true"
+    
+    if job_tracker.draining:
+        # Multi-minute jobs belong on a worker that is not about to stop
+        raise HTTPException(status_code=503, detail="Server is shutting down; please retry.", headers={"Retry-After": "5"})
+    
+    # Fairness and per-client limits are per address
+    client = _client_key(http_request)
     
     try:
-        print("[API] Calling script_generator.generate_script_from_url...")
-        script = await script_generator.generate_script_from_url(
-            github_url=request.github_url,
-            proficiency=request.proficiency,
-            depth=request.depth,
-            file_types=request.file_types,
-            save_to_disk=request.save_to_disk
-        )
-        print(f"[API] Script generation completed. Script has {len(script.scenes)} scenes")
+        async with generation_admission.admit(client), job_tracker.track("generate_script", sys._getframe()):
+            if lazy and not MOCK_LLM_MODE:
+                logger.info("[API] Lazy mode: generating intro, outline and first chapter only")
+                lazy_script = await script_generator.start_lazy_script(
+                    github_url=request.github_url,
+                    proficiency=request.proficiency,
+                    depth=request.depth,
+                    file_types=request.file_types
+                )
+                script_id = str(uuid.uuid4())
+                lazy_store.put(script_id, lazy_script)
+                await _store_lazy_script(script_id, lazy_script)
+                lazy_script.prefetch(2, lambda n: _generate_chapter(script_generator, script_id, lazy_script, n), client)
+                logger.info("[API] Stored lazy script with ID: %s (%d chapters planned)", script_id, lazy_script.chapter_count)
+                return ScriptWithID(script_id=script_id, script=lazy_script.script(), outline=lazy_script.outline())
         
-        script_id = str(uuid.uuid4())
-        script_store[script_id] = script
-        print(f"[API] Stored script with ID: {script_id}")
+            script = await script_generator.generate_script_from_url(
+                github_url=request.github_url,
+                proficiency=request.proficiency,
+                depth=request.depth,
+                file_types=request.file_types,
+                save_to_disk=request.save_to_disk
+            )
         
-        result = ScriptWithID(script_id=script_id, script=script)
-        print(f"[API] Returning response with script ID: {script_id}")
-        return result
+            script_id = str(uuid.uuid4())
+            await script_store.put(script_id, script)
+            logger.info("[API] Stored script with ID: %s (%d scenes)", script_id, len(script.scenes))
+        
+            return ScriptWithID(script_id=script_id, script=script)
+    except AdmissionRejected as e:
+        logger.info("[API] Generation not admitted for %s: %s", client, e.reason)
+        raise HTTPException(status_code=e.status_code, detail=e.reason, headers={"Retry-After": str(e.retry_after)})
+    except Exception as e:
+        logger.error("[API] Error during script generation: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/generate-script/estimate", response_model=GenerationEstimate)
+async def estimate_script(request: EstimateRequest, script_generator: ScriptGenerator = Depends(get_script_generator)):
+    """Dry run of /generate-script: the batch plan and expected duration, without fetching code or calling the LLM."""
+    lazy = request.lazy if request.lazy is not None else os.environ.get("LAZY_CHAPTER_MODE", "false").lower() == "true"
+    try:
+        estimate = await script_generator.estimate_generation(request.github_url, request.file_types, lazy=lazy)
     except Exception as e:
-        print(f"[API] Error during script generation: {e}")
+        logger.error("[API] Error estimating script generation: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
+    if generation_admission.running >= generation_admission.max_running:
+        # A new generation would first wait for an admission slot
+        wait = generation_admission.retry_after()
+        estimate["expected_seconds_breakdown"]["admission_wait"] = wait
+        estimate["expected_seconds"] += wait
+    return GenerationEstimate(**estimate)
+
+# Registered before /scripts/{script_id} so "current" is not taken as an ID
+@router.get("/scripts/current")
+async def get_current_script():
+    if os.path.exists(SAMPLE_SCRIPT_PATH):
+        return await parsed_script_cache.load(SAMPLE_SCRIPT_PATH, parse_sample_script_md)
+    return JSONResponse(status_code=404, content={"detail": "Script not found."})
 
 @router.get("/scripts/{script_id}", response_model=Script)
-async def get_script_by_id(script_id: str):
+async def get_script_by_id(script_id: str, request: Request):
+    """Return the stored script's pre-serialized JSON, or 304 if the client's copy is current."""
+    entry = script_store.get_entry(script_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Script not found.")
+    headers = {"ETag": entry.etag, "Cache-Control": _cache_control(script_id)}
+    if entry.matches(request.headers.get("if-none-match")):
+        return Response(status_code=304, headers=headers)
+    body, encoding = await script_store.body(script_id, request.headers.get("accept-encoding"))
+    if encoding:
+        headers.update({"Content-Encoding": encoding, "ETag": encoded_etag(entry.etag, encoding), "Vary": "Accept-Encoding"})
+    return Response(content=body, media_type="application/json", headers=headers)
+
+def _cached_json(request: Request, etag: str, content: Dict[str, Any], cache_control: str = IMMUTABLE_CACHE_CONTROL) -> Response:
+    """JSON response for a view of a stored script, or 304 if the client's copy is current."""
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(content=content, headers=headers)
+
+@router.get("/scripts/{script_id}/outline", response_model=ScriptOutline)
+async def get_script_outline(script_id: str, request: Request):
+    """Return chapter and scene titles with durations, without any scene content."""
+    entry = script_store.get_entry(script_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Script not found.")
+    return _cached_json(
+        request, f'"{entry.etag[1:-1]}-outline"', {"script_id": script_id, **entry.outline()}, _cache_control(script_id)
+    )
+
+@router.get("/scripts/{script_id}/scenes", response_model=SceneWindow)
+async def get_script_scenes(
+    script_id: str,
+    request: Request,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(20, ge=1, le=200),
+    fields: Optional[str] = Query(None, description="Comma-separated scene fields: title, duration, content, code_highlights"),
+    include_code: bool = Query(True, description="Include the code of each highlight")
+):
+    """Return a window of scenes, optionally limited to some fields; only the window is serialized."""
+    entry = script_store.get_entry(script_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Script not found.")
+    selected = SCENE_FIELDS
+    if fields:
+        selected = frozenset(f.strip() for f in fields.split(",") if f.strip())
+        unknown = selected - SCENE_FIELDS
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown scene fields: {', '.join(sorted(unknown))}")
+    variant = f"{offset}:{limit}:{','.join(sorted(selected))}:{int(include_code)}"
+    etag = f'"{entry.etag[1:-1]}-{hashlib.sha1(variant.encode()).hexdigest()[:12]}"'
+    return _cached_json(request, etag, {
+        "script_id": script_id,
+        "offset": offset,
+        "limit": limit,
+        "total": len(entry.scenes),
+        "scenes": entry.window(offset, limit, selected, include_code),
+    }, _cache_control(script_id))
+
+@router.get("/scripts/{script_id}/markdown")
+async def get_script_markdown(script_id: str):
+    """Stream a stored script as a Markdown download, one scene per chunk."""
     script = script_store.get(script_id)
     if not script:
         raise HTTPException(status_code=404, detail="Script not found.")
-    return script
+    return StreamingResponse(
+        script.iter_markdown(),
+        media_type="text/markdown; charset=utf-8",
+        headers={"Content-Disposition": f'attachment; filename="{script_id}.md"'}
+    )
 
-@router.get("/scripts/current")
-async def get_current_script():
-    script_id = "current"
-    script = script_store.get(script_id)
-    if script is not None:
-        return script
-    if os.path.exists(SAMPLE_SCRIPT_PATH):
-        with open(SAMPLE_SCRIPT_PATH, "r") as f:
-            md_content = f.read()
-        script = parse_sample_script_md(md_content)
-        script_store[script_id] = script
-        return script
-    return JSONResponse(status_code=404, content={"detail": "Script not found."})
\ No newline at end of file
+@router.get("/scripts/{script_id}/chapters/{number}", response_model=ChapterResponse)
+async def get_script_chapter(
+    script_id: str,
+    number: int,
+    http_request: Request,
+    script_generator: ScriptGenerator = Depends(get_script_generator)
+):
+    """Return one chapter of a lazily generated script, generating it on first access."""
+    lazy_script = lazy_store.get(script_id)
+    if lazy_script is None:
+        raise HTTPException(status_code=404, detail="Lazy script not found.")
+    if not 1 <= number <= lazy_script.chapter_count:
+        raise HTTPException(status_code=404, detail=f"Chapter {number} not found; script has {lazy_script.chapter_count} chapters.")
+    client = _client_key(http_request)
+    try:
+        if number in lazy_script.chapters:
+            scenes = lazy_script.chapters[number]
+        else:
+            # On-demand chapters are LLM generations too, under the same limits as /generate-script
+            async with generation_admission.admit(client), job_tracker.track("generate_chapter", sys._getframe()):
+                scenes = await _generate_chapter(script_generator, script_id, lazy_script, number)
+    except AdmissionRejected as e:
+        logger.info("[API] Chapter generation not admitted for %s: %s", client, e.reason)
+        raise HTTPException(status_code=e.status_code, detail=e.reason, headers={"Retry-After": str(e.retry_after)})
+    except Exception as e:
+        logger.error("[API] Error generating chapter %d of %s: %s", number, script_id, e)
+        raise HTTPException(status_code=500, detail=str(e))
+    lazy_script.prefetch(number + 1, lambda n: _generate_chapter(script_generator, script_id, lazy_script, n), client)
+    return ChapterResponse(script_id=script_id, chapter=lazy_script.outline()[number - 1], scenes=scenes)
@@ -1,67 +1,17 @@
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
-from openai import AsyncOpenAI
 import os
-import asyncio
 import logging
-from dotenv import load_dotenv
 from typing import Dict, Any
+from ...services.llm_retry import call_llm_with_retries
+from ...services.offload import get_stage_stats
+from ...services.admission import generation_admission
+from ...services.llm_scheduler import llm_limiter
+from ...services.llm_client import get_llm_client
 
-# Load environment variables
-load_dotenv()
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
-client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
-async def call_llm_with_retries(llm_call, *args, max_retries=3, base_delay=2, **kwargs):
-    """
-    Call an LLM function with retry logic for rate limiting and other transient errors.
-    
-    Args:
-        llm_call: Async function to call
-        *args: Arguments to pass to llm_call
-        max_retries: Maximum number of retry attempts
-        base_delay: Base delay in seconds for exponential backoff
-        **kwargs: Keyword arguments to pass to llm_call
-        
-    Returns:
-        Result from llm_call
-        
-    Raises:
-        RuntimeError: If max retries exceeded
-        Exception: Original exception if not a retryable error
-    """
-    for attempt in range(max_retries):
-        try:
-            logger.info(f"[Throttling] Making LLM call (attempt {attempt+1}/{max_retries})...")
-            return await llm_call(*args, **kwargs)
-        except Exception as e:
-            # Check if this is a rate limit error (429)
-            if hasattr(e, 'status_code') and e.status_code == 429:
-                wait_time = base_delay * (2 ** attempt)
-                logger.warning(f"[Throttling] 429 Too Many Requests. Retrying in {wait_time} seconds (attempt {attempt+1}/{max_retries})...")
-                await asyncio.sleep(wait_time)
-            # Check for other potentially retryable errors
-            elif hasattr(e, 'status_code') and e.status_code >= 500:
-                wait_time = base_delay * (2 ** attempt)
-                logger.warning(f"[Throttling] Server error {e.status_code}. Retrying in {wait_time} seconds (attempt {attempt+1}/{max_retries})...")
-                await asyncio.sleep(wait_time)
-            elif "timeout" in str(e).lower() or "connection" in str(e).lower():
-                wait_time = base_delay * (2 ** attempt)
-                logger.warning(f"[Throttling] Connection/timeout error: {e}. Retrying in {wait_time} seconds (attempt {attempt+1}/{max_retries})...")
-                await asyncio.sleep(wait_time)
-            else:
-                # Non-retryable error, re-raise immediately
-                logger.error(f"[Throttling] Non-retryable error on attempt {attempt+1}: {e}")
-                raise
-    raise RuntimeError(f"Exceeded maximum retries ({max_retries}) for LLM call due to repeated errors.")
 
 class TestRequest(BaseModel):
     prompt: str = "Explain what this code does in one sentence: def hello(): print('world')"
@@ -91,6 +41,21 @@ async def get_config():
         environment=environment
     )
 
+@router.get("/offload-stats")
+async def get_offload_stats():
+    """Cumulative time each CPU/IO stage spent waiting for and running in the offload pools"""
+    return get_stage_stats()
+
+@router.get("/admission-stats")
+async def get_admission_stats():
+    """Running and queued generations, rejections and the current Retry-After estimate"""
+    return generation_admission.status()
+
+@router.get("/llm-queue-stats")
+async def get_llm_queue_stats():
+    """LLM slots in use, waiting calls and queue-wait time per job size class"""
+    return llm_limiter.status()
+
 @router.post("/test-llm", response_model=LLMTestResponse)
 async def test_llm_endpoint(request: LLMTestRequest):
     """Test the LLM connection"""
@@ -101,10 +66,7 @@ async def test_llm_endpoint(request: LLMTestRequest):
             logger.info("Mock mode active - returning mock response")
             return {"response": "This is a mock response from the test endpoint. MOCK_LLM_MODE is enabled."}
         
-        # Import here to avoid issues if OpenAI is not configured
-        from ...services.llm_service import LLMService
-        
-        llm_service = LLMService()
+        client = get_llm_client()
         
         # Simple test prompt
         messages = [
@@ -113,7 +75,9 @@ async def test_llm_endpoint(request: LLMTestRequest):
         
         logger.info(f"Testing LLM with message: {request.message}")
         
-        response = await llm_service.call_llm(
+        response = await call_llm_with_retries(
+            client.chat.completions.create,
+            model="gpt-4o",
             messages=messages,
             max_tokens=100,
             temperature=0.7
@@ -122,9 +86,9 @@ async def test_llm_endpoint(request: LLMTestRequest):
         logger.info("LLM test successful")
         
         return LLMTestResponse(
-            response=response.content,
+            response=response.choices[0].message.content,
             model=response.model,
-            usage=response.usage
+            usage=response.usage.model_dump() if response.usage else {}
         )
         
     except Exception as e:
@@ -143,6 +107,7 @@ async def test_llm(request: TestRequest):
         return {"response": "This is a mock response from the test endpoint. MOCK_LLM_MODE is enabled."}
     
     try:
+        client = get_llm_client()
         async def llm_test_call():
             return await client.chat.completions.create(
                 model="gpt-4o",
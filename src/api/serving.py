@@ -0,0 +1,120 @@
+"""
+Uvicorn entry points for development and production.
+
+Development runs one process with the reloader. Production runs several
+workers with no reloader, uses uvloop and httptools when they are
+installed, and shuts down gracefully. On SIGTERM each worker first reports
+not ready on /ready for SHUTDOWN_DRAIN_DELAY seconds, so the load balancer
+can take it out of rotation. It then stops accepting connections and gives
+in-flight requests up to SHUTDOWN_GRACE_PERIOD seconds to finish.
+
+Configuration:
+    ENVIRONMENT: "production" selects the production mode (default development)
+    HOST, PORT: Listen address (default 0.0.0.0:8080)
+    WEB_CONCURRENCY: Production worker processes; "auto" uses one per CPU (default 1).
+        Scripts are stored in process memory, so with several workers a script can
+        only be fetched from the worker that generated it unless the load balancer
+        keeps each client on one worker.
+    SHUTDOWN_DRAIN_DELAY: Seconds a stopping worker stays up while reporting not ready (default 5)
+    SHUTDOWN_GRACE_PERIOD: Seconds in-flight requests get to finish (default 300)
+    FORWARDED_ALLOW_IPS: Comma-separated addresses of the reverse proxy whose
+        X-Forwarded-For header is trusted in production (default 127.0.0.1). It must
+        name the real proxy: "*" lets any client pick the address that generation
+        admission limits per client.
+"""
+from types import FrameType
+from typing import Optional
+import asyncio
+import importlib.util
+import logging
+import os
+import uvicorn
+from uvicorn.supervisors import Multiprocess
+from ..services.job_tracker import SHUTDOWN_GRACE_PERIOD, job_tracker
+
+logger = logging.getLogger(__name__)
+
+APP = "src.api.app:app"
+DRAIN_DELAY = float(os.environ.get("SHUTDOWN_DRAIN_DELAY", "5"))
+
+
+class DrainingServer(uvicorn.Server):
+    """Uvicorn server that reports not ready for a while before it stops accepting connections."""
+
+    def handle_exit(self, sig: int, frame: Optional[FrameType]) -> None:
+        if job_tracker.draining or DRAIN_DELAY <= 0:
+            # A second signal (or no delay configured) stops right away
+            job_tracker.start_draining()
+            super().handle_exit(sig, frame)
+            return
+        job_tracker.start_draining()
+        logger.info(f"[Serving] Shutdown requested; stopping in {DRAIN_DELAY:.0f}s")
+        asyncio.get_event_loop().call_later(DRAIN_DELAY, super().handle_exit, sig, frame)
+
+
+class DrainingSupervisor(Multiprocess):
+    """Stops all workers at once so they drain in parallel rather than one after another."""
+
+    def shutdown(self) -> None:
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.join()
+        logger.info(f"[Serving] Stopped parent process [{self.pid}]")
+
+
+def worker_count() -> int:
+    setting = os.environ.get("WEB_CONCURRENCY", "1").lower()
+    if setting == "auto":
+        return len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+    return max(1, int(setting))
+
+
+def run_development(host: str, port: int) -> None:
+    uvicorn.run(
+        APP,
+        host=host,
+        port=port,
+        reload=True,
+        reload_dirs=["src"],  # Watch the entire src directory
+        log_level="info"
+    )
+
+
+def run_production(host: str, port: int) -> None:
+    workers = worker_count()
+    loop = "uvloop" if importlib.util.find_spec("uvloop") else "asyncio"
+    http = "httptools" if importlib.util.find_spec("httptools") else "h11"
+    config = uvicorn.Config(
+        APP,
+        host=host,
+        port=port,
+        workers=workers,
+        loop=loop,
+        http=http,
+        proxy_headers=True,
+        # Only these peers may set the client address via X-Forwarded-For; admission is keyed on it
+        forwarded_allow_ips=os.environ.get("FORWARDED_ALLOW_IPS", "127.0.0.1"),
+        timeout_graceful_shutdown=SHUTDOWN_GRACE_PERIOD,
+        log_level="info"
+    )
+    logger.info(
+        f"[Serving] Production mode: {workers} worker(s), loop={loop}, http={http}, "
+        f"drain delay {DRAIN_DELAY:.0f}s, grace period {SHUTDOWN_GRACE_PERIOD}s"
+    )
+    if workers > 1:
+        logger.warning("[Serving] Scripts are kept per worker; clients must stay on the worker that generated them")
+    server = DrainingServer(config)
+    if workers > 1:
+        DrainingSupervisor(config, target=server.run, sockets=[config.bind_socket()]).run()
+    else:
+        server.run()
+
+
+def main() -> None:
+    host = os.environ.get("HOST", "0.0.0.0")
+    port = int(os.environ.get("PORT", "8080"))
+    if os.environ.get("ENVIRONMENT", "development").lower() == "production":
+        run_production(host, port)
+    else:
+        run_development(host, port)
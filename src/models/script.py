@@ -1,5 +1,5 @@
-from typing import List, Optional, Dict, Any
-from pydantic import BaseModel
+from typing import Iterator, List, Optional, Dict, Any
+from pydantic import BaseModel, PrivateAttr
 
 class CodeHighlight(BaseModel):
     """Represents a highlighted section of code in a scene."""
@@ -19,22 +19,44 @@ class Scene(BaseModel):
 class Script(BaseModel):
     """Represents the complete explanation script."""
     scenes: List[Scene]
+    # Contents of the files the highlights were taken from, by path; never serialized
+    _sources: Dict[str, str] = PrivateAttr(default_factory=dict)
+    
+    @property
+    def sources(self) -> Dict[str, str]:
+        return self._sources
+    
+    def attach_sources(self, files: List[Dict[str, str]]) -> "Script":
+        """Remember the fetched files ({'path', 'content'}) so storage can reference highlight code by line range."""
+        self._sources.update({f['path']: f['content'] for f in files})
+        return self
     
     @classmethod
-    def from_json_response(cls, json_data: Dict[str, Any]) -> "Script":
+    def from_json_response(cls, json_data: Dict[str, Any], files: Optional[List[Dict[str, str]]] = None) -> "Script":
         """
         Create a Script from the new JSON response format.
         Flattens all LLM-provided scenes from all chapters, with no extra chapter header scenes.
+        When the fetched `files` are given, scenes without a line range get the range
+        where their code is found in the source.
         """
+        locator = None
+        if files:
+            from ..services.line_locator import SourceLocator
+            locator = SourceLocator(files)
         scenes = []
         for chapter in json_data.get("chapters", []):
             chapter_files = chapter.get("files", [])
             for scene_data in chapter.get("scenes", []):
                 file_path = scene_data.get("file_path") or (chapter_files[0] if chapter_files else "unknown")
+                start_line, end_line = scene_data.get("start_line"), scene_data.get("end_line")
+                if locator and start_line is None and scene_data.get("code"):
+                    found = locator.locate(scene_data["code"], file_path, chapter_files)
+                    if found:
+                        file_path, start_line, end_line = found
                 code_highlight = CodeHighlight(
                     file_path=file_path,
-                    start_line=1,
-                    end_line=1,
+                    start_line=start_line or 1,
+                    end_line=end_line or start_line or 1,
                     description=scene_data.get("explanation", ""),
                     code=scene_data.get("code", "")
                 )
@@ -47,22 +69,29 @@ class Script(BaseModel):
                 scenes.append(scene)
         return cls(scenes=scenes)
     
-    def to_markdown(self) -> str:
-        """Convert the script to Markdown format."""
-        markdown = "# Code Explanation Script\n\n"
-        
+    def iter_markdown(self) -> Iterator[str]:
+        """Yield the Markdown rendering of the script one scene at a time."""
+        yield "# Code Explanation Script\n\n"
         for scene in self.scenes:
-            markdown += f"## {scene.title} ({scene.duration}s)\n\n"
-            markdown += f"{scene.content}\n\n"
-            
+            parts = [f"## {scene.title} ({scene.duration}s)\n\n", f"{scene.content}\n\n"]
             if scene.code_highlights:
-                markdown += "### Code Highlights\n\n"
+                parts.append("### Code Highlights\n\n")
                 for highlight in scene.code_highlights:
-                    markdown += f"**{highlight.file_path}** (lines {highlight.start_line}-{highlight.end_line}):\n"
+                    parts.append(f"**{highlight.file_path}** (lines {highlight.start_line}-{highlight.end_line}):\n")
                     if highlight.code:
-                        markdown += f"```\n{highlight.code}\n```\n"
-                    markdown += f"{highlight.description}\n\n"
-            
-            markdown += "---\n\n"
-            
-        return markdown 
\ No newline at end of file
+                        parts.append(f"```\n{highlight.code}\n```\n")
+                    parts.append(f"{highlight.description}\n\n")
+            parts.append("---\n\n")
+            yield "".join(parts)
+    
+    def to_markdown(self) -> str:
+        """Convert the script to Markdown format."""
+        return "".join(self.iter_markdown())
+
+class ChapterOutline(BaseModel):
+    """One planned chapter of a lazily generated script."""
+    number: int
+    title: str
+    files: List[str]
+    tokens: int
+    generated: bool = False
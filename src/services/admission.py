@@ -0,0 +1,195 @@
+"""
+Admission control for script generation.
+
+At most GENERATION_MAX_RUNNING generations run at once; further requests
+wait in a bounded queue, and anything beyond that is turned away at once
+with a Retry-After estimated from the queue depth and recent job durations.
+Each client (the request's IP address) may hold only a few
+running or queued jobs, and freed slots go to the waiting client with the
+fewest running jobs (then the one served least recently), so one heavy
+user cannot starve everyone else.
+
+Configuration:
+    GENERATION_MAX_RUNNING: Generations running at once (default 4)
+    GENERATION_MAX_QUEUE: Requests waiting for a slot before new ones are rejected (default 20)
+    GENERATION_MAX_PER_CLIENT: Running plus queued generations per client (default 2)
+    GENERATION_QUEUE_TIMEOUT: Seconds a request may wait for a slot (default 120)
+    GENERATION_EXPECTED_SECONDS: Initial estimate of one generation's duration (default 90)
+"""
+from collections import Counter, deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict, Optional, Tuple
+import asyncio
+import itertools
+import logging
+import math
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# Weight of the newest job duration in the moving average
+DURATION_SMOOTHING = 0.2
+MAX_RETRY_AFTER = 600
+
+
+class AdmissionRejected(RuntimeError):
+    """Raised when a request is not admitted; maps to an HTTP status with Retry-After."""
+
+    def __init__(self, status_code: int, retry_after: int, reason: str):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class AdmissionController:
+    """Bounded, per-client fair admission of long-running jobs on one event loop."""
+
+    def __init__(
+        self,
+        max_running: int = 4,
+        max_queue: int = 20,
+        max_per_client: int = 2,
+        queue_timeout: float = 120.0,
+        expected_seconds: float = 90.0
+    ):
+        self.max_running = max_running
+        self.max_queue = max_queue
+        self.max_per_client = max_per_client
+        self.queue_timeout = queue_timeout
+        self.avg_seconds = expected_seconds
+        self._running: Dict[str, int] = {}
+        self._waiters: Dict[str, Deque[Tuple[int, asyncio.Future]]] = {}
+        # Sequence number of each active client's latest grant, for round-robin among equals
+        self._last_grant: Dict[str, int] = {}
+        self._seq = itertools.count()
+        self.admitted = 0
+        self.rejected: Counter = Counter()
+
+    @property
+    def running(self) -> int:
+        return sum(self._running.values())
+
+    @property
+    def queued(self) -> int:
+        return sum(len(waiters) for waiters in self._waiters.values())
+
+    def retry_after(self, ahead: Optional[int] = None) -> int:
+        """Seconds until a slot is likely to free up for a request with `ahead` requests queued before it."""
+        ahead = self.queued if ahead is None else ahead
+        return max(1, min(MAX_RETRY_AFTER, math.ceil((ahead + 1) * self.avg_seconds / self.max_running)))
+
+    def _reject(self, status_code: int, kind: str, reason: str) -> AdmissionRejected:
+        self.rejected[kind] += 1
+        logger.info(f"[Admission] Rejected ({kind}): {reason}")
+        return AdmissionRejected(status_code, self.retry_after(), reason)
+
+    def _grant(self, client: str) -> None:
+        self._running[client] = self._running.get(client, 0) + 1
+        self._last_grant[client] = next(self._seq)
+        self.admitted += 1
+
+    def _drop_if_idle(self, client: str) -> None:
+        if client not in self._running and client not in self._waiters:
+            self._last_grant.pop(client, None)
+
+    def _release(self, client: str, seconds: Optional[float] = None) -> None:
+        self._running[client] -= 1
+        if not self._running[client]:
+            del self._running[client]
+        self._drop_if_idle(client)
+        if seconds is not None:
+            self.avg_seconds += DURATION_SMOOTHING * (seconds - self.avg_seconds)
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        """Hand free slots to waiting clients: fewest running jobs first, then least recently served."""
+        while self.running < self.max_running and self._waiters:
+            client = min(
+                self._waiters,
+                key=lambda c: (self._running.get(c, 0), self._last_grant.get(c, -1), self._waiters[c][0][0])
+            )
+            waiters = self._waiters[client]
+            _, future = waiters.popleft()
+            if not waiters:
+                del self._waiters[client]
+            self._grant(client)
+            future.set_result(None)
+
+    def _forget(self, client: str, future: asyncio.Future) -> None:
+        waiters = self._waiters.get(client)
+        if not waiters:
+            return
+        for entry in waiters:
+            if entry[1] is future:
+                waiters.remove(entry)
+                break
+        if not waiters:
+            del self._waiters[client]
+            self._drop_if_idle(client)
+
+    async def _acquire(self, client: str) -> None:
+        held = self._running.get(client, 0) + len(self._waiters.get(client, ()))
+        if held >= self.max_per_client:
+            raise self._reject(429, "client_limit", f"Client already has {held} generation(s) running or queued")
+        if self.running < self.max_running and not self._waiters:
+            self._grant(client)
+            return
+        if self.queued >= self.max_queue:
+            raise self._reject(503, "queue_full", f"Generation queue is full ({self.queued} waiting)")
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(client, deque()).append((next(self._seq), future))
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.queue_timeout)
+        except BaseException as e:
+            self._forget(client, future)
+            if future.done() and not future.cancelled():
+                # The slot was granted just as we gave up; pass it on
+                self._release(client)
+            future.cancel()
+            if isinstance(e, asyncio.TimeoutError):
+                raise self._reject(503, "queue_timeout", f"No generation slot within {self.queue_timeout:.0f}s")
+            raise
+
+    @asynccontextmanager
+    async def admit(self, client: str) -> AsyncIterator[None]:
+        """
+        Hold a generation slot for the enclosed block, waiting in the fair queue if needed.
+
+        Args:
+            client: Identifier used for per-client limits and fairness
+
+        Raises:
+            AdmissionRejected: If the client is over its limit, the queue is full,
+                or no slot freed up within the queue timeout
+        """
+        await self._acquire(client)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(client, time.monotonic() - start)
+
+    def status(self) -> Dict:
+        return {
+            "running": self.running,
+            "queued": self.queued,
+            "max_running": self.max_running,
+            "max_queue": self.max_queue,
+            "clients": len(set(self._running) | set(self._waiters)),
+            "avg_job_seconds": round(self.avg_seconds, 1),
+            "retry_after": self.retry_after(),
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+        }
+
+
+generation_admission = AdmissionController(
+    max_running=int(os.environ.get("GENERATION_MAX_RUNNING", "4")),
+    max_queue=int(os.environ.get("GENERATION_MAX_QUEUE", "20")),
+    max_per_client=int(os.environ.get("GENERATION_MAX_PER_CLIENT", "2")),
+    queue_timeout=float(os.environ.get("GENERATION_QUEUE_TIMEOUT", "120")),
+    expected_seconds=float(os.environ.get("GENERATION_EXPECTED_SECONDS", "90"))
+)
@@ -0,0 +1,186 @@
+"""
+Background writer for debug artifacts and saved scripts.
+
+Raw LLM responses and generated scripts used to be written to test_output/
+inline, adding disk latency to every batch, and same-named debug files from
+concurrent batches overwrote each other. Writes now go through a bounded
+asyncio queue drained by one background task that does the file I/O in the
+offload I/O pool. Debug artifacts get unique names and are rotated by count
+and total size; saved scripts keep their deterministic names and are replaced
+atomically.
+
+Configuration:
+    ARTIFACT_MODE: "full" (default) writes everything, "sampled" writes a share of
+        debug artifacts (saved scripts are always written), "off" writes nothing
+    ARTIFACT_SAMPLE_RATE: Share of debug artifacts kept in sampled mode (default 0.1)
+    ARTIFACT_DIR: Output directory (default test_output)
+    ARTIFACT_MAX_FILES: Debug artifacts kept per group (default 200)
+    ARTIFACT_MAX_MB: Total size of debug artifacts kept per group (default 100)
+    ARTIFACT_QUEUE_SIZE: Pending writes before new ones are dropped (default 100)
+"""
+from pathlib import Path
+from typing import Iterable, Optional, Union
+import asyncio
+import logging
+import os
+import random
+import re
+import time
+import uuid
+from .offload import run_in_pool
+from .logging_setup import SAMPLED
+
+logger = logging.getLogger(__name__)
+
+MODES = ("off", "sampled", "full")
+Content = Union[str, Iterable[str]]
+
+
+def _write_atomic(path: Path, content: Content) -> int:
+    """Write to a temporary file next to `path` and rename it into place; returns bytes written."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex[:8]}.tmp")
+    written = 0
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            for chunk in ([content] if isinstance(content, str) else content):
+                written += f.write(chunk)
+        os.replace(tmp, path)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    return written
+
+
+def _rotate(directory: Path, pattern: str, max_files: int, max_bytes: int) -> int:
+    """Delete the oldest files matching `pattern` beyond the count and size caps; returns files deleted."""
+    entries = []
+    for path in directory.glob(pattern):
+        try:
+            st = path.stat()
+        except OSError:
+            continue
+        entries.append((st.st_mtime_ns, st.st_size, path))
+    entries.sort()
+    total = sum(size for _, size, _ in entries)
+    deleted = 0
+    while entries and (len(entries) > max_files or total > max_bytes):
+        _, size, path = entries.pop(0)
+        path.unlink(missing_ok=True)
+        total -= size
+        deleted += 1
+    return deleted
+
+
+class ArtifactSink:
+    """Queues artifact writes and performs them in the background."""
+
+    def __init__(
+        self,
+        mode: str = "full",
+        sample_rate: float = 0.1,
+        directory: str = "test_output",
+        max_files: int = 200,
+        max_bytes: int = 100 * 1024 * 1024,
+        queue_size: int = 100
+    ):
+        if mode not in MODES:
+            raise ValueError(f"ARTIFACT_MODE must be one of {MODES}, got {mode!r}")
+        self.mode = mode
+        self.sample_rate = sample_rate
+        self.directory = Path(directory)
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.queue_size = queue_size
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.stats = {"queued": 0, "written": 0, "sampled_out": 0, "dropped": 0, "failed": 0, "rotated": 0}
+
+    @classmethod
+    def from_env(cls) -> "ArtifactSink":
+        return cls(
+            mode=os.environ.get("ARTIFACT_MODE", "full").lower(),
+            sample_rate=float(os.environ.get("ARTIFACT_SAMPLE_RATE", "0.1")),
+            directory=os.environ.get("ARTIFACT_DIR", "test_output"),
+            max_files=int(os.environ.get("ARTIFACT_MAX_FILES", "200")),
+            max_bytes=int(float(os.environ.get("ARTIFACT_MAX_MB", "100")) * 1024 * 1024),
+            queue_size=int(os.environ.get("ARTIFACT_QUEUE_SIZE", "100"))
+        )
+
+    def save_debug(self, group: str, label: str, content: Content, suffix: str = ".json") -> Optional[Path]:
+        """
+        Queue a debug artifact under a unique name, subject to the mode and sample rate.
+
+        Args:
+            group: File name prefix; rotation keeps at most max_files/max_bytes per group
+            label: Free-form description added to the name (e.g. the files in a batch)
+            content: Text, or an iterable of text chunks
+
+        Returns:
+            The path that will be written, or None if the artifact is not kept
+        """
+        if self.mode == "off":
+            return None
+        if self.mode == "sampled" and random.random() >= self.sample_rate:
+            self.stats["sampled_out"] += 1
+            return None
+        label = re.sub(r"[^A-Za-z0-9_.-]+", "_", label)[:80]
+        name = f"{group}_{label}_{time.strftime('%Y%m%d-%H%M%S')}_{uuid.uuid4().hex[:8]}{suffix}"
+        path = self.directory / name
+        return path if self._submit(path, content, f"{group}_*{suffix}") else None
+
+    def save_file(self, path: Union[str, Path], content: Content) -> bool:
+        """Queue a write that atomically replaces `path`; skipped only when the mode is off."""
+        if self.mode == "off":
+            return False
+        return self._submit(Path(path), content, None)
+
+    def _submit(self, path: Path, content: Content, rotate_pattern: Optional[str]) -> bool:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._worker is None or self._worker.done():
+            # First use, or a new event loop (e.g. after a restart in tests)
+            self._loop = loop
+            self._queue = asyncio.Queue(maxsize=self.queue_size)
+            self._worker = loop.create_task(self._drain())
+        try:
+            self._queue.put_nowait((path, content, rotate_pattern))
+        except asyncio.QueueFull:
+            self.stats["dropped"] += 1
+            logger.warning(f"[ArtifactSink] Queue full; dropped write of {path}")
+            return False
+        self.stats["queued"] += 1
+        return True
+
+    async def _drain(self) -> None:
+        queue = self._queue
+        while True:
+            path, content, rotate_pattern = await queue.get()
+            try:
+                size = await run_in_pool("artifact_write", _write_atomic, path, content, io=True)
+                self.stats["written"] += 1
+                logger.debug("[ArtifactSink] Wrote %s (%d chars)", path, size, extra=SAMPLED)
+                if rotate_pattern:
+                    self.stats["rotated"] += await run_in_pool(
+                        "artifact_rotate", _rotate, path.parent, rotate_pattern, self.max_files, self.max_bytes, io=True
+                    )
+            except Exception as e:
+                self.stats["failed"] += 1
+                logger.error(f"[ArtifactSink] Failed to write {path}: {e}")
+            finally:
+                queue.task_done()
+
+    async def flush(self) -> None:
+        """Wait until every queued write has finished."""
+        if self._queue is not None and self._loop is asyncio.get_running_loop():
+            await self._queue.join()
+
+    async def close(self) -> None:
+        """Flush pending writes and stop the background task."""
+        await self.flush()
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+
+
+artifact_sink = ArtifactSink.from_env()
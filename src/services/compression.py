@@ -0,0 +1,135 @@
+"""
+Compression codecs for HTTP responses and for data kept in memory.
+
+gzip is always available; zstd and brotli are used when the optional
+`zstandard` and `brotli` packages are installed.
+
+Configuration:
+    COMPRESSION_ENCODINGS: Response encodings in order of server preference (default "zstd,br,gzip")
+    COMPRESSION_MIN_SIZE: Smallest response body, in bytes, worth compressing (default 1024)
+    AT_REST_COMPRESSION: Encoding for stored response bodies and source blobs; "none" disables it
+        (default: zstd if installed, else gzip)
+"""
+from typing import Callable, Dict, List, Optional
+import gzip
+import os
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class StreamCompressor:
+    """Incremental compressor; every chunk is flushed so it can be sent right away."""
+
+    def __init__(self, chunk: Callable[[bytes], bytes], finish: Callable[[], bytes]):
+        self.chunk = chunk
+        self.finish = finish
+
+
+class Codec:
+    """One content coding with whole-buffer and streaming compression."""
+
+    def __init__(self, name: str, compress: Callable[[bytes], bytes], decompress: Callable[[bytes], bytes],
+                 stream: Callable[[], StreamCompressor]):
+        self.name = name
+        self.compress = compress
+        self.decompress = decompress
+        self.stream = stream
+
+
+def _gzip_stream() -> StreamCompressor:
+    c = zlib.compressobj(5, zlib.DEFLATED, 31)
+    return StreamCompressor(lambda data: c.compress(data) + c.flush(zlib.Z_SYNC_FLUSH), c.flush)
+
+
+CODECS: Dict[str, Codec] = {
+    "gzip": Codec("gzip", lambda data: gzip.compress(data, 5), gzip.decompress, _gzip_stream),
+}
+
+if zstandard is not None:
+    def _zstd_stream() -> StreamCompressor:
+        c = zstandard.ZstdCompressor(level=3).compressobj()
+        return StreamCompressor(
+            lambda data: c.compress(data) + c.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK),
+            c.flush
+        )
+
+    CODECS["zstd"] = Codec(
+        "zstd",
+        lambda data: zstandard.ZstdCompressor(level=3).compress(data),
+        # Frames from streaming compressors carry no content size, so allow growth
+        lambda data: zstandard.ZstdDecompressor().decompressobj().decompress(data),
+        _zstd_stream
+    )
+
+if brotli is not None:
+    def _brotli_stream() -> StreamCompressor:
+        c = brotli.Compressor(quality=4)
+        return StreamCompressor(lambda data: c.process(data) + c.flush(), c.finish)
+
+    CODECS["br"] = Codec("br", lambda data: brotli.compress(data, quality=4), brotli.decompress, _brotli_stream)
+
+PREFERRED_ENCODINGS: List[str] = [
+    name for name in (e.strip() for e in os.environ.get("COMPRESSION_ENCODINGS", "zstd,br,gzip").split(","))
+    if name in CODECS
+]
+MIN_SIZE = int(os.environ.get("COMPRESSION_MIN_SIZE", "1024"))
+
+_at_rest = os.environ.get("AT_REST_COMPRESSION", "zstd" if "zstd" in CODECS else "gzip").lower()
+AT_REST_CODEC: Optional[Codec] = CODECS.get(_at_rest) if _at_rest != "none" else None
+
+
+def negotiate(accept_encoding: Optional[str], preferred: Optional[List[str]] = None) -> Optional[str]:
+    """Pick the server's most preferred encoding that the client accepts (q > 0), or None."""
+    if not accept_encoding:
+        return None
+    accepted: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+    for name in preferred if preferred is not None else PREFERRED_ENCODINGS:
+        q = accepted.get(name, accepted.get("*", 0.0))
+        if q > 0:
+            return name
+    return None
+
+
+def encoded_etag(etag: str, encoding: str) -> str:
+    """ETag of the encoded representation: "abc" becomes "abc-gzip", keeping a W/ prefix."""
+    if not etag.endswith('"'):
+        return etag
+    return f'{etag[:-1]}-{encoding}"'
+
+
+def strip_etag_encoding(etag: str) -> str:
+    """Inverse of encoded_etag, for comparing a client's tag against the identity ETag."""
+    for name in ("gzip", "zstd", "br"):
+        suffix = f'-{name}"'
+        if etag.endswith(suffix):
+            return etag[:-len(suffix)] + '"'
+    return etag
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    """Compress with a named codec; module-level so it can run in the offload pool."""
+    return CODECS[encoding].compress(data)
+
+
+def decompress(data: bytes, encoding: str) -> bytes:
+    """Decompress with a named codec; module-level so it can run in the offload pool."""
+    return CODECS[encoding].decompress(data)
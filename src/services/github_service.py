@@ -1,15 +1,18 @@
-from typing import List, Dict, Optional
-from github import Github
-from github.ContentFile import ContentFile
-from github.Repository import Repository
+from typing import List, Dict, Optional, TYPE_CHECKING
+import logging
 import os
-from dotenv import load_dotenv
-import requests
+from .logging_setup import SAMPLED
 
-load_dotenv()
+if TYPE_CHECKING:
+    from github.ContentFile import ContentFile
+    from github.Repository import Repository
+
+logger = logging.getLogger(__name__)
 
 class GitHubService:
     def __init__(self):
+        # PyGithub is slow to import; load it when the service is first built
+        from github import Github
         self.github = Github(os.getenv("GITHUB_TOKEN"))
     
     def _parse_github_url(self, url: str) -> tuple[str, str, str, str]:
@@ -28,24 +31,25 @@ class GitHubService:
     async def get_file_content(self, url: str) -> Dict:
         """Fetch content of a single file from GitHub."""
         try:
-            print(f"[GitHub] Fetching file: {url}")
+            logger.info("[GitHub] Fetching file: %s", url)
             owner, repo, branch, file_path = self._parse_github_url(url)
             repository: Repository = self.github.get_repo(f"{owner}/{repo}")
             content: ContentFile = repository.get_contents(file_path, ref=branch)
-            print(f"[GitHub] Successfully fetched file: {file_path}")
+            logger.debug("[GitHub] Successfully fetched file: %s", file_path)
             return {
                 "path": file_path,
                 "content": content.decoded_content.decode("utf-8"),
-                "type": "file"
+                "type": "file",
+                "sha": content.sha
             }
         except Exception as e:
-            print(f"[GitHub] Error fetching file {url}: {e}")
+            logger.error("[GitHub] Error fetching file %s: %s", url, e)
             raise Exception(f"Error fetching file content: {str(e)}")
 
     async def get_directory_content(self, url: str, file_types: Optional[List[str]] = None) -> List[Dict]:
         """Fetch content of all files in a directory from GitHub."""
         try:
-            print(f"[GitHub] Fetching directory: {url}")
+            logger.info("[GitHub] Fetching directory: %s", url)
             owner, repo, branch, dir_path = self._parse_github_url(url)
             repository: Repository = self.github.get_repo(f"{owner}/{repo}")
             contents = repository.get_contents(dir_path, ref=branch)
@@ -58,47 +62,81 @@ class GitHubService:
                         ext = content.name.split(".")[-1]
                         if ext not in file_types:
                             continue
-                    print(f"[GitHub] Fetching file in directory: {content.path}")
+                    logger.debug("[GitHub] Fetching file in directory: %s", content.path, extra=SAMPLED)
                     files.append({
                         "path": content.path,
                         "content": content.decoded_content.decode("utf-8"),
-                        "type": "file"
+                        "type": "file",
+                        "sha": content.sha
                     })
                 elif content.type == "dir":
                     # Recursively get contents of subdirectory
                     subdir_url = f"https://github.com/{owner}/{repo}/tree/{branch}/{content.path}"
-                    print(f"[GitHub] Recursively fetching subdirectory: {subdir_url}")
+                    logger.debug("[GitHub] Recursively fetching subdirectory: %s", subdir_url, extra=SAMPLED)
                     subdir_files = await self.get_directory_content(subdir_url, file_types)
                     files.extend(subdir_files)
             
-            print(f"[GitHub] Successfully fetched directory: {dir_path} ({len(files)} files)")
+            logger.info("[GitHub] Fetched directory: %s (%d files)", dir_path, len(files))
             return files
         except Exception as e:
-            print(f"[GitHub] Error fetching directory {url}: {e}")
+            logger.error("[GitHub] Error fetching directory %s: %s", url, e)
             raise Exception(f"Error fetching directory content: {str(e)}")
 
     async def fetch_code(self, url: str, file_types: Optional[List[str]] = None) -> List[Dict]:
         """
         Fetch code from a GitHub file or directory URL.
-        Returns a list of file dicts (with 'path', 'content', 'type').
+        Returns a list of file dicts (with 'path', 'content', 'type'), sorted by path.
         """
         if "/blob/" in url:
             # Single file
             file = await self.get_file_content(url)
             return [file]
         elif "/tree/" in url:
-            # Directory
-            return await self.get_directory_content(url, file_types)
+            # Directory; sorted so batch plans match get_file_entries
+            files = await self.get_directory_content(url, file_types)
+            return sorted(files, key=lambda f: f['path'])
         else:
             raise Exception("Invalid GitHub URL: must contain /blob/ or /tree/")
 
-    def get_repo_tree(self, url: str) -> List[str]:
-        """Fetch the full repo tree (all file paths) using the GitHub API."""
+    def _get_tree_items(self, url: str) -> List[Dict]:
+        """Fetch the recursive git tree of the URL's repository and branch."""
         owner, repo, branch, _ = self._parse_github_url(url)
         api_url = f"https://api.github.com/repos/{owner}/{repo}/git/trees/{branch}?recursive=1"
         headers = {"Authorization": f"token {os.getenv('GITHUB_TOKEN')}"}
+        import requests
         response = requests.get(api_url, headers=headers)
         response.raise_for_status()
-        tree = response.json().get('tree', [])
+        data = response.json()
+        if data.get('truncated'):
+            logger.warning("[GitHub] Tree for %s/%s was truncated by the API; listing is incomplete", owner, repo)
+        return data.get('tree', [])
+
+    def get_repo_tree(self, url: str) -> List[str]:
+        """Fetch the full repo tree (all file paths) using the GitHub API."""
+        tree = self._get_tree_items(url)
         file_paths = [item['path'] for item in tree if item['type'] == 'blob']
-        return file_paths 
\ No newline at end of file
+        return file_paths
+
+    def get_file_entries(self, url: str, file_types: Optional[List[str]] = None) -> List[Dict]:
+        """
+        List the files `fetch_code` would fetch for a URL, sorted by path like it, without their content.
+        Uses a single tree request; returns dicts with 'path', 'size', 'sha' and 'type'.
+        """
+        if "/blob/" not in url and "/tree/" not in url:
+            raise Exception("Invalid GitHub URL: must contain /blob/ or /tree/")
+        _, _, _, path = self._parse_github_url(url)
+        # Symlinks (mode 120000) are blobs in the tree but are not fetched as files
+        blobs = [item for item in self._get_tree_items(url) if item['type'] == 'blob' and item.get('mode') != '120000']
+        if "/blob/" in url:
+            entries = [item for item in blobs if item['path'] == path]
+            if not entries:
+                raise Exception(f"Error fetching file content: {path} not found")
+        else:
+            prefix = f"{path}/" if path else ""
+            entries = [
+                item for item in blobs
+                if item['path'].startswith(prefix)
+                and (not file_types or item['path'].rsplit("/", 1)[-1].split(".")[-1] in file_types)
+            ]
+        entries.sort(key=lambda item: item['path'])
+        return [{"path": item['path'], "size": item.get('size', 0), "sha": item['sha'], "type": "file"} for item in entries]
\ No newline at end of file
@@ -0,0 +1,104 @@
+"""
+In-flight generation jobs and the readiness state used for graceful shutdown.
+
+Script generation can take several minutes, so a worker that is asked to
+stop first reports itself not ready (so the load balancer stops sending it
+new work), refuses new generations, and then waits for the jobs it already
+accepted before it exits.
+
+Configuration:
+    SHUTDOWN_GRACE_PERIOD: Seconds in-flight jobs get to finish on shutdown (default 300)
+"""
+from contextlib import asynccontextmanager
+from types import FrameType
+from typing import AsyncIterator, Dict, Optional
+import asyncio
+import logging
+import os
+import time
+from .logging_setup import request_id
+from .profiler import job_profiler
+
+logger = logging.getLogger(__name__)
+
+SHUTDOWN_GRACE_PERIOD = int(os.environ.get("SHUTDOWN_GRACE_PERIOD", "300"))
+
+
+class JobTracker:
+    """Counts running jobs by kind and tracks whether the worker accepts new ones."""
+
+    def __init__(self):
+        self.ready = False
+        self.draining = False
+        self._drain_started = 0.0
+        self._active: Dict[str, int] = {}
+
+    @property
+    def active(self) -> int:
+        return sum(self._active.values())
+
+    @property
+    def accepting(self) -> bool:
+        return self.ready and not self.draining
+
+    def mark_ready(self) -> None:
+        self.ready = True
+
+    def start_draining(self) -> None:
+        """Stop accepting new jobs; safe to call more than once."""
+        if not self.draining:
+            self.draining = True
+            self._drain_started = time.monotonic()
+            logger.info(f"[JobTracker] Draining; {self.active} job(s) in flight")
+
+    @asynccontextmanager
+    async def track(self, kind: str, job_frame: Optional[FrameType] = None) -> AsyncIterator[None]:
+        """
+        Count the enclosed block as a running job of this kind, profiling it if armed.
+
+        Args:
+            kind: Job kind, for counts and reports
+            job_frame: Frame of the coroutine running the job (the caller's
+                `sys._getframe()`); profiles attribute event loop samples by it
+        """
+        self._active[kind] = self._active.get(kind, 0) + 1
+        profile = None
+        try:
+            if job_profiler.armed:
+                # The job ID is the request ID, so admins can arm profiling for an X-Request-ID
+                profile = await job_profiler.start(request_id.get(), kind, job_frame)
+            yield
+        finally:
+            try:
+                if profile is not None:
+                    await job_profiler.finish(profile)
+            finally:
+                self._active[kind] -= 1
+                if not self._active[kind]:
+                    del self._active[kind]
+
+    async def drain(self, timeout: float = SHUTDOWN_GRACE_PERIOD) -> bool:
+        """
+        Wait for running jobs to finish.
+
+        Args:
+            timeout: Maximum seconds to wait, counted from when draining started,
+                so time the server already spent waiting for requests is not granted twice
+
+        Returns:
+            True if every job finished, False if some were still running at the deadline
+        """
+        self.start_draining()
+        deadline = self._drain_started + timeout
+        while self._active and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        if self._active:
+            logger.warning(f"[JobTracker] Grace period over with jobs still running: {self._active}")
+            return False
+        return True
+
+    def status(self) -> Dict:
+        return {"ready": self.ready, "draining": self.draining, "active_jobs": dict(self._active)}
+
+
+job_tracker = JobTracker()
@@ -0,0 +1,233 @@
+"""
+Tolerant parsing for the JSON script format.
+
+LLM output is often almost-valid JSON: wrapped in Markdown fences, carrying a
+trailing comma, or cut off mid-scene when the response hits the token limit.
+The helpers here repair what can be repaired and salvage every complete
+chapter and scene from a truncated response, so a single bad scene no longer
+costs a full re-run of the batch.
+"""
+from typing import Any, Dict, List, Optional, Tuple
+import json
+import re
+
+_FENCE = re.compile(r"```[a-zA-Z0-9_-]*[ \t]*\r?\n?")
+_CLOSERS = {"{": "}", "[": "]"}
+MAX_SALVAGE_ATTEMPTS = 25
+
+
+class RecoveryResult:
+    """Outcome of a tolerant parse."""
+
+    def __init__(self, data: Any, repaired: bool = False, truncated: bool = False):
+        self.data = data
+        self.repaired = repaired
+        self.truncated = truncated
+
+
+def strip_code_fences(text: str) -> str:
+    """Return the JSON payload from a response that may be wrapped in Markdown fences or prose."""
+    text = text.strip()
+    fence = _FENCE.search(text)
+    if fence and (fence.start() == 0 or text.find("{") > fence.start()):
+        body = text[fence.end():]
+        closing = body.rfind("```")
+        text = body[:closing] if closing != -1 else body
+    start = text.find("{")
+    return text[start:].strip() if start > 0 else text.strip()
+
+
+def remove_trailing_commas(text: str) -> str:
+    """Drop commas that directly precede a closing bracket, ignoring string contents."""
+    out = []
+    in_string = False
+    escaped = False
+    pending_comma = None
+    for ch in text:
+        if in_string:
+            out.append(ch)
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if pending_comma is not None:
+            if ch.isspace():
+                pending_comma.append(ch)
+                continue
+            if ch not in "}]":
+                out.append(",")
+            out.extend(pending_comma)
+            pending_comma = None
+        if ch == ",":
+            pending_comma = []
+            continue
+        if ch == '"':
+            in_string = True
+        out.append(ch)
+    if pending_comma is not None:
+        out.extend(pending_comma)
+    return "".join(out)
+
+
+def _checkpoints(text: str) -> Tuple[List[Tuple[int, str]], bool]:
+    """
+    Scan `text` once and record every position where a nested value just closed.
+
+    Returns the checkpoints as (end_index, closing_suffix) pairs, where the
+    suffix closes all brackets still open at that point, and whether the
+    scan ended inside an unterminated structure.
+    """
+    stack: List[str] = []
+    checkpoints: List[Tuple[int, str]] = []
+    in_string = False
+    escaped = False
+    for i, ch in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch in _CLOSERS:
+            stack.append(_CLOSERS[ch])
+        elif ch in "}]":
+            if not stack or stack[-1] != ch:
+                break
+            stack.pop()
+            if stack:
+                checkpoints.append((i + 1, "".join(reversed(stack))))
+    return checkpoints, bool(stack) or in_string
+
+
+def _loads(text: str) -> Any:
+    # strict=False tolerates raw newlines and tabs inside strings
+    return json.loads(text, strict=False)
+
+
+def recover_json(raw: str) -> RecoveryResult:
+    """
+    Parse LLM JSON output, repairing fences and trailing commas and salvaging truncated output.
+
+    Raises:
+        ValueError: If nothing parseable can be recovered
+    """
+    text = strip_code_fences(raw)
+    try:
+        return RecoveryResult(_loads(text))
+    except ValueError:
+        pass
+    cleaned = remove_trailing_commas(text)
+    try:
+        return RecoveryResult(_loads(cleaned), repaired=True)
+    except ValueError as e:
+        error = e
+    checkpoints, unterminated = _checkpoints(cleaned)
+    for end, suffix in reversed(checkpoints[-MAX_SALVAGE_ATTEMPTS:]):
+        candidate = remove_trailing_commas(cleaned[:end].rstrip().rstrip(",") + suffix)
+        try:
+            return RecoveryResult(_loads(candidate), repaired=True, truncated=True)
+        except ValueError:
+            continue
+    raise ValueError(f"Could not recover JSON ({'truncated' if unterminated else 'malformed'}): {error}")
+
+
+def sanitize_script_data(data: Any, line_refs: bool = False) -> Tuple[Dict[str, Any], int]:
+    """
+    Keep every chapter and scene that satisfies the script schema.
+
+    Scenes with an empty or missing `title` or `explanation`, or without a
+    string `code` (which may be empty, for context scenes), are dropped; a
+    missing `duration` or `type_of_code` is filled with a default. With
+    `line_refs`, scenes need `file_path`, `start_line` and `end_line` instead of `code`.
+
+    Returns:
+        The cleaned script data and the number of scenes that were dropped
+    """
+    if not isinstance(data, dict) or not isinstance(data.get("chapters"), list):
+        raise ValueError("LLM JSON missing 'chapters' array")
+    required = ("title", "explanation", "file_path") if line_refs else ("title", "explanation")
+    chapters = []
+    dropped = 0
+    for chapter in data["chapters"]:
+        if not isinstance(chapter, dict) or not isinstance(chapter.get("scenes"), list):
+            continue
+        scenes = []
+        for scene in chapter["scenes"]:
+            if not isinstance(scene, dict) or not all(scene.get(k) for k in required):
+                dropped += 1
+                continue
+            if not line_refs and not isinstance(scene.get("code"), str):
+                dropped += 1
+                continue
+            if line_refs and not _valid_line_range(scene):
+                dropped += 1
+                continue
+            if not isinstance(scene.get("duration"), int):
+                try:
+                    scene["duration"] = int(scene.get("duration"))
+                except (TypeError, ValueError):
+                    scene["duration"] = 20
+            scene.setdefault("type_of_code", "plaintext")
+            scenes.append(scene)
+        if scenes:
+            chapters.append({
+                **chapter,
+                "title": chapter.get("title") or "Untitled",
+                "files": chapter.get("files") if isinstance(chapter.get("files"), list) else [],
+                "scenes": scenes,
+            })
+    return {"chapters": chapters}, dropped
+
+
+def _valid_line_range(scene: Dict[str, Any]) -> bool:
+    """Coerce `start_line`/`end_line` to ints in place; False if they do not form a range."""
+    try:
+        start, end = int(scene.get("start_line")), int(scene.get("end_line"))
+    except (TypeError, ValueError):
+        return False
+    if start < 1 or end < start:
+        return False
+    scene["start_line"], scene["end_line"] = start, end
+    return True
+
+
+def merge_continuation(data: Dict[str, Any], continuation: Dict[str, Any]) -> Dict[str, Any]:
+    """Append continued chapters, extending the last chapter when the model resumes it."""
+    chapters = list(data["chapters"])
+    for chapter in continuation["chapters"]:
+        if chapters and chapter["title"] == chapters[-1]["title"]:
+            last = chapters[-1]
+            seen = {scene["title"] for scene in last["scenes"]}
+            last["scenes"].extend(s for s in chapter["scenes"] if s["title"] not in seen)
+            last["files"] = last["files"] + [f for f in chapter["files"] if f not in last["files"]]
+        else:
+            chapters.append(chapter)
+    return {"chapters": chapters}
+
+
+def build_continuation_prompt(data: Dict[str, Any], files: List[Dict[str, str]]) -> str:
+    """Ask the model for only the part of the script that was cut off."""
+    covered = {path for chapter in data["chapters"] for path in chapter["files"]}
+    missing = [f["path"] for f in files if f["path"] not in covered]
+    last_chapter: Optional[Dict[str, Any]] = data["chapters"][-1] if data["chapters"] else None
+    prompt = "Your previous response was cut off before the JSON was complete. "
+    if last_chapter:
+        prompt += (
+            f"The last complete scene was \"{last_chapter['scenes'][-1]['title']}\" "
+            f"in the chapter \"{last_chapter['title']}\". "
+            "Continue from the scene after it; if that chapter is unfinished, repeat its exact title. "
+        )
+    if missing:
+        prompt += "These files have not been covered yet: " + ", ".join(missing) + ". "
+    prompt += (
+        "Output a new JSON object with the same schema containing only the remaining chapters and scenes. "
+        "Do not repeat scenes that were already completed."
+    )
+    return prompt
@@ -0,0 +1,144 @@
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+import asyncio
+import logging
+import os
+import sys
+from ..models.script import ChapterOutline, Scene, Script
+from .admission import AdmissionRejected, generation_admission
+from .job_tracker import job_tracker
+
+logger = logging.getLogger(__name__)
+
+# Generate the following chapter in the background when a chapter is read
+LAZY_PREFETCH_NEXT = os.environ.get("LAZY_PREFETCH_NEXT", "true").lower() == "true"
+# Lazy scripts kept for on-demand chapters; each holds its fetched sources until complete
+LAZY_STORE_MAX_SCRIPTS = int(os.environ.get("LAZY_STORE_MAX_SCRIPTS", "100"))
+
+
+class LazyScript:
+    """
+    Generation state for a script whose chapters are produced on first access.
+    Holds the batch plan, the chapters generated so far and per-chapter locks.
+    The fetched sources are dropped once every chapter has been generated.
+    """
+
+    def __init__(
+        self,
+        github_url: str,
+        proficiency: str,
+        depth: str,
+        batches: List[List[Dict]],
+        batch_tokens: List[int],
+        files: List[Dict]
+    ):
+        self.github_url = github_url
+        self.proficiency = proficiency
+        self.depth = depth
+        self.batches = batches
+        self.batch_tokens = batch_tokens
+        self.files = files
+        self.chapter_count = len(batches)
+        self.chapter_files = [[f['path'] for f in batch] for batch in batches]
+        # Scenes ahead of chapter 1 (intro, skipped files) and one header scene per chapter
+        self.lead_scenes: List[Scene] = []
+        self.headers: List[Scene] = []
+        self.chapters: Dict[int, List[Scene]] = {}
+        # Serializes writes of the growing script back to the script store
+        self.store_lock = asyncio.Lock()
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self._prefetch_tasks: Set[asyncio.Task] = set()
+
+    @property
+    def complete(self) -> bool:
+        return len(self.chapters) == self.chapter_count
+
+    def script(self) -> Script:
+        """The script so far, in reading order: each chapter's header followed by its scenes once generated."""
+        scenes = list(self.lead_scenes)
+        for number, header in enumerate(self.headers, start=1):
+            scenes.append(header)
+            scenes.extend(self.chapters.get(number, []))
+        return Script(scenes=scenes).attach_sources(self.files)
+
+    def release_sources(self) -> None:
+        """Drop the fetched files once no chapter is left to generate."""
+        if self.complete:
+            self.files = []
+            self.batches = [[] for _ in self.batches]
+
+    def lock_for(self, number: int) -> asyncio.Lock:
+        return self._locks.setdefault(number, asyncio.Lock())
+
+    def outline(self) -> List[ChapterOutline]:
+        """The chapter plan with file lists and token counts."""
+        return [
+            ChapterOutline(
+                number=idx + 1,
+                title=f"Chapter {idx+1}: Files in this chapter",
+                files=paths,
+                tokens=tokens,
+                generated=(idx + 1) in self.chapters
+            )
+            for idx, (paths, tokens) in enumerate(zip(self.chapter_files, self.batch_tokens))
+        ]
+
+    def prefetch(self, number: int, generate: Callable[[int], Awaitable[List[Scene]]], client: str) -> None:
+        """
+        Schedule background generation of chapter `number` if prefetching is enabled and it is still missing.
+
+        The work is admitted like any other generation of `client`, so it counts
+        toward that client's limits, and is skipped if it is not admitted.
+        """
+        if not LAZY_PREFETCH_NEXT or not 1 <= number <= self.chapter_count or number in self.chapters:
+            return
+        if job_tracker.draining:
+            # Speculative work would only delay shutdown
+            return
+        if self.lock_for(number).locked():
+            return
+
+        async def _run():
+            try:
+                async with generation_admission.admit(client):
+                    if job_tracker.draining:
+                        return
+                    # Tracked so shutdown waits for it instead of cutting off an LLM call
+                    async with job_tracker.track("prefetch_chapter", sys._getframe()):
+                        await generate(number)
+            except AdmissionRejected as e:
+                logger.info(f"[LazyChapters] Prefetch of chapter {number} not admitted: {e.reason}")
+            except Exception as e:
+                logger.warning(f"[LazyChapters] Prefetch of chapter {number} failed: {e}")
+
+        task = asyncio.create_task(_run())
+        # Keep a reference so the task is not garbage collected mid-flight
+        self._prefetch_tasks.add(task)
+        task.add_done_callback(self._prefetch_tasks.discard)
+
+
+class LazyScriptStore:
+    """Lazy scripts by ID; the least recently used are evicted beyond `max_entries`."""
+
+    def __init__(self, max_entries: int = LAZY_STORE_MAX_SCRIPTS):
+        self.max_entries = max_entries
+        self._scripts: "OrderedDict[str, LazyScript]" = OrderedDict()
+
+    def get(self, script_id: str) -> Optional[LazyScript]:
+        lazy = self._scripts.get(script_id)
+        if lazy is not None:
+            self._scripts.move_to_end(script_id)
+        return lazy
+
+    def put(self, script_id: str, lazy: LazyScript) -> None:
+        self._scripts[script_id] = lazy
+        self._scripts.move_to_end(script_id)
+        while len(self._scripts) > self.max_entries:
+            evicted, _ = self._scripts.popitem(last=False)
+            logger.info(f"[LazyChapters] Evicted lazy script {evicted}; its remaining chapters can no longer be generated")
+
+    def __contains__(self, script_id: str) -> bool:
+        return script_id in self._scripts
+
+    def __len__(self) -> int:
+        return len(self._scripts)
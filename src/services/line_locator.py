@@ -0,0 +1,112 @@
+"""
+Locate code snippets quoted by the LLM in the fetched source files.
+
+JSON-mode scenes carry the highlighted code but no line numbers. `LineIndex`
+maps the hash of every whitespace-normalized line of a file to the positions
+where it occurs. A snippet is located by letting each of its lines vote for
+the offset (file position minus snippet position) it implies; the offset with
+most votes wins. Lines the model reindented, reflowed or slightly edited
+simply cast no vote, so the match tolerates small differences, and the work
+is linear in the size of the file plus the snippet.
+"""
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+# Lines that occur more often than this ("}", "return", "else:") carry no location information
+MAX_OCCURRENCES = 32
+# Share of the snippet's distinctive lines that must agree on the location
+MIN_MATCH_RATIO = 0.5
+# How far (in lines) a matching line may drift from the winning offset, for inserted or dropped lines
+MAX_DRIFT = 3
+
+
+def normalize_line(line: str) -> str:
+    """Collapse all whitespace so indentation and spacing differences do not matter."""
+    return " ".join(line.split())
+
+
+class LineIndex:
+    """Normalized line hash -> 0-based line positions for one file."""
+
+    def __init__(self, content: str):
+        lines = content.splitlines()
+        self.line_count = len(lines)
+        self._positions: Dict[int, List[int]] = {}
+        for pos, line in enumerate(lines):
+            normalized = normalize_line(line)
+            if normalized:
+                self._positions.setdefault(hash(normalized), []).append(pos)
+
+    def locate(self, snippet: str) -> Optional[Tuple[int, int]]:
+        """
+        Find the snippet's line range in the file.
+
+        Returns:
+            (start_line, end_line), 1-based and inclusive, or None if the snippet is not found
+        """
+        snippet_lines = snippet.strip("\n").splitlines()
+        candidates: List[Tuple[int, List[int]]] = []
+        votes: Counter = Counter()
+        informative = 0
+        for k, line in enumerate(snippet_lines):
+            normalized = normalize_line(line)
+            if not normalized:
+                continue
+            positions = self._positions.get(hash(normalized), ())
+            if len(positions) > MAX_OCCURRENCES:
+                continue
+            informative += 1
+            if positions:
+                candidates.append((k, positions))
+                for pos in positions:
+                    votes[pos - k] += 1
+        if not votes:
+            return None
+        offset = votes.most_common(1)[0][0]
+
+        # Lines that matched near the winning offset support it, allowing for inserted or dropped lines
+        first = last = None
+        support = 0
+        for k, positions in candidates:
+            near = [pos for pos in positions if abs(pos - k - offset) <= MAX_DRIFT]
+            if not near:
+                continue
+            support += 1
+            pos = min(near, key=lambda p: abs(p - k - offset))
+            if first is None or pos - k < first[0] - first[1]:
+                first = (pos, k)
+            if last is None or pos > last[0]:
+                last = (pos, k)
+        if support < MIN_MATCH_RATIO * informative:
+            return None
+        # Extend the matched lines to the snippet's own first and last lines
+        start = max(0, first[0] - first[1])
+        end = min(self.line_count - 1, last[0] + (len(snippet_lines) - 1 - last[1]))
+        return start + 1, max(start, end) + 1
+
+
+class SourceLocator:
+    """Lazily built line indexes for a set of fetched files ({'path', 'content'} dicts)."""
+
+    def __init__(self, files: List[Dict[str, str]]):
+        self._contents = {f['path']: f['content'] for f in files}
+        self._indexes: Dict[str, LineIndex] = {}
+
+    def index(self, path: str) -> Optional[LineIndex]:
+        if path not in self._contents:
+            return None
+        index = self._indexes.get(path)
+        if index is None:
+            index = self._indexes[path] = LineIndex(self._contents[path])
+        return index
+
+    def locate(self, snippet: str, path: str, fallback_paths: List[str] = ()) -> Optional[Tuple[str, int, int]]:
+        """Find the snippet in `path`, then in `fallback_paths`; returns (path, start_line, end_line) or None."""
+        for candidate in [path, *fallback_paths]:
+            index = self.index(candidate)
+            if index is None:
+                continue
+            found = index.locate(snippet)
+            if found:
+                return candidate, found[0], found[1]
+        return None
@@ -0,0 +1,100 @@
+"""
+The app-wide OpenAI client and its HTTP connection pool.
+
+Every LLM call (script batches, the intro chapter, the test endpoints)
+goes through one AsyncOpenAI client, so concurrent requests reuse warm
+keep-alive connections instead of each paying a TLS handshake. The app
+lifespan closes it on shutdown.
+
+Configuration:
+    LLM_MAX_CONNECTIONS: Maximum open connections to the API (default 20)
+    LLM_MAX_KEEPALIVE: Idle connections kept open for reuse (default 10)
+    LLM_KEEPALIVE_EXPIRY: Seconds an idle connection is kept (default 60)
+    LLM_HTTP2: "true", "false" or "auto"; auto uses HTTP/2 when the `h2` package is installed (default auto)
+    LLM_CONNECT_TIMEOUT: Seconds to establish a connection (default 10)
+    LLM_READ_TIMEOUT: Seconds to wait for response data; long completions need a generous value (default 180)
+    LLM_WRITE_TIMEOUT: Seconds to send the request (default 30)
+    LLM_POOL_TIMEOUT: Seconds to wait for a free pooled connection (default 30)
+"""
+from typing import Optional, TYPE_CHECKING
+import importlib.util
+import logging
+import os
+import threading
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+
+logger = logging.getLogger(__name__)
+
+_client: Optional["AsyncOpenAI"] = None
+_lock = threading.Lock()
+
+
+def http2_enabled() -> bool:
+    setting = os.environ.get("LLM_HTTP2", "auto").lower()
+    if setting == "auto":
+        return importlib.util.find_spec("h2") is not None
+    return setting == "true"
+
+
+def create_llm_client(api_key: str) -> "AsyncOpenAI":
+    """
+    Build an AsyncOpenAI client on a tuned httpx connection pool.
+
+    Args:
+        api_key: OpenAI API key
+
+    Returns:
+        A new client; callers normally use `get_llm_client` instead
+    """
+    # Both libraries are slow to import; load them when the client is first built
+    import httpx
+    from openai import AsyncOpenAI
+
+    limits = httpx.Limits(
+        max_connections=int(os.environ.get("LLM_MAX_CONNECTIONS", "20")),
+        max_keepalive_connections=int(os.environ.get("LLM_MAX_KEEPALIVE", "10")),
+        keepalive_expiry=float(os.environ.get("LLM_KEEPALIVE_EXPIRY", "60"))
+    )
+    timeout = httpx.Timeout(
+        connect=float(os.environ.get("LLM_CONNECT_TIMEOUT", "10")),
+        read=float(os.environ.get("LLM_READ_TIMEOUT", "180")),
+        write=float(os.environ.get("LLM_WRITE_TIMEOUT", "30")),
+        pool=float(os.environ.get("LLM_POOL_TIMEOUT", "30"))
+    )
+    http2 = http2_enabled()
+    http_client = httpx.AsyncClient(limits=limits, timeout=timeout, http2=http2, follow_redirects=True)
+    logger.info(
+        f"[LLMClient] Created client (max_connections={limits.max_connections}, "
+        f"keepalive={limits.max_keepalive_connections}, http2={http2})"
+    )
+    # Retries are handled by the shared retry engine, not the SDK
+    return AsyncOpenAI(api_key=api_key, max_retries=0, timeout=timeout, http_client=http_client)
+
+
+def get_llm_client() -> "AsyncOpenAI":
+    """
+    Return the shared client, creating it on first use.
+
+    Raises:
+        ValueError: If OPENAI_API_KEY is not set
+    """
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                api_key = os.getenv("OPENAI_API_KEY")
+                if not api_key:
+                    raise ValueError("OPENAI_API_KEY environment variable is not set")
+                _client = create_llm_client(api_key)
+    return _client
+
+
+async def close_llm_client() -> None:
+    """Close the shared client's connections; the next `get_llm_client` builds a new one."""
+    global _client
+    with _lock:
+        client, _client = _client, None
+    if client is not None:
+        await client.close()
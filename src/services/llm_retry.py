@@ -0,0 +1,374 @@
+"""
+Shared retry subsystem for every LLM call in the app.
+
+Combines decorrelated-jitter backoff, server-provided wait hints
+(`Retry-After`, `retry-after-ms`, `x-ratelimit-reset-*`), a process-wide
+retry budget and a circuit breaker so that a degraded upstream does not
+turn every request into minutes of synchronized backoff.
+"""
+from typing import Any, Awaitable, Callable, Dict, Optional, TYPE_CHECKING
+from email.utils import parsedate_to_datetime
+import asyncio
+import logging
+import os
+import random
+import re
+import time
+
+from .metrics import generation_labels, llm_retries, observe_stage, record_usage
+
+if TYPE_CHECKING:
+    import httpx
+
+logger = logging.getLogger(__name__)
+
+# Weight of the newest call in the average call duration
+CALL_TIME_SMOOTHING = 0.2
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised when the circuit breaker is open and calls fail fast."""
+
+    def __init__(self, retry_in: float):
+        super().__init__(f"LLM upstream is unhealthy; circuit open for another {retry_in:.1f}s")
+        self.retry_in = retry_in
+
+
+def parse_reset_duration(value: Optional[str]) -> Optional[float]:
+    """Parse OpenAI reset values such as '20ms', '1s' or '6m0s' into seconds."""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts or "".join(n + u for n, u in parts) != value:
+        return None
+    scale = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+    return sum(float(number) * scale[unit] for number, unit in parts)
+
+
+def parse_retry_after(headers: Optional["httpx.Headers"]) -> Optional[float]:
+    """
+    Extract the server's requested wait time from response headers.
+
+    `retry-after-ms` and `Retry-After` (delta-seconds or HTTP-date) win. Otherwise
+    the `x-ratelimit-reset-*` header of whichever limit is exhausted is used,
+    falling back to the longest reset that is present.
+    """
+    if not headers:
+        return None
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return max(0.0, float(retry_after_ms) / 1000.0)
+        except ValueError:
+            pass
+    retry_after = headers.get("retry-after")
+    if retry_after:
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+    resets = {}
+    for kind in ("requests", "tokens"):
+        reset = parse_reset_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+        if reset is not None:
+            resets[kind] = reset
+            if headers.get(f"x-ratelimit-remaining-{kind}") == "0":
+                return reset
+    return max(resets.values()) if resets else None
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Classify an exception by type and status code, never by message text."""
+    # Imported here so importing this module does not load the HTTP client stack
+    import httpx
+    import openai
+    if isinstance(error, (openai.APIConnectionError, httpx.TimeoutException,
+                          httpx.TransportError, asyncio.TimeoutError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in (408, 409, 429) or error.status_code >= 500
+    return False
+
+
+def _error_headers(error: BaseException) -> Optional["httpx.Headers"]:
+    response = getattr(error, "response", None)
+    return getattr(response, "headers", None)
+
+
+class DecorrelatedJitter:
+    """Backoff schedule from 'decorrelated jitter': sleep = U(base, 3 * previous), capped."""
+
+    def __init__(self, base_delay: float, max_delay: float):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def next_delay(self, previous: float) -> float:
+        upper = max(self.base_delay, previous * 3)
+        return min(self.max_delay, random.uniform(self.base_delay, upper))
+
+
+class RetryBudget:
+    """
+    Process-wide token bucket that bounds retries to a fraction of traffic.
+
+    Every first attempt deposits `ratio` tokens, every retry withdraws one, and
+    a small reserve refills over time so low-traffic processes can still retry.
+    """
+
+    def __init__(self, ratio: float = 0.2, min_per_second: float = 0.5, max_balance: float = 20.0):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_balance = max_balance
+        self._balance = max_balance
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._balance = min(self.max_balance, self._balance + (now - self._updated) * self.min_per_second)
+        self._updated = now
+
+    def record_request(self) -> None:
+        self._refill()
+        self._balance = min(self.max_balance, self._balance + self.ratio)
+
+    def try_withdraw(self) -> bool:
+        self._refill()
+        if self._balance >= 1.0:
+            self._balance -= 1.0
+            return True
+        return False
+
+    @property
+    def balance(self) -> float:
+        self._refill()
+        return self._balance
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker with a single half-open probe.
+
+    Only upstream failures (5xx, timeouts, connection errors) count; client
+    errors and rate limits say nothing about upstream health.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._probe_started = 0.0
+
+    def before_call(self) -> bool:
+        """
+        Raise CircuitOpenError unless a call is currently allowed.
+
+        Returns:
+            True if the call is the half-open probe; the caller must end it with
+            record_success, record_failure or release_probe
+        """
+        now = time.monotonic()
+        if self.state == self.OPEN:
+            elapsed = now - self._opened_at
+            if elapsed < self.reset_timeout:
+                raise CircuitOpenError(self.reset_timeout - elapsed)
+            self.state = self.HALF_OPEN
+            self._probe_in_flight = False
+        if self.state == self.HALF_OPEN:
+            # A probe older than reset_timeout is presumed lost, so it cannot wedge the breaker
+            if self._probe_in_flight and now - self._probe_started < self.reset_timeout:
+                raise CircuitOpenError(self.reset_timeout - (now - self._probe_started))
+            self._probe_in_flight = True
+            self._probe_started = now
+            return True
+        return False
+
+    def record_success(self) -> None:
+        if self.state != self.CLOSED:
+            logger.info("[Throttling] Circuit breaker closed after successful probe")
+        self.state = self.CLOSED
+        self._failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        self._probe_in_flight = False
+        if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.warning(f"[Throttling] Circuit breaker opened after {self._failures} consecutive upstream failures")
+            self.state = self.OPEN
+            self._opened_at = time.monotonic()
+
+    def release_probe(self) -> None:
+        """Give back a half-open probe slot when the call ended without a health signal."""
+        self._probe_in_flight = False
+
+
+class RetryEngine:
+    """Executes LLM calls with backoff, server wait hints, a retry budget and a circuit breaker."""
+
+    def __init__(
+        self,
+        max_retries: int = 3,
+        base_delay: float = 1.0,
+        max_delay: float = 30.0,
+        max_hint_delay: float = 120.0,
+        budget: Optional[RetryBudget] = None,
+        breaker: Optional[CircuitBreaker] = None,
+        expected_call_seconds: float = 30.0,
+    ):
+        self.max_retries = max_retries
+        self.backoff = DecorrelatedJitter(base_delay, max_delay)
+        self.max_hint_delay = max_hint_delay
+        self.budget = budget or RetryBudget()
+        self.breaker = breaker or CircuitBreaker()
+        # Shared "do not send before" deadline learned from rate-limit headers.
+        self._blocked_until = 0.0
+        # Moving average of successful call durations, for generation time estimates
+        self.avg_call_seconds = expected_call_seconds
+        self.stats: Dict[str, int] = {"calls": 0, "retries": 0, "budget_exhausted": 0, "circuit_rejections": 0}
+
+    @classmethod
+    def from_env(cls) -> "RetryEngine":
+        return cls(
+            max_retries=int(os.environ.get("LLM_RETRY_MAX_RETRIES", "3")),
+            base_delay=float(os.environ.get("LLM_RETRY_BASE_DELAY", "1.0")),
+            max_delay=float(os.environ.get("LLM_RETRY_MAX_DELAY", "30.0")),
+            max_hint_delay=float(os.environ.get("LLM_RETRY_MAX_HINT_DELAY", "120.0")),
+            budget=RetryBudget(
+                ratio=float(os.environ.get("LLM_RETRY_BUDGET_RATIO", "0.2")),
+                min_per_second=float(os.environ.get("LLM_RETRY_BUDGET_MIN_PER_SECOND", "0.5")),
+                max_balance=float(os.environ.get("LLM_RETRY_BUDGET_MAX", "20")),
+            ),
+            breaker=CircuitBreaker(
+                failure_threshold=int(os.environ.get("LLM_CIRCUIT_FAILURE_THRESHOLD", "5")),
+                reset_timeout=float(os.environ.get("LLM_CIRCUIT_RESET_TIMEOUT", "30.0")),
+            ),
+            expected_call_seconds=float(os.environ.get("LLM_EXPECTED_CALL_SECONDS", "30.0")),
+        )
+
+    def blocked_for(self) -> float:
+        """Seconds until the shared rate-limit deadline passes (0 if not blocked)."""
+        return max(0.0, self._blocked_until - time.monotonic())
+
+    async def _timed_call(self, llm_call: Callable[..., Awaitable[Any]], args, kwargs) -> Any:
+        started = time.monotonic()
+        result = await llm_call(*args, **kwargs)
+        elapsed = time.monotonic() - started
+        self.avg_call_seconds += CALL_TIME_SMOOTHING * (elapsed - self.avg_call_seconds)
+        observe_stage("llm_call", elapsed)
+        record_usage(getattr(result, "usage", None))
+        return result
+
+    async def call(
+        self,
+        llm_call: Callable[..., Awaitable[Any]],
+        *args,
+        max_retries: Optional[int] = None,
+        semaphore: Optional[asyncio.Semaphore] = None,
+        **kwargs,
+    ) -> Any:
+        """
+        Call `llm_call(*args, **kwargs)` and retry transient failures.
+
+        Args:
+            llm_call: Async function to call
+            max_retries: Override for the number of retries after the first attempt
+            semaphore: Optional concurrency limiter held only while a request is in flight
+
+        Returns:
+            Result from llm_call
+
+        Raises:
+            CircuitOpenError: If the upstream is currently considered unhealthy
+            RuntimeError: If retries or the retry budget are exhausted
+            Exception: Original exception if not a retryable error
+        """
+        retries = self.max_retries if max_retries is None else max_retries
+        self.stats["calls"] += 1
+        self.budget.record_request()
+        delay = self.backoff.base_delay
+        attempt = 0
+        while True:
+            wait = self.blocked_for()
+            if wait > 0:
+                await asyncio.sleep(wait + random.uniform(0, self.backoff.base_delay))
+            try:
+                is_probe = self.breaker.before_call()
+            except CircuitOpenError:
+                self.stats["circuit_rejections"] += 1
+                raise
+            try:
+                logger.info(f"[Throttling] Making LLM call (attempt {attempt+1}/{retries+1})...")
+                if semaphore is not None:
+                    async with semaphore:
+                        result = await self._timed_call(llm_call, args, kwargs)
+                else:
+                    result = await self._timed_call(llm_call, args, kwargs)
+            except Exception as e:
+                if not is_retryable(e):
+                    if is_probe:
+                        self.breaker.release_probe()
+                    logger.error(f"[Throttling] Non-retryable error on attempt {attempt+1}: {e}")
+                    raise
+                rate_limited = getattr(e, "status_code", None) == 429
+                if rate_limited:
+                    if is_probe:
+                        self.breaker.release_probe()
+                else:
+                    self.breaker.record_failure()
+                    if self.breaker.state == CircuitBreaker.OPEN:
+                        raise CircuitOpenError(self.breaker.reset_timeout) from e
+                if attempt >= retries:
+                    raise RuntimeError(f"Exceeded maximum retries ({retries}) for LLM call: {e}") from e
+                if not self.budget.try_withdraw():
+                    self.stats["budget_exhausted"] += 1
+                    raise RuntimeError(f"LLM retry budget exhausted; not retrying: {e}") from e
+
+                hint = parse_retry_after(_error_headers(e))
+                if hint is not None:
+                    if hint > self.max_hint_delay:
+                        raise RuntimeError(f"LLM upstream asked to wait {hint:.0f}s, longer than allowed: {e}") from e
+                    wait_time = hint + random.uniform(0, self.backoff.base_delay)
+                    if rate_limited:
+                        self._blocked_until = max(self._blocked_until, time.monotonic() + hint)
+                else:
+                    delay = self.backoff.next_delay(delay)
+                    wait_time = delay
+                attempt += 1
+                self.stats["retries"] += 1
+                llm_retries.inc(*generation_labels())
+                logger.warning(f"[Throttling] {type(e).__name__}: {e}. Retrying in {wait_time:.2f}s (attempt {attempt+1}/{retries+1})...")
+                await asyncio.sleep(wait_time)
+                continue
+            except BaseException:
+                # Cancelled (timeout, shutdown, client gone): no health signal, but free the probe slot
+                if is_probe:
+                    self.breaker.release_probe()
+                raise
+            self.breaker.record_success()
+            return result
+
+
+llm_retry_engine = RetryEngine.from_env()
+
+
+async def call_llm_with_retries(llm_call, *args, max_retries=None, semaphore=None, **kwargs):
+    """Call an LLM function through the shared retry engine."""
+    return await llm_retry_engine.call(llm_call, *args, max_retries=max_retries, semaphore=semaphore, **kwargs)
@@ -0,0 +1,161 @@
+"""
+Shortest-job-first scheduling of LLM calls.
+
+LLM calls share a small number of slots. When calls are waiting, a freed
+slot goes to the call whose job has the fewest estimated tokens left, so a
+single-file request is not stuck behind a whole-directory job. The job's
+estimate comes from the batch plan and is carried in a context variable,
+so calls made anywhere inside a job inherit it. A waiting call's priority
+improves with age, so large jobs still get their turn.
+
+Configuration:
+    LLM_MAX_CONCURRENCY: LLM calls in flight at once (default 1)
+    LLM_SCHEDULER_AGING: Tokens of priority a waiting call gains per second (default 1000)
+"""
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+import asyncio
+import itertools
+import logging
+import os
+import time
+from .metrics import observe_stage
+
+logger = logging.getLogger(__name__)
+
+# Jobs are classed by their total estimated tokens, for wait-time reporting
+PRIORITY_CLASSES = (("small", 10000), ("medium", 50000), ("large", None))
+
+
+def priority_class(tokens: int) -> str:
+    for name, limit in PRIORITY_CLASSES:
+        if limit is None or tokens <= limit:
+            return name
+    return PRIORITY_CLASSES[-1][0]
+
+
+class JobCost:
+    """Estimated tokens of one generation job; `remaining` shrinks as its batches finish."""
+
+    __slots__ = ("total", "remaining", "priority_class")
+
+    def __init__(self, total: int):
+        self.total = total
+        self.remaining = total
+        self.priority_class = priority_class(total)
+
+    def finish(self, tokens: int) -> None:
+        self.remaining = max(0, self.remaining - tokens)
+
+
+current_job: ContextVar[Optional[JobCost]] = ContextVar("current_job", default=None)
+
+
+def set_job_cost(total_tokens: int) -> JobCost:
+    """Attach a token estimate to the current task; LLM calls it makes are scheduled by it."""
+    cost = JobCost(total_tokens)
+    current_job.set(cost)
+    return cost
+
+
+class _Waiter:
+    __slots__ = ("tokens", "enqueued", "seq", "future", "priority_class")
+
+    def __init__(self, tokens: int, seq: int, future: asyncio.Future, cls: str):
+        self.tokens = tokens
+        self.enqueued = time.monotonic()
+        self.seq = seq
+        self.future = future
+        self.priority_class = cls
+
+
+class PriorityLimiter:
+    """
+    Concurrency limiter that admits waiting calls shortest job first, with aging.
+
+    Used like a semaphore (`async with limiter:`); the priority is read from
+    `current_job` when the call starts waiting.
+    """
+
+    def __init__(self, capacity: int = 1, aging_per_second: float = 1000.0):
+        self.capacity = capacity
+        self.aging_per_second = aging_per_second
+        self._in_flight = 0
+        self._waiters: List[_Waiter] = []
+        self._seq = itertools.count()
+        self._stats: Dict[str, Dict[str, float]] = {}
+
+    def _record(self, cls: str, wait: float) -> None:
+        stats = self._stats.setdefault(cls, {"calls": 0, "wait_seconds": 0.0, "max_wait_seconds": 0.0})
+        stats["calls"] += 1
+        stats["wait_seconds"] += wait
+        stats["max_wait_seconds"] = max(stats["max_wait_seconds"], wait)
+
+    def _pick(self) -> _Waiter:
+        now = time.monotonic()
+        return min(
+            self._waiters,
+            key=lambda w: (w.tokens - self.aging_per_second * (now - w.enqueued), w.seq)
+        )
+
+    def _dispatch(self) -> None:
+        while self._in_flight < self.capacity and self._waiters:
+            waiter = self._pick()
+            self._waiters.remove(waiter)
+            self._in_flight += 1
+            waiter.future.set_result(None)
+
+    async def acquire(self) -> None:
+        cost = current_job.get()
+        tokens = cost.remaining if cost is not None else 0
+        cls = cost.priority_class if cost is not None else priority_class(0)
+        if self._in_flight < self.capacity and not self._waiters:
+            self._in_flight += 1
+            self._record(cls, 0.0)
+            observe_stage("limiter_wait", 0.0)
+            return
+        waiter = _Waiter(tokens, next(self._seq), asyncio.get_running_loop().create_future(), cls)
+        self._waiters.append(waiter)
+        try:
+            await waiter.future
+        except BaseException:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            elif waiter.future.done() and not waiter.future.cancelled():
+                # Granted just as the caller was cancelled; hand the slot on
+                self.release()
+            raise
+        wait = time.monotonic() - waiter.enqueued
+        self._record(cls, wait)
+        observe_stage("limiter_wait", wait)
+        if wait > 1:
+            logger.info(f"[Scheduler] {cls} call ({tokens} tokens left in job) waited {wait:.1f}s for an LLM slot")
+
+    def release(self) -> None:
+        self._in_flight -= 1
+        self._dispatch()
+
+    async def __aenter__(self) -> "PriorityLimiter":
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self.release()
+
+    def status(self) -> Dict:
+        """Slots in use, waiting calls and per-class queue-wait statistics."""
+        classes = {}
+        for cls, stats in self._stats.items():
+            classes[cls] = dict(stats, avg_wait_seconds=stats["wait_seconds"] / stats["calls"])
+        return {
+            "capacity": self.capacity,
+            "in_flight": self._in_flight,
+            "waiting": len(self._waiters),
+            "classes": classes,
+        }
+
+
+llm_limiter = PriorityLimiter(
+    capacity=int(os.environ.get("LLM_MAX_CONCURRENCY", "1")),
+    aging_per_second=float(os.environ.get("LLM_SCHEDULER_AGING", "1000"))
+)
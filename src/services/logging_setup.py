@@ -0,0 +1,129 @@
+"""
+Structured, queue-backed logging with per-request IDs.
+
+Records are put on an in-memory queue by the calling code and formatted
+and written by a background thread, so a log call on the event loop costs
+a level check and a queue put. Every record carries the ID of the request
+that produced it (set by RequestIdMiddleware and inherited by tasks the
+request starts), so lines from concurrent generations can be told apart.
+
+High-volume messages (one per file or per scene) are logged at DEBUG with
+`extra=SAMPLED`; when DEBUG is on, only the first and then every
+LOG_SAMPLE_EVERY-th record from each such call site is written.
+
+Configuration:
+    LOG_LEVEL: Minimum level written (default INFO)
+    LOG_FORMAT: "text" or "json" lines (default text)
+    LOG_SAMPLE_EVERY: Keep one in this many sampled records per call site (default 20)
+"""
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional, Tuple
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s"
+# Pass as `extra=` on per-file and per-scene messages
+SAMPLED = {"sampled": True}
+
+request_id: ContextVar[str] = ContextVar("request_id", default="-")
+
+_listener: Optional[QueueListener] = None
+_output: Optional[logging.Handler] = None
+_settings: Optional[Tuple[str, str]] = None
+
+
+class RequestIdFilter(logging.Filter):
+    """Stamp each record with the current request ID."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Pass the first and then every `every`-th record of each sampled call site."""
+
+    def __init__(self, every: int = 20):
+        super().__init__()
+        self.every = max(1, every)
+        self._seen: Dict[Tuple[str, int], int] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not getattr(record, "sampled", False):
+            return True
+        site = (record.pathname, record.lineno)
+        with self._lock:
+            seen = self._seen.get(site, 0)
+            self._seen[site] = seen + 1
+        return seen % self.every == 0
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, request ID, message and exception."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def _formatter(log_format: str) -> logging.Formatter:
+    return JsonFormatter() if log_format == "json" else logging.Formatter(TEXT_FORMAT)
+
+
+def configure_logging() -> None:
+    """
+    Route the root logger through a background queue.
+
+    Safe to call more than once: a later call (e.g. after .env is loaded)
+    re-applies LOG_LEVEL and LOG_FORMAT if they changed. Filters run in the
+    calling thread, so request IDs are captured where the record is made
+    and sampled records are dropped before they are queued.
+    """
+    global _listener, _output, _settings
+    level = os.environ.get("LOG_LEVEL", "INFO").upper()
+    log_format = os.environ.get("LOG_FORMAT", "text").lower()
+    if _listener is not None:
+        if _settings != (level, log_format):
+            logging.getLogger().setLevel(level)
+            _output.setFormatter(_formatter(log_format))
+            _settings = (level, log_format)
+        return
+    output = _output = logging.StreamHandler()
+    output.setFormatter(_formatter(log_format))
+    _settings = (level, log_format)
+
+    handler = QueueHandler(queue.SimpleQueue())
+    handler.addFilter(RequestIdFilter())
+    handler.addFilter(SamplingFilter(int(os.environ.get("LOG_SAMPLE_EVERY", "20"))))
+
+    root = logging.getLogger()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    _listener = QueueListener(handler.queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging() -> None:
+    """Write out queued records and stop the background thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
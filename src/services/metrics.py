@@ -0,0 +1,193 @@
+"""
+Prometheus metrics for script generation, served on /metrics.
+
+A small in-process registry (counters, histograms and callback gauges)
+rendered in the Prometheus text exposition format, so no client library
+is needed. Generation stages are timed with `span(stage)`. Labels for the
+current generation (prompt mode and proficiency) are kept in a context
+variable, so code deep inside a job, such as the retry engine or the LLM
+limiter, records under the right labels without passing them along.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple
+import bisect
+import threading
+import time
+
+PREFIX = "vibeparse"
+# Stage durations range from milliseconds (parsing) to minutes (whole generations)
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+GENERATION_LABELS = ("mode", "proficiency")
+
+_generation_labels: ContextVar[Tuple[str, str]] = ContextVar("generation_labels", default=("none", "none"))
+
+
+def set_generation_labels(mode: str, proficiency: str) -> None:
+    """Label metrics recorded by the current task with its prompt mode and proficiency."""
+    _generation_labels.set((mode, proficiency))
+
+
+def generation_labels() -> Tuple[str, str]:
+    return _generation_labels.get()
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _label_text(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = f"{PREFIX}_{name}"
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = dict(self._values)
+        return self.header() + [
+            f"{self.name}{_label_text(self.labels, key)} {value}" for key, value in sorted(values.items())
+        ]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (), buckets: Sequence[float] = SECONDS_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+        # Per label set: counts per bucket (last is +Inf), then sum
+        self._series: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, *label_values: str) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._series.setdefault(label_values, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[index] += 1
+            total[0] += value
+
+    def render(self) -> List[str]:
+        with self._lock:
+            series = {key: (list(counts), total[0]) for key, (counts, total) in self._series.items()}
+        lines = self.header()
+        for key, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                bucket_label = f'le="{le}"'
+                lines.append(f"{self.name}_bucket{_label_text(self.labels, key, bucket_label)} {cumulative}")
+            lines.append(f"{self.name}_sum{_label_text(self.labels, key)} {total}")
+            lines.append(f"{self.name}_count{_label_text(self.labels, key)} {cumulative}")
+        return lines
+
+
+class CallbackGauge(_Metric):
+    """Gauge whose value is read from a function at scrape time."""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, read: Callable[[], float]):
+        super().__init__(name, documentation)
+        self.read = read
+
+    def render(self) -> List[str]:
+        return self.header() + [f"{self.name} {self.read()}"]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+stage_seconds: Histogram = registry.register(Histogram(
+    "stage_seconds", "Time spent in each script generation stage", ("stage",) + GENERATION_LABELS
+))
+llm_tokens: Counter = registry.register(Counter(
+    "llm_tokens_total", "LLM tokens by kind: prompt, completion or cached prompt tokens", ("kind",) + GENERATION_LABELS
+))
+llm_retries: Counter = registry.register(Counter(
+    "llm_retries_total", "LLM calls retried after a transient failure", GENERATION_LABELS
+))
+skipped_files: Counter = registry.register(Counter(
+    "skipped_files_total", "Files skipped as too large for one batch", GENERATION_LABELS
+))
+cache_requests: Counter = registry.register(Counter(
+    "cache_requests_total", "Cache lookups by cache and result (hit or miss)", ("cache", "result") + GENERATION_LABELS
+))
+
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """Time the enclosed block as one occurrence of `stage`, under the current generation labels."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_seconds.observe(time.perf_counter() - start, stage, *generation_labels())
+
+
+def observe_stage(stage: str, seconds: float) -> None:
+    stage_seconds.observe(seconds, stage, *generation_labels())
+
+
+def record_usage(usage) -> None:
+    """Count the tokens of an OpenAI `usage` object (None is ignored)."""
+    if usage is None:
+        return
+    labels = generation_labels()
+    llm_tokens.inc("prompt", *labels, amount=getattr(usage, "prompt_tokens", 0) or 0)
+    llm_tokens.inc("completion", *labels, amount=getattr(usage, "completion_tokens", 0) or 0)
+    # Only newer API versions report cached prompt tokens; older SDKs keep them as a plain dict
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = details.get("cached_tokens") if isinstance(details, dict) else getattr(details, "cached_tokens", 0)
+    llm_tokens.inc("cached", *labels, amount=cached or 0)
+
+
+def record_cache(cache: str, hits: int, misses: int) -> None:
+    """Count cache hits and misses under the current generation labels."""
+    labels = generation_labels()
+    if hits:
+        cache_requests.inc(cache, "hit", *labels, amount=hits)
+    if misses:
+        cache_requests.inc(cache, "miss", *labels, amount=misses)
+
+
+def register_gauge(name: str, documentation: str, read: Callable[[], float]) -> None:
+    registry.register(CallbackGauge(name, documentation, read))
@@ -0,0 +1,117 @@
+"""
+Worker pools for CPU-bound and blocking stages.
+
+Tokenization, response parsing, Markdown rendering, tree formatting and file
+writes must not run on the asyncio event loop thread, or one large repo stalls
+every other request. `run_in_pool` sends such a stage to a pool sized to the
+machine and records how long it waited for and ran in that pool.
+
+Configuration:
+    OFFLOAD_POOL_KIND: "thread" (default) or "process" for CPU-bound stages
+    OFFLOAD_POOL_WORKERS: CPU pool size (default: number of CPUs)
+    OFFLOAD_IO_WORKERS: thread pool size for blocking I/O stages
+"""
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+import asyncio
+import functools
+import logging
+import os
+import threading
+import time
+from .profiler import current_profile
+from .logging_setup import SAMPLED
+
+logger = logging.getLogger(__name__)
+
+_cpu_pool: Optional[Executor] = None
+_io_pool: Optional[ThreadPoolExecutor] = None
+_pool_lock = threading.Lock()
+_stage_stats: Dict[str, Dict[str, float]] = {}
+
+
+def _cpu_count() -> int:
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0)) or 1
+    return os.cpu_count() or 1
+
+
+def _get_cpu_pool() -> Executor:
+    global _cpu_pool
+    if _cpu_pool is None:
+        with _pool_lock:
+            if _cpu_pool is None:
+                kind = os.environ.get("OFFLOAD_POOL_KIND", "thread").lower()
+                workers = int(os.environ.get("OFFLOAD_POOL_WORKERS", "0")) or _cpu_count()
+                if kind == "process":
+                    _cpu_pool = ProcessPoolExecutor(max_workers=workers)
+                else:
+                    _cpu_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="offload-cpu")
+                logger.info(f"[Offload] Started {kind} pool with {workers} workers for CPU-bound stages")
+    return _cpu_pool
+
+
+def _get_io_pool() -> ThreadPoolExecutor:
+    global _io_pool
+    if _io_pool is None:
+        with _pool_lock:
+            if _io_pool is None:
+                workers = int(os.environ.get("OFFLOAD_IO_WORKERS", "0")) or min(32, _cpu_count() + 4)
+                _io_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="offload-io")
+    return _io_pool
+
+
+def _timed_call(func: Callable, args: Tuple, kwargs: Dict[str, Any]) -> Tuple[Any, float]:
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def _record(stage: str, wait: float, run: float) -> None:
+    stats = _stage_stats.setdefault(stage, {"calls": 0, "wait_seconds": 0.0, "run_seconds": 0.0, "max_run_seconds": 0.0})
+    stats["calls"] += 1
+    stats["wait_seconds"] += wait
+    stats["run_seconds"] += run
+    stats["max_run_seconds"] = max(stats["max_run_seconds"], run)
+
+
+async def run_in_pool(stage: str, func: Callable, *args, io: bool = False, **kwargs) -> Any:
+    """
+    Run `func(*args, **kwargs)` in a worker pool and await its result.
+
+    Args:
+        stage: Stage name used for timing stats
+        func: Callable to run; must be picklable (module-level) when the CPU pool uses processes
+        io: Run in the blocking-I/O thread pool instead of the CPU pool
+
+    Returns:
+        Result of func
+    """
+    pool = _get_io_pool() if io else _get_cpu_pool()
+    profile = current_profile.get()
+    if profile is not None and isinstance(pool, ThreadPoolExecutor):
+        # Sample the pool thread while it works for the profiled job
+        func = profile.wrap_thread_call(func)
+    loop = asyncio.get_running_loop()
+    submitted = time.perf_counter()
+    result, run = await loop.run_in_executor(pool, functools.partial(_timed_call, func, args, kwargs))
+    wait = max(0.0, time.perf_counter() - submitted - run)
+    _record(stage, wait, run)
+    logger.debug("[Offload] Stage '%s' ran %.1fms in pool (queued %.1fms)", stage, run * 1000, wait * 1000, extra=SAMPLED)
+    return result
+
+
+def get_stage_stats() -> Dict[str, Dict[str, float]]:
+    """Return cumulative per-stage pool timings."""
+    return {stage: dict(stats) for stage, stats in _stage_stats.items()}
+
+
+def shutdown_pools() -> None:
+    """Shut down the worker pools; they are recreated on next use."""
+    global _cpu_pool, _io_pool
+    with _pool_lock:
+        for pool in (_cpu_pool, _io_pool):
+            if pool is not None:
+                pool.shutdown(wait=True)
+        _cpu_pool = None
+        _io_pool = None
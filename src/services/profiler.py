@@ -0,0 +1,274 @@
+"""
+On-demand sampling CPU profiles and allocation snapshots of single jobs.
+
+An admin arms profiling for a job ID (the request's X-Request-ID) or for
+the next N jobs. When an armed job starts, a sampler thread records the
+job's Python stack every PROFILE_INTERVAL_MS: the event loop thread while
+the job's code is on its stack, and offload pool threads while they run
+work submitted by the job. tracemalloc snapshots are taken before and
+after the job and diffed into the top allocation sites; snapshots and the
+diff run in a worker thread, not on the event loop. Stacks are kept in
+the collapsed ("folded") format that flamegraph.pl and speedscope read.
+
+Nothing is sampled or traced unless a job is armed; an unarmed job costs a
+single attribute check.
+
+tracemalloc is process-wide, so allocation sites of a profiled job include
+those of any job running alongside it. Profiles are per worker process.
+
+Configuration:
+    PROFILE_INTERVAL_MS: Milliseconds between stack samples (default 5)
+    PROFILE_MAX_RESULTS: Finished profiles kept for retrieval (default 20)
+    PROFILE_TRACEMALLOC_FRAMES: Frames stored per allocation traceback (default 10)
+"""
+from collections import Counter, OrderedDict
+from contextvars import ContextVar
+from types import FrameType
+from typing import Callable, Dict, List, Optional, Set
+import asyncio
+import functools
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+logger = logging.getLogger(__name__)
+
+MAX_STACK_DEPTH = 128
+TOP_ALLOCATIONS = 25
+
+current_profile: ContextVar[Optional["JobProfile"]] = ContextVar("current_profile", default=None)
+
+
+def _fold(frame: Optional[FrameType]) -> str:
+    """Collapse a stack into 'outer;...;inner', one 'function (file:line)' per frame."""
+    names = []
+    while frame is not None and len(names) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class JobProfile:
+    """Samples and allocation snapshots collected for one job."""
+
+    def __init__(self, job_id: str, kind: str, interval: float, job_frame: Optional[FrameType]):
+        self.job_id = job_id
+        self.kind = kind
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.started = time.time()
+        self.seconds = 0.0
+        # Frame of the coroutine that runs the job; the job is running whenever it is on the loop's stack
+        self.job_frame = job_frame
+        self.threads: Set[int] = set()
+        self.loop_thread = threading.get_ident()
+        self.allocations: List[Dict] = []
+        self.peak_traced_bytes = 0
+        self._before: Optional[tracemalloc.Snapshot] = None
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample_loop, name=f"profiler-{job_id}", daemon=True)
+
+    def wrap_thread_call(self, func: Callable) -> Callable:
+        """Wrap a pool callable so the thread running it is sampled for this job."""
+        @functools.wraps(func)
+        def run(*args, **kwargs):
+            ident = threading.get_ident()
+            self.threads.add(ident)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.threads.discard(ident)
+        return run
+
+    def _job_on_stack(self, frame: Optional[FrameType]) -> bool:
+        while frame is not None:
+            if frame is self.job_frame:
+                return True
+            frame = frame.f_back
+        return False
+
+    def _sample_loop(self) -> None:
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            running = [ident for ident in list(self.threads) if ident in frames]
+            # Other jobs share the loop thread, so it is sampled only while this job's code runs
+            if self.job_frame is not None and self._job_on_stack(frames.get(self.loop_thread)):
+                running.append(self.loop_thread)
+            for ident in running:
+                self.stacks[_fold(frames[ident])] += 1
+            self.samples += 1
+
+    def start(self, before: tracemalloc.Snapshot) -> None:
+        self._before = before
+        self._sampler.start()
+
+    def stop(self) -> None:
+        """Stop sampling; the allocation diff is left to `diff_allocations`."""
+        self._stop.set()
+        self._sampler.join()
+        self.seconds = time.time() - self.started
+
+    def diff_allocations(self) -> None:
+        """Snapshot allocations and diff them against the start; slow, so run off the event loop."""
+        after = tracemalloc.take_snapshot()
+        self.peak_traced_bytes = tracemalloc.get_traced_memory()[1]
+        ignore = [tracemalloc.Filter(False, tracemalloc.__file__)]
+        diff = after.filter_traces(ignore).compare_to(self._before.filter_traces(ignore), "lineno")
+        self.allocations = [
+            {
+                "site": str(stat.traceback[0]),
+                "size_diff_bytes": stat.size_diff,
+                "size_bytes": stat.size,
+                "count_diff": stat.count_diff,
+            }
+            for stat in diff[:TOP_ALLOCATIONS]
+        ]
+        self._before = None
+
+    def collapsed(self) -> str:
+        """Stacks in the folded format: 'frame;frame;frame count' per line."""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def summary(self, top: int = 20) -> Dict:
+        """Timing, hottest functions (self and inclusive samples) and top allocation sites."""
+        own: Counter = Counter()
+        inclusive: Counter = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")
+            own[frames[-1]] += count
+            for frame in set(frames):
+                inclusive[frame] += count
+        return {
+            "job_id": self.job_id,
+            "kind": self.kind,
+            "started": self.started,
+            "seconds": round(self.seconds, 3),
+            "interval_ms": self.interval * 1000,
+            "samples": self.samples,
+            "job_samples": sum(self.stacks.values()),
+            "top_self": [{"function": f, "samples": n} for f, n in own.most_common(top)],
+            "top_inclusive": [{"function": f, "samples": n} for f, n in inclusive.most_common(top)],
+            "peak_traced_bytes": self.peak_traced_bytes,
+            "top_allocations": self.allocations,
+        }
+
+
+class JobProfiler:
+    """Arms profiling for job IDs or the next N jobs, and keeps the finished profiles."""
+
+    def __init__(self, interval: float = 0.005, max_results: int = 20, tracemalloc_frames: int = 10):
+        self.interval = interval
+        self.max_results = max_results
+        self.tracemalloc_frames = tracemalloc_frames
+        # Checked on every job start; True only while something is armed
+        self.armed = False
+        self._job_ids: Set[str] = set()
+        self._next_jobs = 0
+        self._active: Dict[str, JobProfile] = {}
+        self._results: "OrderedDict[str, JobProfile]" = OrderedDict()
+        self._started_tracemalloc = False
+
+    def _update_armed(self) -> None:
+        self.armed = bool(self._job_ids or self._next_jobs)
+
+    def arm_job(self, job_id: str) -> None:
+        self._job_ids.add(job_id)
+        self._update_armed()
+
+    def arm_next(self, count: int) -> None:
+        self._next_jobs = max(0, count)
+        self._update_armed()
+
+    def disarm(self) -> None:
+        self._job_ids.clear()
+        self._next_jobs = 0
+        self._update_armed()
+
+    def _claim(self, job_id: str) -> bool:
+        if job_id in self._job_ids:
+            self._job_ids.discard(job_id)
+        elif self._next_jobs:
+            self._next_jobs -= 1
+        else:
+            return False
+        self._update_armed()
+        return True
+
+    async def start(self, job_id: str, kind: str, job_frame: Optional[FrameType] = None) -> Optional[JobProfile]:
+        """
+        Begin profiling a job if `job_id` is armed (or a next-N slot is left).
+
+        Args:
+            job_id: ID of the job
+            kind: Job kind, for reporting
+            job_frame: Frame of the coroutine running the job; event loop samples
+                are attributed to the job while this frame is on the stack
+        """
+        if not self._claim(job_id):
+            return None
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.tracemalloc_frames)
+            self._started_tracemalloc = True
+        # Peak memory is reported per job
+        tracemalloc.reset_peak()
+        profile = JobProfile(job_id, kind, self.interval, job_frame)
+        self._active[job_id] = profile
+        try:
+            before = await asyncio.to_thread(tracemalloc.take_snapshot)
+        except BaseException:
+            self._untrace(profile)
+            raise
+        current_profile.set(profile)
+        profile.start(before)
+        logger.info(f"[Profiler] Profiling {kind} job {job_id}")
+        return profile
+
+    def _untrace(self, profile: JobProfile) -> None:
+        self._active.pop(profile.job_id, None)
+        if not self._active and self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    async def finish(self, profile: JobProfile) -> None:
+        """Stop sampling, diff the allocation snapshots and keep the profile for retrieval."""
+        current_profile.set(None)
+        profile.stop()
+        try:
+            await asyncio.to_thread(profile.diff_allocations)
+        finally:
+            # tracemalloc keeps running until the diff is done
+            self._untrace(profile)
+        self._results[profile.job_id] = profile
+        self._results.move_to_end(profile.job_id)
+        while len(self._results) > self.max_results:
+            self._results.popitem(last=False)
+        logger.info(
+            f"[Profiler] Finished {profile.kind} job {profile.job_id}: "
+            f"{profile.seconds:.1f}s, {sum(profile.stacks.values())} samples"
+        )
+
+    def get(self, job_id: str) -> Optional[JobProfile]:
+        return self._results.get(job_id)
+
+    def status(self) -> Dict:
+        return {
+            "armed_job_ids": sorted(self._job_ids),
+            "armed_next_jobs": self._next_jobs,
+            "active": sorted(self._active),
+            "results": [
+                {"job_id": p.job_id, "kind": p.kind, "started": p.started, "seconds": round(p.seconds, 3)}
+                for p in reversed(self._results.values())
+            ],
+        }
+
+
+job_profiler = JobProfiler(
+    interval=float(os.environ.get("PROFILE_INTERVAL_MS", "5")) / 1000,
+    max_results=int(os.environ.get("PROFILE_MAX_RESULTS", "20")),
+    tracemalloc_frames=int(os.environ.get("PROFILE_TRACEMALLOC_FRAMES", "10"))
+)
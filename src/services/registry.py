@@ -0,0 +1,59 @@
+"""
+Shared service instances, created on first use.
+
+Importing the app builds nothing: each service is constructed the first
+time a request needs it and then shared by every route. A missing
+OPENAI_API_KEY therefore only fails the requests that actually call the
+LLM. The app lifespan calls `close_services` on shutdown.
+"""
+from typing import Any, Callable, Dict, TYPE_CHECKING
+import logging
+import threading
+
+if TYPE_CHECKING:
+    from .github_service import GitHubService
+    from .llm_service import LLMService
+    from .script_generator import ScriptGenerator
+
+logger = logging.getLogger(__name__)
+
+_instances: Dict[str, Any] = {}
+_lock = threading.Lock()
+
+
+def _shared(name: str, factory: Callable[[], Any]) -> Any:
+    instance = _instances.get(name)
+    if instance is None:
+        with _lock:
+            instance = _instances.get(name)
+            if instance is None:
+                instance = _instances[name] = factory()
+                logger.info(f"[Registry] Created shared {name}")
+    return instance
+
+
+def get_github_service() -> "GitHubService":
+    from .github_service import GitHubService
+    return _shared("github_service", GitHubService)
+
+
+def get_llm_service() -> "LLMService":
+    """
+    Raises:
+        ValueError: If OPENAI_API_KEY is not set
+    """
+    from .llm_service import LLMService
+    return _shared("llm_service", LLMService)
+
+
+def get_script_generator() -> "ScriptGenerator":
+    from .script_generator import ScriptGenerator
+    return _shared("script_generator", ScriptGenerator)
+
+
+async def close_services() -> None:
+    """Forget the shared services and close the shared LLM client."""
+    from .llm_client import close_llm_client
+    with _lock:
+        _instances.clear()
+    await close_llm_client()
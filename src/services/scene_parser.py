@@ -0,0 +1,220 @@
+"""
+Single-pass parser for the Markdown scene format.
+
+Both LLM responses and saved scripts use the same grammar:
+
+    ## Scene Title (20s)
+    Explanation text, which may contain fenced code.
+
+    ### Code Highlights
+    **path/to/file.py** (lines 3-9):
+    ```python
+    code
+    ```
+    Description of the code.
+
+    ---
+
+`SceneParser` is a line-at-a-time state machine: every line is looked at once
+and text is accumulated in lists that are joined when a scene is finished, so
+parsing time is linear in the size of the response.
+"""
+from typing import Dict, Iterable, List, Optional, Union
+import re
+from ..models.script import Script, Scene, CodeHighlight
+
+_HEADING = re.compile(r"^(.*?)\s*\((\d+)\s*s(?:ec(?:ond)?s?)?\)\s*:?\s*$")
+_HIGHLIGHT = re.compile(r"\*\*(.+?)\*\* \(lines (\d+)[-–](\d+)\):?")
+_NUMBERING = re.compile(r"^((Scene|Chapter) [0-9.]+: )+")
+_FILE_MENTION = re.compile(r"The `([^`]+)` file")
+DEFAULT_DURATION = 20
+
+# Parser states
+CONTENT = "content"
+CONTENT_FENCE = "content_fence"
+AWAIT_CODE = "await_code"
+HIGHLIGHT_CODE = "highlight_code"
+DESCRIPTION = "description"
+
+
+class _Highlight:
+    __slots__ = ("file_path", "start_line", "end_line", "code_lines", "desc_lines")
+
+    def __init__(self, file_path: str, start_line: int, end_line: int):
+        self.file_path = file_path
+        self.start_line = start_line
+        self.end_line = end_line
+        self.code_lines: Optional[List[str]] = None
+        self.desc_lines: List[str] = []
+
+
+class SceneParser:
+    """
+    Incremental scene parser. Call `feed` once per line, then `close` for the Script.
+
+    Args:
+        files: Fetched files ({'path', 'content'} dicts) used to fill highlight code from line ranges
+        fill_from_source: Always take highlight code from the file's line range, ignoring echoed code
+        inline_code_highlights: Also turn fenced code in scene content into highlights
+        strip_numbering: Remove leading "Scene N: " / "Chapter N: " prefixes from titles
+    """
+
+    def __init__(
+        self,
+        files: Optional[List[Dict[str, str]]] = None,
+        fill_from_source: bool = False,
+        inline_code_highlights: bool = False,
+        strip_numbering: bool = False
+    ):
+        self._sources = {f['path']: f['content'] for f in files or []}
+        self._source_lines: Dict[str, List[str]] = {}
+        self.fill_from_source = fill_from_source
+        self.inline_code_highlights = inline_code_highlights
+        self.strip_numbering = strip_numbering
+        self.scenes: List[Scene] = []
+        self._state = CONTENT
+        self._title: Optional[str] = None
+        self._duration = DEFAULT_DURATION
+        self._content: List[str] = []
+        self._highlights: List[_Highlight] = []
+        self._inline_blocks: List[List[str]] = []
+
+    def feed(self, raw_line: str) -> None:
+        """Consume one line (with or without its trailing newline)."""
+        line = raw_line.rstrip("\r\n")
+        stripped = line.strip()
+        state = self._state
+
+        # Inside a fence, only a closing fence changes state
+        if state == HIGHLIGHT_CODE:
+            if stripped.startswith("```"):
+                self._state = DESCRIPTION
+            else:
+                self._highlights[-1].code_lines.append(line)
+            return
+        if state == CONTENT_FENCE:
+            self._content.append(line)
+            if stripped.startswith("```"):
+                self._state = CONTENT
+            elif self.inline_code_highlights:
+                self._inline_blocks[-1].append(line)
+            return
+
+        if stripped.startswith("## "):
+            self._finish_scene()
+            self._start_scene(stripped[3:])
+            return
+        if self._title is None:
+            return  # preamble such as "# Code Explanation Script"
+        if stripped.startswith("#") or stripped == "---":
+            # "### Code Highlights", other sub-headings and scene separators
+            self._state = CONTENT
+            return
+        if stripped.startswith("**"):
+            match = _HIGHLIGHT.match(stripped)
+            if match:
+                self._highlights.append(_Highlight(match.group(1).strip(), int(match.group(2)), int(match.group(3))))
+                self._state = AWAIT_CODE
+                return
+
+        if state == AWAIT_CODE:
+            if not stripped:
+                return
+            if stripped.startswith("```"):
+                self._highlights[-1].code_lines = []
+                self._state = HIGHLIGHT_CODE
+                return
+            self._state = state = DESCRIPTION
+        if state == DESCRIPTION:
+            if stripped:
+                self._highlights[-1].desc_lines.append(stripped)
+            return
+
+        # Scene content
+        if stripped.startswith("```"):
+            self._content.append(line)
+            self._state = CONTENT_FENCE
+            if self.inline_code_highlights:
+                self._inline_blocks.append([])
+            return
+        self._content.append(stripped)
+
+    def close(self) -> Script:
+        """Finish the last scene and return the parsed Script."""
+        self._finish_scene()
+        return Script(scenes=self.scenes)
+
+    def _start_scene(self, heading: str) -> None:
+        match = _HEADING.match(heading)
+        if match:
+            title, duration = match.group(1).strip(), int(match.group(2))
+        else:
+            title, duration = heading.strip(), DEFAULT_DURATION
+        if self.strip_numbering:
+            title = _NUMBERING.sub("", title)
+        self._title = title
+        self._duration = duration
+        self._state = CONTENT
+
+    def _finish_scene(self) -> None:
+        if self._title is None:
+            return
+        content = "\n".join(self._content).strip()
+        highlights = [self._build_highlight(h) for h in self._highlights]
+        if self.inline_code_highlights and self._inline_blocks:
+            mention = _FILE_MENTION.search(content)
+            file_path = mention.group(1) if mention else "scene-content"
+            highlights.extend(
+                CodeHighlight(
+                    file_path=file_path,
+                    start_line=0,
+                    end_line=0,
+                    description="Inline code block from scene content",
+                    code="\n".join(block).strip()
+                )
+                for block in self._inline_blocks
+            )
+        self.scenes.append(Scene(
+            title=self._title,
+            duration=self._duration,
+            content=content,
+            code_highlights=highlights
+        ))
+        self._title = None
+        self._duration = DEFAULT_DURATION
+        self._content = []
+        self._highlights = []
+        self._inline_blocks = []
+        self._state = CONTENT
+
+    def _build_highlight(self, h: _Highlight) -> CodeHighlight:
+        code = "\n".join(h.code_lines) if h.code_lines else ""
+        if (self.fill_from_source or not code) and h.file_path in self._sources:
+            lines = self._source_lines.get(h.file_path)
+            if lines is None:
+                # Split lazily, only for files that are actually referenced
+                lines = self._source_lines[h.file_path] = self._sources[h.file_path].splitlines()
+            code = "\n".join(lines[h.start_line - 1:h.end_line])
+        return CodeHighlight(
+            file_path=h.file_path,
+            start_line=h.start_line,
+            end_line=h.end_line,
+            description="\n".join(h.desc_lines),
+            code=code
+        )
+
+
+def parse_scenes(
+    source: Union[str, Iterable[str]],
+    files: Optional[List[Dict[str, str]]] = None,
+    **options
+) -> Script:
+    """
+    Parse Markdown scenes from a string or an iterable of lines (e.g. an open file).
+    Keyword options are passed to SceneParser.
+    """
+    parser = SceneParser(files, **options)
+    lines = source.splitlines() if isinstance(source, str) else source
+    for line in lines:
+        parser.feed(line)
+    return parser.close()
@@ -0,0 +1,102 @@
+"""
+Cache of parsed Script objects for Markdown script files.
+
+Mock mode and /api/scripts/current serve scripts from files in test_output/.
+Parsing those on every request skews load and UI tests, so parsed scripts are
+kept in memory keyed by path and revalidated against the file's mtime and
+size. Cached scripts are shared between requests and must be treated as
+read-only.
+"""
+from typing import Callable, Dict, Iterable, Optional, Tuple
+import asyncio
+import logging
+import os
+from ..models.script import Script
+from .offload import run_in_pool
+from .metrics import record_cache
+
+logger = logging.getLogger(__name__)
+
+Parser = Callable[[str], Script]
+
+
+class ParsedScriptCache:
+    """Parsed scripts keyed by (path, parser), invalidated when mtime or size changes."""
+
+    def __init__(self):
+        self._entries: Dict[Tuple[str, str], Tuple[Tuple[int, int], Script, Parser]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(path: str, parse: Parser) -> Tuple[str, str]:
+        return os.path.abspath(path), f"{parse.__module__}.{parse.__qualname__}"
+
+    @staticmethod
+    def _signature(path: str) -> Tuple[int, int]:
+        st = os.stat(path)
+        return st.st_mtime_ns, st.st_size
+
+    def get_cached(self, path: str, parse: Parser) -> Optional[Script]:
+        """Return the cached script if it is still current, else None."""
+        entry = self._entries.get(self._key(path, parse))
+        if entry is None:
+            return None
+        try:
+            if entry[0] == self._signature(path):
+                self.hits += 1
+                return entry[1]
+        except OSError:
+            pass
+        return None
+
+    async def load(self, path: str, parse: Parser) -> Script:
+        """
+        Return the parsed script for `path`, parsing in the offload pool on a miss.
+
+        Raises:
+            OSError: If the file does not exist or cannot be read
+        """
+        script = self.get_cached(path, parse)
+        if script is not None:
+            record_cache("parsed_script", 1, 0)
+            return script
+        self.misses += 1
+        record_cache("parsed_script", 0, 1)
+        signature = self._signature(path)
+        script = await run_in_pool("parse_cached_script", parse, path)
+        self._entries[self._key(path, parse)] = (signature, script, parse)
+        logger.info(f"[ScriptCache] Parsed and cached {path} ({len(script.scenes)} scenes)")
+        return script
+
+    async def preload(self, paths: Iterable[str], parse: Parser) -> None:
+        """Parse every existing file in `paths` ahead of the first request."""
+        for path in paths:
+            if os.path.exists(path):
+                try:
+                    await self.load(path, parse)
+                except Exception as e:
+                    logger.warning(f"[ScriptCache] Could not preload {path}: {e}")
+
+    async def refresh(self) -> None:
+        """Re-parse cached entries whose files changed and drop entries whose files are gone."""
+        for key, (signature, _, parse) in list(self._entries.items()):
+            path = key[0]
+            try:
+                if self._signature(path) != signature:
+                    await self.load(path, parse)
+            except OSError:
+                self._entries.pop(key, None)
+                logger.info(f"[ScriptCache] Dropped {path}; file no longer exists")
+
+    async def watch(self, interval: float) -> None:
+        """Poll cached files every `interval` seconds and reload them when they change."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.warning(f"[ScriptCache] Refresh failed: {e}")
+
+
+parsed_script_cache = ParsedScriptCache()
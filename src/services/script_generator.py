@@ -1,30 +1,121 @@
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 import os
-from pathlib import Path
 from .github_service import GitHubService
-from .llm_service import LLMService
-from ..models.script import Script
-import tiktoken
+from .llm_service import LLMService, parse_markdown_script, line_ranges_enabled
+from .registry import get_github_service, get_llm_service
+from .llm_retry import CircuitBreaker, call_llm_with_retries, llm_retry_engine
+from .llm_scheduler import llm_limiter, set_job_cost
+from .offload import run_in_pool
+from .lazy_chapters import LazyScript
+from .scene_parser import parse_scenes
+from .script_cache import parsed_script_cache
+from .artifact_sink import artifact_sink
+from .tree_summary import summarize_tree
+from .token_cache import estimate_tokens_from_size, token_count_cache
+from .metrics import generation_labels, observe_stage, record_cache, set_generation_labels, span
+from .metrics import skipped_files as skipped_files_total
+from .logging_setup import SAMPLED
+from ..models.script import Script, Scene
 import re
 import logging
-import time
 import asyncio
-import openai
+import time
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger(__name__)
 
-# Global rate limiter - only allow one LLM call at a time
-llm_semaphore = asyncio.Semaphore(1)
+MAX_BATCH_TOKENS = 10000  # Safe threshold per batch
+BATCH_PAUSE_SECONDS = 5  # Pause between batches to avoid rate limits
+MARKDOWN_SYSTEM_MESSAGE = {"role": "system", "content": "You are an expert code explainer. Format output in Markdown as a list of scenes."}
+
+# Mock-mode script files, chosen by the first key found in the GitHub URL
+MOCK_SCRIPT_PATHS = {
+    "App.tsx": "test_output/App.tsx_script.md",
+    "setcharacters.js": "test_output/setcharacters.js_script.md",
+    "MyActivity.java": "test_output/MyActivity.java_script.md",
+    "ExpertSingleFileTest": "test_output/ExpertSingleFileTest.md",
+}
+DEFAULT_MOCK_SCRIPT_PATH = "test_output/src_script.md"
+
+def mock_script_path(github_url: str) -> str:
+    """Return the saved script file that mock mode serves for a URL."""
+    for key, path in MOCK_SCRIPT_PATHS.items():
+        if key in github_url:
+            return path
+    return DEFAULT_MOCK_SCRIPT_PATH
+
+def parse_mock_script_file(path: str) -> Script:
+    """Parse a saved Markdown script for mock mode, streaming it line by line."""
+    with open(path, "r", encoding="utf-8") as f:
+        return parse_scenes(f)
+
+def prompt_mode() -> str:
+    """Prompt format in use, as reported in metric labels."""
+    return "json" if os.environ.get("USE_JSON_SCRIPT_PROMPT", "false").lower() == "true" else "markdown"
+
+_encoder = None
+
+def count_tokens(contents: List[str]) -> List[int]:
+    """Count GPT-4 tokens for each string. Module-level so it can run in the offload pool."""
+    global _encoder
+    if _encoder is None:
+        import tiktoken
+        _encoder = tiktoken.encoding_for_model("gpt-4")
+    return [len(tokens) for tokens in _encoder.encode_ordinary_batch(contents)]
+
+def plan_batches(
+    files: List[Dict],
+    token_counts: List[int],
+    max_tokens: int = MAX_BATCH_TOKENS
+) -> Tuple[List[List[Dict]], List[str], List[int]]:
+    """
+    Split files into batches of at most `max_tokens` tokens, in order.
+    
+    Returns:
+        The batches, the paths of files skipped as too large, and the token total of each batch
+    """
+    batches = []
+    batch_tokens = []
+    current_batch = []
+    current_tokens = 0
+    skipped_files = []
+    for f, file_tokens in zip(files, token_counts):
+        # If file itself is too large, skip it
+        if file_tokens > max_tokens:
+            logger.warning("Skipping file '%s' (tokens: %d) - too large for a single batch.", f['path'], file_tokens, extra=SAMPLED)
+            skipped_files.append(f['path'])
+            continue
+        # If adding this file would exceed the batch limit, start a new batch
+        if current_tokens + file_tokens > max_tokens and current_batch:
+            logger.debug("Created batch with %d files, total tokens: %d.", len(current_batch), current_tokens, extra=SAMPLED)
+            batches.append(current_batch)
+            batch_tokens.append(current_tokens)
+            current_batch = []
+            current_tokens = 0
+        current_batch.append(f)
+        current_tokens += file_tokens
+    if current_batch:
+        logger.debug("Created batch with %d files, total tokens: %d.", len(current_batch), current_tokens, extra=SAMPLED)
+        batches.append(current_batch)
+        batch_tokens.append(current_tokens)
+    return batches, skipped_files, batch_tokens
 
 class ScriptGenerator:
-    def __init__(self):
-        self.github_service = GitHubService()
-        self.llm_service = LLMService()
+    def __init__(self, github_service: Optional[GitHubService] = None, llm_service: Optional[LLMService] = None):
+        # Default to the shared services, resolved on first use
+        self._github_service = github_service
+        self._llm_service = llm_service
+    
+    @property
+    def github_service(self) -> GitHubService:
+        if self._github_service is None:
+            self._github_service = get_github_service()
+        return self._github_service
+    
+    @property
+    def llm_service(self) -> LLMService:
+        if self._llm_service is None:
+            self._llm_service = get_llm_service()
+        return self._llm_service
         
     async def generate_script_from_url(
         self,
@@ -47,9 +138,11 @@ class ScriptGenerator:
         Returns:
             Generated Script object
         """
+        started = time.perf_counter()
         # Check if mock mode is enabled
         MOCK_LLM_MODE = os.environ.get("MOCK_LLM_MODE", "false").lower() == "true"
         if MOCK_LLM_MODE:
+            set_generation_labels("mock", proficiency)
             logger.info("[MockLLM] MOCK MODE ENABLED: Using existing src_script.md instead of making LLM calls")
             return await self._generate_mock_script(github_url, save_to_disk)
         
@@ -63,120 +156,41 @@ class ScriptGenerator:
         # Check JSON vs Markdown mode
         USE_JSON_SCRIPT_PROMPT = os.environ.get("USE_JSON_SCRIPT_PROMPT", "false").lower() == "true"
         logger.info(f"[ScriptGenerator] USE_JSON_SCRIPT_PROMPT: {USE_JSON_SCRIPT_PROMPT}")
+        # Metrics recorded anywhere in this job carry its mode and proficiency
+        set_generation_labels(prompt_mode(), proficiency)
         
-        # Fetch code from GitHub
-        files = await self.github_service.fetch_code(github_url, file_types)
-        logger.info(f"[ScriptGenerator] Fetched {len(files)} files from GitHub")
-        
-        # Tokenizer for estimation
-        enc = tiktoken.encoding_for_model("gpt-4")
-        MAX_TOKENS = 10000  # Safe threshold per batch
-        batches = []
-        current_batch = []
-        current_tokens = 0
-        skipped_files = []
-        for f in files:
-            # Estimate tokens for this file
-            file_tokens = len(enc.encode(f['content']))
-            # If file itself is too large, skip it
-            if file_tokens > MAX_TOKENS:
-                logger.warning(f"Skipping file '{f['path']}' (tokens: {file_tokens}) - too large for a single batch.")
-                skipped_files.append(f['path'])
-                continue
-            # If adding this file would exceed the batch limit, start a new batch
-            if current_tokens + file_tokens > MAX_TOKENS and current_batch:
-                logger.info(f"Created batch with {len(current_batch)} files, total tokens: {current_tokens}.")
-                batches.append(current_batch)
-                current_batch = []
-                current_tokens = 0
-            current_batch.append(f)
-            current_tokens += file_tokens
-        if current_batch:
-            logger.info(f"Created batch with {len(current_batch)} files, total tokens: {current_tokens}.")
-            batches.append(current_batch)
-        
-        logger.info(f"[ScriptGenerator] Created {len(batches)} batches for processing")
+        files, batches, skipped_files, batch_tokens = await self._fetch_and_plan(github_url, file_types)
+        # LLM calls of this job are scheduled by its remaining token estimate
+        job = set_job_cost(sum(batch_tokens))
         
         # Process each batch using a single chat history
         all_scenes = []
         global_scene_idx = 1
-        messages = [
-            {"role": "system", "content": "You are an expert code explainer. Format output in Markdown as a list of scenes."}
-        ]
+        messages = [dict(MARKDOWN_SYSTEM_MESSAGE)]
         for idx, batch in enumerate(batches):
-            chapter_title = f"Chapter {idx+1}: Files in this chapter"
-            chapter_content = "This chapter covers the following files:\n" + "\n".join([f['path'] for f in batch])
-            from ..models.script import Scene
-            chapter_scene = Scene(
-                title=chapter_title,
-                duration=5,
-                content=chapter_content,
-                code_highlights=[]
-            )
-            all_scenes.append(chapter_scene)
+            all_scenes.append(self._chapter_scene(idx, batch))
             logger.info(f"[Batching] Processing chapter {idx+1}/{len(batches)} with {len(batch)} files...")
             
-            # Check if we should use the new JSON path
-            if USE_JSON_SCRIPT_PROMPT:
-                logger.info(f"[ScriptGenerator] Using NEW JSON path for batch {idx+1}")
-                try:
-                    # Use the new LLMService.generate_script method
-                    script = await self.llm_service.generate_script(batch, proficiency, depth)
-                    logger.info(f"[ScriptGenerator] JSON path returned: {type(script)}")
-                    if isinstance(script, dict):
-                        logger.info(f"[ScriptGenerator] JSON response has {len(script.get('chapters', []))} chapters")
-                        # Use the new from_json_response method
-                        from ..models.script import Script
-                        script = Script.from_json_response(script)
-                        logger.info(f"[ScriptGenerator] Converted JSON to Script with {len(script.scenes)} scenes")
-                    else:
-                        logger.info(f"[ScriptGenerator] JSON path returned Script object with {len(script.scenes)} scenes")
-                    
-                    # Number scenes globally
-                    for scene in script.scenes:
-                        if not re.match(r'^Scene \d+:', scene.title):
-                            scene.title = f"Scene {global_scene_idx}: {scene.title}"
-                        global_scene_idx += 1
-                        all_scenes.append(scene)
-                except Exception as e:
-                    logger.error(f"[ScriptGenerator] Error in JSON path for batch {idx+1}: {e}")
-                    # Fall back to old path
-                    logger.info(f"[ScriptGenerator] Falling back to old Markdown path for batch {idx+1}")
-                    script = await self._process_batch_old_way(batch, proficiency, depth, messages, idx)
-                    # Number scenes globally
-                    for scene in script.scenes:
-                        if not re.match(r'^Scene \d+:', scene.title):
-                            scene.title = f"Scene {global_scene_idx}: {scene.title}"
-                        global_scene_idx += 1
-                        all_scenes.append(scene)
-            else:
-                logger.info(f"[ScriptGenerator] Using OLD Markdown path for batch {idx+1}")
-                script = await self._process_batch_old_way(batch, proficiency, depth, messages, idx)
-                # Number scenes globally
-                for scene in script.scenes:
-                    if not re.match(r'^Scene \d+:', scene.title):
-                        scene.title = f"Scene {global_scene_idx}: {scene.title}"
-                    global_scene_idx += 1
-                    all_scenes.append(scene)
+            script = await self._generate_batch_script(batch, proficiency, depth, messages, idx, USE_JSON_SCRIPT_PROMPT)
+            job.finish(batch_tokens[idx])
+            # Number scenes globally
+            for scene in script.scenes:
+                if not re.match(r'^Scene \d+:', scene.title):
+                    scene.title = f"Scene {global_scene_idx}: {scene.title}"
+                global_scene_idx += 1
+                all_scenes.append(scene)
             
             logger.info(f"[Batching] Chapter {idx+1} processed successfully. Scenes added: {len(script.scenes)}.")
             
             if idx < len(batches) - 1:
-                logger.info("[Throttling] Sleeping 5 seconds before next batch to avoid rate limits...")
-                await asyncio.sleep(5)
+                logger.info(f"[Throttling] Sleeping {BATCH_PAUSE_SECONDS} seconds before next batch to avoid rate limits...")
+                await asyncio.sleep(BATCH_PAUSE_SECONDS)
         
         # Add a scene at the start if any files were skipped
         if skipped_files:
-            from ..models.script import Scene
-            skip_scene = Scene(
-                title="Skipped Files",
-                duration=10,
-                content="The following files were skipped because they were too large to process in a single request:\n" + "\n".join(skipped_files),
-                code_highlights=[]
-            )
-            all_scenes.insert(0, skip_scene)
+            all_scenes.insert(0, self._skipped_scene(skipped_files))
         
-        final_script = Script(scenes=all_scenes)
+        final_script = Script(scenes=all_scenes).attach_sources(files)
         logger.info(f"[ScriptGenerator] Final script has {len(final_script.scenes)} scenes total")
         
         # Modular multi-scene intro chapter for directory submissions
@@ -185,10 +199,6 @@ class ScriptGenerator:
         if ENABLE_INTRO_CHAPTER and is_directory:
             logger.info("[IntroChapter] ENABLED: Generating multi-scene repo overview intro chapter in the same chat...")
             logger.info(f"[IntroChapter] Processing directory with {len(files)} files")
-            # Fetch repo tree
-            logger.info("[IntroChapter] Fetching repository tree structure...")
-            repo_tree = self.github_service.get_repo_tree(github_url)
-            logger.info(f"[IntroChapter] Retrieved {len(repo_tree)} files/directories in repo tree")
             # Build mapping of files to scene titles
             logger.info("[IntroChapter] Building file-to-scene mapping...")
             file_to_scenes = {}
@@ -196,32 +206,247 @@ class ScriptGenerator:
                 for ch in getattr(scene, 'code_highlights', []):
                     file_to_scenes.setdefault(ch.file_path, []).append(scene.title)
             logger.info(f"[IntroChapter] Mapped {len(file_to_scenes)} files to their scenes")
-            # Format repo tree as indented list
-            logger.info("[IntroChapter] Formatting repository tree structure...")
-            def format_tree(paths):
-                from collections import defaultdict
-                tree = lambda: defaultdict(tree)
-                root = tree()
-                for path in paths:
-                    parts = path.split('/')
-                    d = root
-                    for part in parts:
-                        d = d[part]
-                def _format(d, indent=0):
-                    lines = []
-                    for k, v in d.items():
-                        lines.append('  ' * indent + k + ('/' if v else ''))
-                        if v:
-                            lines.extend(_format(v, indent+1))
-                    return lines
-                return '\n'.join(_format(root))
-            repo_tree_str = format_tree(repo_tree)
-            logger.info("[IntroChapter] Repository tree formatted successfully")
-            # Format scene mapping
-            logger.info("[IntroChapter] Formatting scene mapping for LLM prompt...")
-            explained_files = '\n'.join(f"- {f}: {', '.join(titles)}" for f, titles in file_to_scenes.items())
-            # Construct prompt for intro chapter
-            intro_prompt = f"""Repository structure:
+            with span("intro"):
+                intro_scenes = await self._generate_intro_scenes(github_url, files, file_to_scenes, messages)
+            final_script.scenes = intro_scenes + final_script.scenes
+            logger.info(f"[IntroChapter] Final script now has {len(final_script.scenes)} scenes")
+        else:
+            logger.info(f"[IntroChapter] DISABLED or not a directory (ENABLE_INTRO_CHAPTER={ENABLE_INTRO_CHAPTER}, is_directory={is_directory})")
+        
+        # Save to disk if requested
+        if save_to_disk:
+            with span("save"):
+                await self._save_script(final_script, github_url)
+        observe_stage("total", time.perf_counter() - started)
+        
+        logger.info(f"[ScriptGenerator] Script generation completed. Returning script with {len(final_script.scenes)} scenes")
+        return final_script
+
+    async def start_lazy_script(
+        self,
+        github_url: str,
+        proficiency: str = "beginner",
+        depth: str = "key-parts",
+        file_types: Optional[List[str]] = None
+    ) -> LazyScript:
+        """
+        Start a script in lazy mode: plan every chapter but only generate the first one.
+        
+        The initial script contains the intro chapter (if enabled), then a header
+        scene for every planned chapter, with chapter 1's scenes after its header.
+        Later chapters are generated on first access via generate_lazy_chapter.
+        
+        Args:
+            github_url: URL of the GitHub file or directory
+            proficiency: User's proficiency level
+            depth: Explanation depth
+            file_types: Optional list of file extensions to include
+            
+        Returns:
+            LazyScript holding the batch plan and the initial script
+        """
+        logger.info(f"[LazyChapters] Starting lazy script generation for {github_url}")
+        set_generation_labels(prompt_mode(), proficiency)
+        files, batches, skipped_files, batch_tokens = await self._fetch_and_plan(github_url, file_types)
+        lazy = LazyScript(github_url, proficiency, depth, batches, batch_tokens, files)
+        lazy.headers = [self._chapter_scene(idx, batch) for idx, batch in enumerate(batches)]
+        if skipped_files:
+            lazy.lead_scenes.append(self._skipped_scene(skipped_files))
+        if batches:
+            await self.generate_lazy_chapter(lazy, 1)
+        
+        ENABLE_INTRO_CHAPTER = os.environ.get("ENABLE_INTRO_CHAPTER", "false").lower() == "true"
+        if ENABLE_INTRO_CHAPTER and len(files) > 1:
+            # Only chapter 1 exists yet, so describe the rest of the plan by chapter
+            file_to_scenes = {
+                f['path']: [f"Chapter {idx+1}"] for idx, batch in enumerate(batches) for f in batch
+            }
+            messages = [dict(MARKDOWN_SYSTEM_MESSAGE)]
+            with span("intro"):
+                lazy.lead_scenes[:0] = await self._generate_intro_scenes(github_url, files, file_to_scenes, messages)
+        
+        logger.info(f"[LazyChapters] Initial script has {len(lazy.chapters.get(1, []))} chapter 1 scenes; {len(batches)} chapters planned")
+        return lazy
+
+    async def generate_lazy_chapter(self, lazy: LazyScript, number: int) -> List[Scene]:
+        """
+        Return the scenes of chapter `number` (1-based), generating them on first access.
+        Concurrent requests for the same chapter share a single generation.
+        A chapter that fails or comes back empty raises and is not cached, so
+        the next request for it generates it again.
+        """
+        if number in lazy.chapters:
+            return lazy.chapters[number]
+        async with lazy.lock_for(number):
+            if number in lazy.chapters:
+                return lazy.chapters[number]
+            logger.info(f"[LazyChapters] Generating chapter {number}/{lazy.chapter_count} on demand")
+            set_job_cost(lazy.batch_tokens[number - 1])
+            set_generation_labels(prompt_mode(), lazy.proficiency)
+            USE_JSON_SCRIPT_PROMPT = os.environ.get("USE_JSON_SCRIPT_PROMPT", "false").lower() == "true"
+            messages = [dict(MARKDOWN_SYSTEM_MESSAGE)]
+            script = await self._generate_batch_script(
+                lazy.batches[number - 1], lazy.proficiency, lazy.depth, messages, number - 1, USE_JSON_SCRIPT_PROMPT
+            )
+            if not script.scenes:
+                # Batch failures come back as empty scripts; caching one would serve the empty chapter for good
+                raise RuntimeError(f"Chapter {number} produced no scenes")
+            for scene_idx, scene in enumerate(script.scenes, start=1):
+                scene.title = f"Scene {number}.{scene_idx}: {re.sub(r'^Scene [0-9.]+: ', '', scene.title)}"
+            lazy.chapters[number] = script.scenes
+            return script.scenes
+
+    async def _fetch_and_plan(self, github_url: str, file_types: Optional[List[str]]):
+        """Fetch the files and split them into token-bounded batches."""
+        # Fetch code from GitHub
+        with span("fetch"):
+            files = await self.github_service.fetch_code(github_url, file_types)
+        logger.info(f"[ScriptGenerator] Fetched {len(files)} files from GitHub")
+        
+        with span("tokenize"):
+            token_counts = await self._count_tokens(files)
+        with span("batch"):
+            batches, skipped_files, batch_tokens = plan_batches(files, token_counts)
+        if skipped_files:
+            skipped_files_total.inc(*generation_labels(), amount=len(skipped_files))
+        logger.info(f"[ScriptGenerator] Created {len(batches)} batches for processing")
+        return files, batches, skipped_files, batch_tokens
+
+    async def _count_tokens(self, files: List[Dict]) -> List[int]:
+        """Token count of each file, from the blob-SHA cache where possible."""
+        counts = [token_count_cache.get(f.get('sha')) for f in files]
+        missing = [i for i, count in enumerate(counts) if count is None]
+        record_cache("token_count", len(files) - len(missing), len(missing))
+        if missing:
+            # Tokenize in the offload pool; this is pure CPU work
+            fresh = await run_in_pool("tokenize", count_tokens, [files[i]['content'] for i in missing])
+            for i, count in zip(missing, fresh):
+                counts[i] = count
+                token_count_cache.put(files[i].get('sha'), count)
+        return counts
+
+    async def estimate_generation(
+        self,
+        github_url: str,
+        file_types: Optional[List[str]] = None,
+        lazy: bool = False
+    ) -> Dict:
+        """
+        Plan a generation without fetching file contents or calling the LLM.
+        
+        Files come from one tree request; token counts come from the cache,
+        or are estimated from file size for files not tokenized before. The
+        batches are planned exactly as generate_script_from_url plans them.
+        
+        Args:
+            github_url: URL of the GitHub file or directory
+            file_types: Optional list of file extensions to include
+            lazy: Estimate the initial response of lazy mode rather than the full script
+            
+        Returns:
+            Dict with the file count, skipped files, batch plan, token totals,
+            predicted LLM calls and a breakdown of the expected wall-clock time
+        """
+        entries = await run_in_pool("file_entries", self.github_service.get_file_entries, github_url, file_types, io=True)
+        cached = [token_count_cache.get(e['sha']) for e in entries]
+        token_counts = [
+            count if count is not None else estimate_tokens_from_size(e['size'])
+            for e, count in zip(entries, cached)
+        ]
+        batches, skipped_files, batch_tokens = plan_batches(entries, token_counts)
+        
+        intro = os.environ.get("ENABLE_INTRO_CHAPTER", "false").lower() == "true" and len(entries) > 1
+        generated_batches = min(1, len(batches)) if lazy else len(batches)
+        llm_calls = generated_batches + (1 if intro else 0)
+        if os.environ.get("MOCK_LLM_MODE", "false").lower() == "true":
+            # Mock mode returns a stored script without calling the LLM or pausing
+            generated_batches = llm_calls = 0
+        # Rate-limit state shared by every LLM call in this process
+        call_seconds = llm_retry_engine.avg_call_seconds
+        limiter = llm_limiter.status()
+        queue_seconds = (limiter["in_flight"] + limiter["waiting"]) * call_seconds / max(1, limiter["capacity"])
+        seconds = {
+            "rate_limit_wait": round(llm_retry_engine.blocked_for(), 1),
+            "llm_queue_wait": round(queue_seconds, 1),
+            "llm_calls": round(llm_calls * call_seconds, 1),
+            "batch_pauses": BATCH_PAUSE_SECONDS * max(0, generated_batches - 1),
+        }
+        return {
+            "file_count": len(entries),
+            "skipped_files": skipped_files,
+            "batches": [
+                {"files": [f['path'] for f in batch], "tokens": tokens}
+                for batch, tokens in zip(batches, batch_tokens)
+            ],
+            "total_input_tokens": sum(batch_tokens),
+            "exact_token_counts": sum(1 for count in cached if count is not None),
+            "predicted_llm_calls": llm_calls,
+            "avg_llm_call_seconds": round(call_seconds, 1),
+            "llm_available": llm_retry_engine.breaker.state != CircuitBreaker.OPEN,
+            "expected_seconds": round(sum(seconds.values()), 1),
+            "expected_seconds_breakdown": seconds,
+        }
+
+    def _chapter_scene(self, idx: int, batch: List[Dict]) -> Scene:
+        """Header scene listing the files of a chapter."""
+        return Scene(
+            title=f"Chapter {idx+1}: Files in this chapter",
+            duration=5,
+            content="This chapter covers the following files:\n" + "\n".join([f['path'] for f in batch]),
+            code_highlights=[]
+        )
+
+    def _skipped_scene(self, skipped_files: List[str]) -> Scene:
+        return Scene(
+            title="Skipped Files",
+            duration=10,
+            content="The following files were skipped because they were too large to process in a single request:\n" + "\n".join(skipped_files),
+            code_highlights=[]
+        )
+
+    async def _generate_batch_script(self, batch, proficiency, depth, messages, idx, use_json: bool) -> Script:
+        """Generate the scenes for one batch, falling back to the Markdown path if the JSON path fails."""
+        # Check if we should use the new JSON path
+        if use_json:
+            logger.info(f"[ScriptGenerator] Using NEW JSON path for batch {idx+1}")
+            try:
+                # Use the new LLMService.generate_script method
+                script = await self.llm_service.generate_script(batch, proficiency, depth)
+                logger.info(f"[ScriptGenerator] JSON path returned: {type(script)}")
+                if isinstance(script, dict):
+                    logger.info(f"[ScriptGenerator] JSON response has {len(script.get('chapters', []))} chapters")
+                    # Use the new from_json_response method
+                    # Locating each highlight's lines in the batch sources is CPU work
+                    with span("parse"):
+                        script = await run_in_pool("locate_lines", Script.from_json_response, script, batch)
+                    logger.info(f"[ScriptGenerator] Converted JSON to Script with {len(script.scenes)} scenes")
+                else:
+                    logger.info(f"[ScriptGenerator] JSON path returned Script object with {len(script.scenes)} scenes")
+                return script
+            except Exception as e:
+                logger.error(f"[ScriptGenerator] Error in JSON path for batch {idx+1}: {e}")
+                # Fall back to old path
+                logger.info(f"[ScriptGenerator] Falling back to old Markdown path for batch {idx+1}")
+                return await self._process_batch_old_way(batch, proficiency, depth, messages, idx)
+        logger.info(f"[ScriptGenerator] Using OLD Markdown path for batch {idx+1}")
+        return await self._process_batch_old_way(batch, proficiency, depth, messages, idx)
+
+    async def _generate_intro_scenes(self, github_url: str, files: List[Dict], file_to_scenes: Dict[str, List[str]], messages: List[Dict]) -> List[Scene]:
+        """Generate the repo overview intro scenes in the given chat history; returns [] on failure."""
+        # Fetch repo tree
+        logger.info("[IntroChapter] Fetching repository tree structure...")
+        repo_tree = await run_in_pool("repo_tree", self.github_service.get_repo_tree, github_url, io=True)
+        logger.info(f"[IntroChapter] Retrieved {len(repo_tree)} files/directories in repo tree")
+        # Summarise the repo tree within the token budget, keeping explained files expanded
+        logger.info("[IntroChapter] Summarising repository tree structure...")
+        explained_paths = list(file_to_scenes) + [f['path'] for f in files]
+        repo_tree_str = await run_in_pool("summarize_tree", summarize_tree, repo_tree, explained_paths)
+        logger.info(f"[IntroChapter] Repository tree summarised in {len(repo_tree_str.splitlines())} lines")
+        # Format scene mapping
+        logger.info("[IntroChapter] Formatting scene mapping for LLM prompt...")
+        explained_files = '\n'.join(f"- {f}: {', '.join(titles)}" for f, titles in file_to_scenes.items())
+        # Construct prompt for intro chapter
+        intro_prompt = f"""Repository structure:
 {repo_tree_str}
 
 Files explained in detail:
@@ -245,35 +470,27 @@ If a file was not covered in detail, make an educated guess based on its name an
 Summarize how the files relate to each other and the overall architecture.
 
 Format your answer as a list of scenes, each with a title, duration, and content."""
-            messages.append({"role": "user", "content": intro_prompt})
-            logger.info("[IntroChapter] Sending prompt to LLM for intro chapter generation (in chat history)...")
-            try:
-                async def llm_intro_call():
-                    return await self.llm_service.client.chat.completions.create(
-                        model="gpt-4o",
-                        messages=messages,
-                        temperature=0.5,
-                    )
+        messages.append({"role": "user", "content": intro_prompt})
+        logger.info("[IntroChapter] Sending prompt to LLM for intro chapter generation (in chat history)...")
+        try:
+            async def llm_intro_call():
+                return await self.llm_service.client.chat.completions.create(
+                    model="gpt-4o",
+                    messages=messages,
+                    temperature=0.5,
+                )
 
-                intro_response = await call_llm_with_retries(llm_intro_call)
-                logger.info("[IntroChapter] Received response from LLM, parsing intro scenes...")
-                intro_scenes = self.llm_service._parse_response(
-                    intro_response.choices[0].message.content, files
-                ).scenes
-                logger.info(f"[IntroChapter] Generated {len(intro_scenes)} intro scenes")
-                final_script.scenes = intro_scenes + final_script.scenes
-                logger.info(f"[IntroChapter] Final script now has {len(final_script.scenes)} scenes")
-            except Exception as e:
-                logger.error(f"[IntroChapter] Error generating intro chapter: {e}. Skipping intro chapter.")
-        else:
-            logger.info(f"[IntroChapter] DISABLED or not a directory (ENABLE_INTRO_CHAPTER={ENABLE_INTRO_CHAPTER}, is_directory={is_directory})")
-        
-        # Save to disk if requested
-        if save_to_disk:
-            self._save_script(final_script, github_url)
-        
-        logger.info(f"[ScriptGenerator] Script generation completed. Returning script with {len(final_script.scenes)} scenes")
-        return final_script
+            intro_response = await call_llm_with_retries(llm_intro_call, semaphore=llm_limiter)
+            logger.info("[IntroChapter] Received response from LLM, parsing intro scenes...")
+            with span("parse"):
+                intro_script = await run_in_pool(
+                    "parse", parse_markdown_script, intro_response.choices[0].message.content, files
+                )
+            logger.info(f"[IntroChapter] Generated {len(intro_script.scenes)} intro scenes")
+            return intro_script.scenes
+        except Exception as e:
+            logger.error(f"[IntroChapter] Error generating intro chapter: {e}. Skipping intro chapter.")
+            return []
 
     async def _process_batch_old_way(self, batch, proficiency, depth, messages, idx):
         """Process a batch using the old Markdown-based approach."""
@@ -288,16 +505,16 @@ Format your answer as a list of scenes, each with a title, duration, and content
                     messages=messages,
                     temperature=0.7
                 )
-            response = await call_llm_with_retries(llm_batch_call)
+            response = await call_llm_with_retries(llm_batch_call, semaphore=llm_limiter)
             batch_response = response.choices[0].message.content
             messages.append({"role": "assistant", "content": batch_response})
-            script = self.llm_service._parse_response(batch_response, batch)
+            with span("parse"):
+                script = await run_in_pool("parse", parse_markdown_script, batch_response, batch, line_ranges_enabled())
             logger.info(f"[ScriptGenerator] Old Markdown approach returned {len(script.scenes)} scenes")
             return script
         except Exception as e:
             logger.error(f"[Batching] Error processing chapter {idx+1}: {e}. Skipping chapter.")
             # Return empty script
-            from ..models.script import Script
             return Script(scenes=[])
     
     async def _generate_mock_script(self, github_url: str, save_to_disk: bool = True) -> Script:
@@ -318,127 +535,31 @@ Format your answer as a list of scenes, each with a title, duration, and content
         
         logger.info(f"[MockLLM] Generating mock script for URL: {github_url}")
         
-        # Determine which script file to load based on the URL
-        script_path = "test_output/src_script.md"  # default
-        
-        # Try to find a more specific script file based on the URL
-        if "App.tsx" in github_url:
-            script_path = "test_output/App.tsx_script.md"
-        elif "setcharacters.js" in github_url:
-            script_path = "test_output/setcharacters.js_script.md"
-        elif "MyActivity.java" in github_url:
-            script_path = "test_output/MyActivity.java_script.md"
-        elif "ExpertSingleFileTest" in github_url:
-            script_path = "test_output/ExpertSingleFileTest.md"
-        
+        script_path = mock_script_path(github_url)
         logger.info(f"[MockLLM] Loading script from: {script_path}")
         
         try:
-            # Read the existing script file
-            with open(script_path, "r", encoding="utf-8") as f:
-                script_content = f.read()
-            
-            logger.info(f"[MockLLM] Successfully loaded script file ({len(script_content)} characters)")
-            
-            # Parse the markdown content into a Script object using the LLMService parser
-            # Create a dummy files list for parsing
-            dummy_files = [{"path": "mock_file.md", "content": script_content}]
-            script = self.llm_service._parse_response(script_content, dummy_files)
-            logger.info(f"[MockLLM] Successfully parsed script with {len(script.scenes)} scenes")
-            logger.info("[MockLLM] Scene titles:")
-            for scene in script.scenes:
-                logger.info(f"  - {scene.title}")
-            
+            # Parsed scripts are cached and only re-parsed when the file changes
+            script = await parsed_script_cache.load(script_path, parse_mock_script_file)
+            logger.info(f"[MockLLM] Loaded script with {len(script.scenes)} scenes")
             return script
                 
         except Exception as e:
             logger.error(f"[MockLLM] Error loading or parsing script: {e}")
             raise RuntimeError(f"Failed to load mock script: {e}")
     
-    def _save_script(self, script: Script, github_url: str) -> None:
-        """Save the script to disk in Markdown format."""
-        # Create test_output directory if it doesn't exist
-        output_dir = Path("test_output")
-        output_dir.mkdir(exist_ok=True)
-        
+    async def _save_script(self, script: Script, github_url: str) -> None:
+        """Queue the script to be saved to disk in Markdown format."""
         # Generate filename from GitHub URL
         filename = github_url.split("/")[-1].replace("/", "_")
-        output_path = output_dir / f"{filename}_script.md"
+        output_path = artifact_sink.directory / f"{filename}_script.md"
         
         logger.info(f"[SaveScript] Saving script to {output_path}")
         logger.info(f"[SaveScript] Script contains {len(script.scenes)} scenes")
-        logger.info("[SaveScript] Scene titles:")
-        for scene in script.scenes:
-            logger.info(f"  - {scene.title}")
-        
-        # Save the script
-        with open(output_path, "w") as f:
-            f.write(script.to_markdown())
-        logger.info("[SaveScript] Script saved successfully")
-
-async def call_llm_with_retries(llm_call, *args, max_retries=3, base_delay=30, **kwargs):
-    """
-    Call an LLM function with retry logic for rate limiting and other transient errors.
-    Uses a global semaphore to ensure only one LLM call happens at a time.
-    
-    Args:
-        llm_call: Async function to call
-        *args: Arguments to pass to llm_call
-        max_retries: Maximum number of retry attempts
-        base_delay: Base delay in seconds for exponential backoff if headers are not available
-        **kwargs: Keyword arguments to pass to llm_call
-        
-    Returns:
-        Result from llm_call
+        if logger.isEnabledFor(logging.DEBUG):
+            for scene in script.scenes:
+                logger.debug("[SaveScript]   - %s", scene.title, extra=SAMPLED)
         
-    Raises:
-        RuntimeError: If max retries exceeded
-        Exception: Original exception if not a retryable error
-    """
-    async with llm_semaphore:  # Ensure only one LLM call at a time
-        for attempt in range(max_retries):
-            try:
-                logger.info(f"[Throttling] Making LLM call (attempt {attempt+1}/{max_retries})...")
-                return await llm_call(*args, **kwargs)
-            except openai.RateLimitError as e:
-                headers = e.response.headers
-                logger.warning("[Throttling] OpenAI Rate Limit Error (429). Headers:")
-                logger.warning(f"  - Limit Requests: {headers.get('x-ratelimit-limit-requests')}")
-                logger.warning(f"  - Remaining Requests: {headers.get('x-ratelimit-remaining-requests')}")
-                logger.warning(f"  - Reset Requests: {headers.get('x-ratelimit-reset-requests')}")
-
-                reset_time_str = headers.get('x-ratelimit-reset-requests')
-                
-                # Use the reset time from the header if available, otherwise use exponential backoff with a 30s base
-                if reset_time_str:
-                    try:
-                        if reset_time_str.endswith('ms'):
-                            wait_time = float(reset_time_str.replace('ms', '')) / 1000.0
-                        else:
-                            wait_time = float(reset_time_str.replace('s', ''))
-                        wait_time += 0.1  # Add a small buffer
-                        logger.warning(f"[Throttling] Rate limit exceeded. Waiting for {wait_time:.2f} seconds based on 'x-ratelimit-reset-requests'.")
-                    except (ValueError, AttributeError):
-                        wait_time = base_delay * (2 ** attempt)
-                        logger.warning(f"[Throttling] Could not parse reset time '{reset_time_str}'. Falling back to exponential backoff: {wait_time}s.")
-                else:
-                    wait_time = base_delay * (2 ** attempt)
-                    logger.warning(f"[Throttling] No reset time in header. Falling back to exponential backoff: {wait_time}s.")
-
-                await asyncio.sleep(wait_time)
-
-            except Exception as e:
-                # Fallback for other retryable errors
-                if hasattr(e, 'status_code') and e.status_code >= 500:
-                    wait_time = base_delay * (2 ** attempt)
-                    logger.warning(f"[Throttling] Server error {e.status_code}. Retrying in {wait_time} seconds (attempt {attempt+1}/{max_retries})...")
-                    await asyncio.sleep(wait_time)
-                elif "timeout" in str(e).lower() or "connection" in str(e).lower():
-                    wait_time = base_delay * (2 ** attempt)
-                    logger.warning(f"[Throttling] Connection/timeout error: {e}. Retrying in {wait_time} seconds (attempt {attempt+1}/{max_retries})...")
-                    await asyncio.sleep(wait_time)
-                else:
-                    # Non-retryable error, re-raise immediately
-                    logger.error(f"[Throttling] Non-retryable error on attempt {attempt+1}: {e}")
-                    raise
-    raise RuntimeError(f"Exceeded maximum retries ({max_retries}) for LLM call due to repeated errors.") 
\ No newline at end of file
+        # Rendered scene by scene and written atomically by the background artifact writer
+        if artifact_sink.save_file(output_path, script.iter_markdown()):
+            logger.info("[SaveScript] Script queued for saving")
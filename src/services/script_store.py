@@ -0,0 +1,354 @@
+"""
+In-memory store of generated scripts in a compact, deduplicated form.
+
+Scripts never change once stored. Each one is kept as tuples of slotted
+records rather than pydantic models:
+
+- file paths are interned, so every highlight of a file shares one string
+- highlight code that matches its line range is held as a reference into a
+  shared table of source blobs (one copy of each file's content)
+- a highlight description equal to its scene's content is held once
+
+The public `Script` model is only rebuilt when a script is serialized or
+read. Serialized responses are kept in a bounded LRU with a strong ETag, so
+repeat reads of hot scripts still never touch pydantic. A per-script chapter
+index lets outlines and scene windows be served without expanding the rest.
+
+Cached bodies and large source blobs are compressed at rest with the codec
+chosen by AT_REST_COMPRESSION; a body is sent still compressed to clients that
+accept its encoding.
+
+Configuration:
+    SCRIPT_STORE_BODY_CACHE_MB: Size of the serialized-response LRU (default 32)
+"""
+from array import array
+from collections import OrderedDict
+from itertools import accumulate
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple, Union
+import hashlib
+import os
+import re
+import sys
+import threading
+import weakref
+from ..models.script import CodeHighlight, Scene, Script
+from .compression import AT_REST_CODEC, decompress, negotiate, strip_etag_encoding
+from .offload import run_in_pool
+
+# Stored scripts are immutable, so clients and proxies may cache them indefinitely
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+BODY_CACHE_BYTES = int(float(os.environ.get("SCRIPT_STORE_BODY_CACHE_MB", "32")) * 1024 * 1024)
+SCENE_FIELDS = frozenset({"title", "duration", "content", "code_highlights"})
+# Header scenes inserted by the generator start a chapter
+_CHAPTER_TITLE = re.compile(r"^Chapter \d+: ")
+
+
+# Blobs at least this large are kept compressed
+BLOB_COMPRESS_MIN_CHARS = 4096
+# Decompressed blob contents kept around for repeated line lookups
+_BLOB_TEXT_CACHE_SIZE = 16
+_blob_texts: "OrderedDict[SourceBlob, str]" = OrderedDict()
+_blob_texts_lock = threading.Lock()
+
+
+class SourceBlob:
+    """One file's content with line start offsets, shared by every highlight into it."""
+    __slots__ = ("path", "_text", "_packed", "offsets", "__weakref__")
+
+    def __init__(self, path: str, content: str):
+        self.path = path
+        # offsets[i] is where line i+1 starts; the final entry is len(content)
+        self.offsets = array("L", accumulate((len(line) for line in content.splitlines(True)), initial=0))
+        if AT_REST_CODEC is not None and len(content) >= BLOB_COMPRESS_MIN_CHARS:
+            self._text, self._packed = None, AT_REST_CODEC.compress(content.encode("utf-8", "surrogatepass"))
+        else:
+            self._text, self._packed = content, None
+
+    @property
+    def content(self) -> str:
+        if self._text is not None:
+            return self._text
+        with _blob_texts_lock:
+            text = _blob_texts.get(self)
+            if text is not None:
+                _blob_texts.move_to_end(self)
+                return text
+        text = AT_REST_CODEC.decompress(self._packed).decode("utf-8", "surrogatepass")
+        with _blob_texts_lock:
+            _blob_texts[self] = text
+            while len(_blob_texts) > _BLOB_TEXT_CACHE_SIZE:
+                _blob_texts.popitem(last=False)
+        return text
+
+    def lines(self, start_line: int, end_line: int) -> str:
+        """Lines start_line..end_line (1-based, inclusive) joined with newlines."""
+        last = len(self.offsets) - 1
+        start, end = max(start_line - 1, 0), min(end_line, last)
+        if start >= end:
+            return ""
+        return "\n".join(self.content[self.offsets[start]:self.offsets[end]].splitlines())
+
+
+# Shared by all stored scripts; a blob is freed once no stored highlight references it
+_source_table: "weakref.WeakValueDictionary[Tuple[str, str], SourceBlob]" = weakref.WeakValueDictionary()
+
+
+def _source_blob(path: str, content: str) -> SourceBlob:
+    key = (path, hashlib.sha1(content.encode("utf-8", "surrogatepass")).hexdigest())
+    blob = _source_table.get(key)
+    if blob is None:
+        blob = _source_table[key] = SourceBlob(path, content)
+    return blob
+
+
+class CompactHighlight:
+    """A code highlight whose code is a source reference when it matches the file's lines."""
+    __slots__ = ("file_path", "start_line", "end_line", "description", "code")
+
+    def __init__(self, file_path: str, start_line: int, end_line: int,
+                 description: Optional[str], code: Union[str, SourceBlob]):
+        self.file_path = file_path
+        self.start_line = start_line
+        self.end_line = end_line
+        # None means "same as the scene content"
+        self.description = description
+        self.code = code
+
+    def expand(self, scene_content: str) -> CodeHighlight:
+        code = self.code.lines(self.start_line, self.end_line) if isinstance(self.code, SourceBlob) else self.code
+        return CodeHighlight.model_construct(
+            file_path=self.file_path,
+            start_line=self.start_line,
+            end_line=self.end_line,
+            description=scene_content if self.description is None else self.description,
+            code=code
+        )
+
+
+class CompactScene:
+    __slots__ = ("title", "duration", "content", "highlights")
+
+    def __init__(self, title: str, duration: int, content: str, highlights: Tuple[CompactHighlight, ...]):
+        self.title = title
+        self.duration = duration
+        self.content = content
+        self.highlights = highlights
+
+    def expand(self) -> Scene:
+        return Scene.model_construct(
+            title=self.title,
+            duration=self.duration,
+            content=self.content,
+            code_highlights=[h.expand(self.content) for h in self.highlights]
+        )
+
+
+def compact_script(script: Script) -> Tuple[CompactScene, ...]:
+    """Convert a Script to its compact stored form."""
+    sources = script.sources
+    blobs: Dict[str, SourceBlob] = {}
+    scenes = []
+    for scene in script.scenes:
+        highlights = []
+        for h in scene.code_highlights:
+            path = sys.intern(h.file_path)
+            code: Union[str, SourceBlob] = h.code
+            if h.code and path in sources:
+                blob = blobs.get(path)
+                if blob is None:
+                    blob = blobs[path] = _source_blob(path, sources[path])
+                if blob.lines(h.start_line, h.end_line) == h.code:
+                    code = blob
+            description = None if h.description == scene.content else h.description
+            highlights.append(CompactHighlight(path, h.start_line, h.end_line, description, code))
+        scenes.append(CompactScene(scene.title, scene.duration, scene.content, tuple(highlights)))
+    return tuple(scenes)
+
+
+def expand_script(scenes: Tuple[CompactScene, ...]) -> Script:
+    """Rebuild the public Script model from its compact form."""
+    return Script.model_construct(scenes=[scene.expand() for scene in scenes])
+
+
+def _pack(body: bytes) -> bytes:
+    return AT_REST_CODEC.compress(body) if AT_REST_CODEC is not None else body
+
+
+def _serialize(script: Script) -> Tuple[str, bytes]:
+    """Return the ETag and the at-rest form of the script's JSON body."""
+    # pydantic-core writes JSON straight from the model without building dicts first
+    body = script.model_dump_json().encode("utf-8")
+    return f'"{hashlib.sha256(body).hexdigest()[:32]}"', _pack(body)
+
+
+def _expand_and_serialize(scenes: Tuple[CompactScene, ...]) -> bytes:
+    return _pack(expand_script(scenes).model_dump_json().encode("utf-8"))
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """True if an If-None-Match header value matches `etag` (weak comparison, any content coding)."""
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or any(strip_etag_encoding(tag.removeprefix("W/")) == etag for tag in tags)
+
+
+class ChapterSpan:
+    """A run of consecutive scenes that belong to one chapter."""
+    __slots__ = ("number", "title", "start", "count", "duration")
+
+    def __init__(self, number: int, title: str, start: int):
+        self.number = number
+        self.title = title
+        self.start = start
+        self.count = 0
+        self.duration = 0
+
+
+def _chapter_spans(scenes: Tuple[CompactScene, ...]) -> Tuple[ChapterSpan, ...]:
+    """Group scenes into chapters at each "Chapter N: " header; earlier scenes form chapter 0, the introduction."""
+    spans: List[ChapterSpan] = []
+    headers = 0
+    for idx, scene in enumerate(scenes):
+        if _CHAPTER_TITLE.match(scene.title):
+            headers += 1
+            spans.append(ChapterSpan(headers, scene.title, idx))
+        elif not spans:
+            spans.append(ChapterSpan(0, "Introduction", idx))
+        spans[-1].count += 1
+        spans[-1].duration += scene.duration
+    return tuple(spans)
+
+
+def _scene_chapters(spans: Tuple[ChapterSpan, ...]) -> array:
+    """Chapter number of every scene, for looking it up by index."""
+    numbers = array("H")
+    for span in spans:
+        numbers.extend([span.number] * span.count)
+    return numbers
+
+
+def scene_dict(scene: CompactScene, fields: FrozenSet[str] = SCENE_FIELDS, include_code: bool = True) -> Dict[str, Any]:
+    """JSON-ready dict of a stored scene with only the requested fields, without building models."""
+    out: Dict[str, Any] = {}
+    if "title" in fields:
+        out["title"] = scene.title
+    if "duration" in fields:
+        out["duration"] = scene.duration
+    if "content" in fields:
+        out["content"] = scene.content
+    if "code_highlights" in fields:
+        highlights = []
+        for h in scene.highlights:
+            item = {
+                "file_path": h.file_path,
+                "start_line": h.start_line,
+                "end_line": h.end_line,
+                "description": scene.content if h.description is None else h.description,
+            }
+            if include_code:
+                item["code"] = h.code.lines(h.start_line, h.end_line) if isinstance(h.code, SourceBlob) else h.code
+            highlights.append(item)
+        out["code_highlights"] = highlights
+    return out
+
+
+class StoredScript:
+    """A stored script in compact form with its chapter index and the ETag of its serialized JSON."""
+    __slots__ = ("scenes", "etag", "chapters", "scene_chapters", "total_duration")
+
+    def __init__(self, scenes: Tuple[CompactScene, ...], etag: str):
+        self.scenes = scenes
+        self.etag = etag
+        self.chapters = _chapter_spans(scenes)
+        self.scene_chapters = _scene_chapters(self.chapters)
+        self.total_duration = sum(span.duration for span in self.chapters)
+
+    def matches(self, if_none_match: Optional[str]) -> bool:
+        return etag_matches(if_none_match, self.etag)
+
+    def outline(self) -> Dict[str, Any]:
+        """Chapter and scene titles with durations and scene indexes."""
+        return {
+            "scene_count": len(self.scenes),
+            "total_duration": self.total_duration,
+            "chapters": [
+                {"number": c.number, "title": c.title, "start": c.start, "count": c.count, "duration": c.duration}
+                for c in self.chapters
+            ],
+            "scenes": [
+                {"index": idx, "title": scene.title, "duration": scene.duration, "chapter": self.scene_chapters[idx]}
+                for idx, scene in enumerate(self.scenes)
+            ],
+        }
+
+    def window(self, offset: int, limit: int, fields: FrozenSet[str] = SCENE_FIELDS, include_code: bool = True) -> List[Dict[str, Any]]:
+        """Scenes offset..offset+limit as dicts; only those scenes are touched."""
+        return [scene_dict(scene, fields, include_code) for scene in self.scenes[offset:offset + limit]]
+
+
+class ScriptStore:
+    """Scripts by ID in compact form, with an LRU of their serialized (at-rest encoded) response bodies."""
+
+    def __init__(self, body_cache_bytes: int = BODY_CACHE_BYTES):
+        self._entries: Dict[str, StoredScript] = {}
+        self._bodies: "OrderedDict[str, bytes]" = OrderedDict()
+        self._body_bytes = 0
+        self.body_cache_bytes = body_cache_bytes
+
+    async def put(self, script_id: str, script: Script) -> StoredScript:
+        """Serialize `script` in the offload pool and store it in compact form under `script_id`."""
+        etag, body = await run_in_pool("serialize_script", _serialize, script)
+        # Compacting shares blobs through the source table, so it stays on this thread
+        entry = StoredScript(compact_script(script), etag)
+        self._entries[script_id] = entry
+        self._remember_body(script_id, body)
+        return entry
+
+    def get(self, script_id: str) -> Optional[Script]:
+        entry = self._entries.get(script_id)
+        return expand_script(entry.scenes) if entry else None
+
+    def get_entry(self, script_id: str) -> Optional[StoredScript]:
+        return self._entries.get(script_id)
+
+    async def body(self, script_id: str, accept_encoding: Optional[str] = None) -> Optional[Tuple[bytes, Optional[str]]]:
+        """
+        Serialized JSON for a stored script, from the LRU or rebuilt from the compact form.
+
+        Returns:
+            The body and its content coding: still compressed if the client's
+            Accept-Encoding allows the at-rest codec, otherwise decompressed (None)
+        """
+        body = self._bodies.get(script_id)
+        if body is not None:
+            self._bodies.move_to_end(script_id)
+        else:
+            entry = self._entries.get(script_id)
+            if entry is None:
+                return None
+            body = await run_in_pool("serialize_script", _expand_and_serialize, entry.scenes)
+            self._remember_body(script_id, body)
+        if AT_REST_CODEC is None:
+            return body, None
+        if negotiate(accept_encoding, [AT_REST_CODEC.name]):
+            return body, AT_REST_CODEC.name
+        return await run_in_pool("decompress_body", decompress, body, AT_REST_CODEC.name), None
+
+    def _remember_body(self, script_id: str, body: bytes) -> None:
+        if len(body) > self.body_cache_bytes:
+            return
+        old = self._bodies.pop(script_id, None)
+        if old is not None:
+            self._body_bytes -= len(old)
+        self._bodies[script_id] = body
+        self._body_bytes += len(body)
+        while self._body_bytes > self.body_cache_bytes:
+            _, evicted = self._bodies.popitem(last=False)
+            self._body_bytes -= len(evicted)
+
+    def __contains__(self, script_id: str) -> bool:
+        return script_id in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,51 @@
+"""
+Token counts of fetched files, keyed by git blob SHA.
+
+A blob SHA identifies exact file content, so a count stays valid for as
+long as it is kept and is shared across repositories, branches and paths.
+Generation fills the cache as it tokenizes files; the estimate endpoint
+reads it to plan batches without downloading anything.
+
+Configuration:
+    TOKEN_CACHE_ENTRIES: Maximum number of cached counts (default 200000)
+"""
+from collections import OrderedDict
+from typing import Optional
+import os
+
+# Typical bytes per GPT-4 token in source code, for files with no cached count
+BYTES_PER_TOKEN = 4
+
+
+class TokenCountCache:
+    """LRU map of blob SHA to token count."""
+
+    def __init__(self, max_entries: int = 200000):
+        self.max_entries = max_entries
+        self._counts: "OrderedDict[str, int]" = OrderedDict()
+
+    def get(self, sha: Optional[str]) -> Optional[int]:
+        if sha is None:
+            return None
+        count = self._counts.get(sha)
+        if count is not None:
+            self._counts.move_to_end(sha)
+        return count
+
+    def put(self, sha: Optional[str], count: int) -> None:
+        if sha is None:
+            return
+        self._counts[sha] = count
+        self._counts.move_to_end(sha)
+        while len(self._counts) > self.max_entries:
+            self._counts.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._counts)
+
+
+def estimate_tokens_from_size(size: int) -> int:
+    return (size + BYTES_PER_TOKEN - 1) // BYTES_PER_TOKEN
+
+
+token_count_cache = TokenCountCache(int(os.environ.get("TOKEN_CACHE_ENTRIES", "200000")))
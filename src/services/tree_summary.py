@@ -0,0 +1,235 @@
+"""
+Repository tree summaries that fit a token budget.
+
+The intro chapter prompt describes the repository structure. Listing every
+path from `get_repo_tree` makes that prompt huge on monorepos, so the tree is
+rendered at the depth and per-directory width that show the most within the
+budget: directories past that depth, and entries past that width, are
+collapsed into file counts with an extension histogram. Explained files and entry points (README,
+main modules, manifests near the root) are always listed with their parent
+directories.
+
+Configuration:
+    INTRO_TREE_TOKEN_BUDGET: Approximate token budget for the tree (default 3000)
+"""
+from collections import Counter
+from typing import AbstractSet, Dict, Iterable, List, Optional, Set, Tuple
+import os
+
+TREE_TOKEN_BUDGET = int(os.environ.get("INTRO_TREE_TOKEN_BUDGET", "3000"))
+# Entries listed per directory, tried from widest to narrowest
+ENTRY_LIMITS = (200, 50, 20, 8, 3)
+# Entry points deeper than this many directories are not pinned
+ENTRY_POINT_MAX_DEPTH = 2
+ENTRY_POINT_NAMES = {
+    "readme", "readme.md", "readme.rst", "readme.txt", "main.py", "__main__.py", "app.py", "manage.py",
+    "setup.py", "pyproject.toml", "requirements.txt", "package.json", "index.js", "index.ts", "main.js",
+    "main.ts", "server.js", "main.go", "go.mod", "cargo.toml", "main.rs", "lib.rs", "pom.xml",
+    "build.gradle", "makefile", "dockerfile", "cmakelists.txt",
+}
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (about 4 characters per token for paths), used while fitting the budget."""
+    return len(text) // 4 + 1
+
+
+def _extension(name: str) -> str:
+    # Same as os.path.splitext: leading dots (".gitignore") do not start an extension
+    dot = name.rfind(".")
+    if dot <= 0 or name[:dot].strip(".") == "":
+        return "(no ext)"
+    return name[dot:].lower()
+
+
+def _histogram(extensions: Counter, top: int = 3) -> str:
+    # Ties by name, so the listing does not depend on path order
+    common = sorted(extensions.items(), key=lambda item: (-item[1], item[0]))[:top]
+    parts = [f"{ext} {count}" for ext, count in common]
+    rest = sum(extensions.values()) - sum(count for _, count in common)
+    if rest:
+        parts.append(f"other {rest}")
+    return ", ".join(parts)
+
+
+_NO_PINS: AbstractSet[str] = frozenset()
+
+
+class _Dir:
+    __slots__ = ("name", "dirs", "files", "file_count", "extensions", "pinned")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.dirs: Dict[str, "_Dir"] = {}
+        self.files: List[str] = []
+        self.file_count = 0
+        self.extensions: Counter  # summed by _build once the tree is complete
+        # Names of direct children that are or contain pinned paths; most directories have none
+        self.pinned: AbstractSet[str] = _NO_PINS
+
+    def pin(self, name: str) -> None:
+        if self.pinned is _NO_PINS:
+            self.pinned = set()
+        self.pinned.add(name)
+
+
+class _OverBudget(Exception):
+    pass
+
+
+def _build(paths: Iterable[str], pins: Set[str]) -> _Dir:
+    root = _Dir("")
+    for path in paths:
+        *parts, name = path.strip("/").split("/")
+        node = root
+        for part in parts:
+            child = node.dirs.get(part)
+            if child is None:
+                child = node.dirs[part] = _Dir(part)
+            node = child
+        node.files.append(name)
+    # File counts and extensions are summed once per directory, children before parents
+    order = [root]
+    for node in order:
+        order.extend(node.dirs.values())
+    for node in reversed(order):
+        node.file_count += len(node.files)
+        extensions = Counter(map(_extension, node.files))
+        for child in node.dirs.values():
+            node.file_count += child.file_count
+            extensions.update(child.extensions)
+        node.extensions = extensions
+    for path in pins:
+        *parts, name = path.strip("/").split("/")
+        node = root
+        for part in parts:
+            node.pin(part)
+            node = node.dirs[part]
+        node.pin(name)
+    return root
+
+
+class _Renderer:
+    def __init__(self, max_depth: int, entry_limit: int, budget: Optional[int], keep_lines: bool = True):
+        self.max_depth = max_depth
+        self.entry_limit = entry_limit
+        self.budget = budget
+        self.tokens = 0
+        # None while only measuring a candidate shape
+        self.lines: Optional[List[str]] = [] if keep_lines else None
+
+    def emit(self, line: str) -> None:
+        self.tokens += estimate_tokens(line)
+        if self.budget is not None and self.tokens > self.budget:
+            raise _OverBudget()
+        if self.lines is not None:
+            self.lines.append(line)
+
+    def render(self, node: _Dir, depth: int = 0) -> None:
+        indent = "  " * depth
+        expanded = depth < self.max_depth
+        dirs = sorted(node.dirs.values(), key=lambda d: -d.file_count)
+        if expanded:
+            # Pinned entries first, then the largest directories, then files
+            pinned_dirs = [d for d in dirs if d.name in node.pinned]
+            pinned_files = [f for f in node.files if f in node.pinned]
+            others = [d for d in dirs if d.name not in node.pinned] + [f for f in sorted(node.files) if f not in node.pinned]
+            room = max(0, self.entry_limit - len(pinned_dirs) - len(pinned_files))
+            shown = pinned_dirs + pinned_files + others[:room]
+        else:
+            shown = [d for d in dirs if d.name in node.pinned] + [f for f in node.files if f in node.pinned]
+
+        shown_dirs = sorted((e for e in shown if isinstance(e, _Dir)), key=lambda d: d.name)
+        shown_files = sorted(e for e in shown if isinstance(e, str))
+        remaining = Counter(node.extensions)
+        remaining_files = node.file_count
+        for child in shown_dirs:
+            remaining -= child.extensions
+            remaining_files -= child.file_count
+            if depth + 1 < self.max_depth or child.pinned:
+                self.emit(f"{indent}{child.name}/")
+                self.render(child, depth + 1)
+            else:
+                self.emit(f"{indent}{child.name}/ ({child.file_count} files: {_histogram(child.extensions)})")
+        for name in shown_files:
+            remaining[_extension(name)] -= 1
+            remaining_files -= 1
+            self.emit(f"{indent}{name}")
+        if remaining_files > 0:
+            hidden_dirs = len(node.dirs) - len(shown_dirs)
+            where = f" in {hidden_dirs} more directories" if hidden_dirs else ""
+            self.emit(f"{indent}... {remaining_files} more files{where} ({_histogram(+remaining)})")
+
+
+def _entry_points(paths: List[str]) -> Set[str]:
+    return {
+        path for path in paths
+        if path.count("/") <= ENTRY_POINT_MAX_DEPTH and path.rsplit("/", 1)[-1].lower() in ENTRY_POINT_NAMES
+    }
+
+
+def _depth(root: _Dir) -> int:
+    deepest = 0
+    stack = [(root, 1)]
+    while stack:
+        node, depth = stack.pop()
+        deepest = max(deepest, depth)
+        stack.extend((child, depth + 1) for child in node.dirs.values())
+    return deepest
+
+
+def _measure(root: _Dir, max_depth: int, entry_limit: int, budget: int) -> Optional[int]:
+    """Tokens of the tree rendered in this shape, or None if it goes over budget."""
+    renderer = _Renderer(max_depth, entry_limit, budget, keep_lines=False)
+    try:
+        renderer.render(root)
+    except _OverBudget:
+        return None
+    return renderer.tokens
+
+
+def _deepest_fit(root: _Dir, max_depth: int, entry_limit: int, budget: int) -> Optional[Tuple[int, int]]:
+    """(tokens, depth) of the deepest rendering with this entry limit that fits the budget."""
+    # Deeper renderings list more, so the deepest one that fits is found by bisection
+    found = None
+    low, high = 1, max_depth
+    while low <= high:
+        depth = (low + high) // 2
+        tokens = _measure(root, depth, entry_limit, budget)
+        if tokens is None:
+            high = depth - 1
+        else:
+            found = (tokens, depth)
+            low = depth + 1
+    return found
+
+
+def summarize_tree(paths: List[str], keep: Iterable[str] = (), token_budget: int = TREE_TOKEN_BUDGET) -> str:
+    """
+    Render repository paths as an indented tree that fits `token_budget`.
+
+    Args:
+        paths: File paths from the repository tree
+        keep: Paths that are always listed, e.g. the files explained in the script
+        token_budget: Approximate token budget for the rendered tree
+
+    Returns:
+        The tree listing; it only exceeds the budget if the kept paths alone do
+    """
+    pins = (set(keep) & set(paths)) | _entry_points(paths)
+    root = _build(paths, pins)
+    max_depth = _depth(root)
+    # Candidate shapes are only measured (each stops as soon as it goes over budget);
+    # the one that shows the most within the budget is then rendered
+    best: Optional[Tuple[int, int, int]] = None
+    for limit in ENTRY_LIMITS:
+        fit = _deepest_fit(root, max_depth, limit, token_budget)
+        if fit is not None and (best is None or fit[0] > best[0]):
+            best = (*fit, limit)
+    if best is None:
+        # Even the most collapsed form is too large; keep the pinned paths regardless
+        renderer = _Renderer(1, ENTRY_LIMITS[-1], None)
+    else:
+        renderer = _Renderer(best[1], best[2], None)
+    renderer.render(root)
+    return "\n".join(renderer.lines)